@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# bench_importtime.py
+# 起動時間の計測。python -X importtime で各モジュールの import にかかった時間を測り、
+# 重い依存（matplotlib / numpy / pyarrow）が収集・検索の経路で読み込まれていないことを確かめる
+# - 計測対象ごとに新しいプロセスを --repeat 回起動し、累積時間の中央値を使う
+# - --max-ms を超えた / 禁止モジュールが読み込まれた時は終了コード 1（CI で劣化を検出する用）
+# - 新しい DB への収集で禁止モジュールが読み込まれないことは tests/test_importtime.py が確かめる
+#
+# 使い方:
+#   python scripts/bench_importtime.py
+#   python scripts/bench_importtime.py --repeat 7 --top 15 --max-ms 300
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+COLLECTOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector")
+
+# (名前, 実行するコード, 読み込まれてはいけないモジュール)
+TARGETS = [
+    ("import civitai_collector_v8", "import civitai_collector_v8", ("matplotlib", "numpy", "pyarrow")),
+    ("cli --help", "import civitai_collector_v8 as m; m.build_parser().format_help()",
+     ("matplotlib", "numpy", "pyarrow")),
+    ("import main (prompts)", "import db, cleaner, collector", ("matplotlib", "numpy", "pyarrow")),
+    # pyarrow 自体が numpy を読むので、exporter は matplotlib だけを見る
+    ("import exporter", "import exporter", ("matplotlib",)),
+]
+
+
+def run_importtime(code):
+    """-X importtime の出力を {module: 累積マイクロ秒} にして返す"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=COLLECTOR_DIR,
+                          capture_output=True, text=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 入れ子の深さはインデントで表される。同名が複数回出ることはない
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def top_level_total(modules, code):
+    """計測コードが直接 import したモジュールの累積時間の和（ミリ秒）"""
+    names = set()
+    for statement in code.split(";"):
+        words = statement.replace(",", " ").split()
+        if words and words[0] == "import":
+            names.update(w for w in words[1:] if w != "as" and w in modules)
+    return sum(modules[n] for n in names) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure collector startup time with -X importtime")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="重いモジュールを何件表示するか")
+    parser.add_argument("--max-ms", type=float, default=None, help="import civitai_collector_v8 の許容時間")
+    args = parser.parse_args()
+
+    failed = False
+    for name, code, forbidden in TARGETS:
+        runs = [run_importtime(code) for _ in range(args.repeat)]
+        totals = [top_level_total(modules, code) for modules in runs]
+        median = statistics.median(totals)
+        modules = runs[totals.index(sorted(totals)[len(totals) // 2])]
+        loaded = [m for m in forbidden if m in modules]
+        print(f"\n{name}: {median:.1f} ms (median of {args.repeat}, min {min(totals):.1f} ms)")
+        for module, cumulative in sorted(modules.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"  {cumulative / 1000:9.1f} ms  {module}")
+        if loaded:
+            print(f"  !! heavy modules imported: {', '.join(loaded)}")
+            failed = True
+        if args.max_ms is not None and name == TARGETS[0][0] and median > args.max_ms:
+            print(f"  !! {median:.1f} ms exceeds --max-ms {args.max_ms}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
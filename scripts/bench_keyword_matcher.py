@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# bench_keyword_matcher.py
+# categorize_prompt + calculate_quality_score のキーワード照合を
+# 旧方式（キーワードごとの正規表現 / 部分文字列スキャン）と Aho-Corasick で比較する
+#
+# 使い方:
+#   python scripts/bench_keyword_matcher.py --db civitai_dataset.db   # 実データ（civitai_prompts.full_prompt）
+#   python scripts/bench_keyword_matcher.py --count 100000             # DB が無ければ合成プロンプト
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from civitai_collector_v8 import CATEGORIES, QUALITY_KEYWORDS  # noqa: E402
+from keyword_matcher import KeywordMatcher  # noqa: E402
+from mock_civitai_server import make_item  # noqa: E402
+
+# 語彙は収集側と同じもの（CivitaiPromptCollector の既定値）を使う
+TECHNICAL = QUALITY_KEYWORDS["technical"]
+DETAIL = QUALITY_KEYWORDS["detail"]
+
+
+def load_prompts(db_path, count):
+    """DB から full_prompt を読む。無ければ合成プロンプトを作る"""
+    if db_path and os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute(
+            "SELECT full_prompt FROM civitai_prompts WHERE full_prompt != '' LIMIT ?", (count,)
+        ).fetchall()
+        conn.close()
+        if rows:
+            return [r[0] for r in rows]
+    return [make_item(i % 50, i)["meta"]["prompt"] for i in range(count)]
+
+
+def legacy_scan(prompts):
+    """旧実装: キーワードごとに正規表現を1本ずつ走らせ、品質語彙も別に部分文字列検索"""
+    patterns = {cat: [re.compile(re.escape(kw.lower())) for kw in kws] for cat, kws in CATEGORIES.items()}
+    hits = 0
+    for prompt in prompts:
+        text = prompt.lower()
+        for pats in patterns.values():
+            for pat in pats:
+                if pat.search(text):
+                    hits += 1
+        hits += sum(1 for kw in TECHNICAL if kw in text)
+        hits += sum(1 for kw in DETAIL if kw in text)
+    return hits
+
+
+def matcher_scan(prompts, word_boundary=False):
+    """新実装: 全語彙を1つのオートマトンにまとめて1回走査"""
+    groups = dict(CATEGORIES)
+    groups["quality:technical"] = TECHNICAL
+    groups["quality:detail"] = DETAIL
+    matcher = KeywordMatcher(groups, word_boundary=word_boundary)
+    hits = 0
+    for prompt in prompts:
+        for found in matcher.match_groups(prompt).values():
+            hits += len(found)
+    return hits
+
+
+def timed(fn, prompts, **kwargs):
+    start = time.perf_counter()
+    hits = fn(prompts, **kwargs)
+    return time.perf_counter() - start, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyword matcher micro-benchmark")
+    parser.add_argument("--db", default=None, help="civitai_prompts を持つ DB（省略時は合成データ）")
+    parser.add_argument("--count", type=int, default=100_000)
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.db, args.count)
+    avg_len = sum(len(p) for p in prompts) / max(1, len(prompts))
+    print(f"prompts: {len(prompts)} (avg {avg_len:.0f} chars)")
+
+    legacy_t, legacy_hits = timed(legacy_scan, prompts)
+    ac_t, ac_hits = timed(matcher_scan, prompts)
+    wb_t, wb_hits = timed(matcher_scan, prompts, word_boundary=True)
+
+    n = max(1, len(prompts))
+    print(f"legacy regex      : {legacy_t:7.2f}s  {legacy_t / n * 1e6:7.1f} us/prompt  hits={legacy_hits}")
+    print(f"aho-corasick      : {ac_t:7.2f}s  {ac_t / n * 1e6:7.1f} us/prompt  hits={ac_hits}")
+    print(f"aho-corasick (wb) : {wb_t:7.2f}s  {wb_t / n * 1e6:7.1f} us/prompt  hits={wb_hits}")
+    print(f"speedup: x{legacy_t / ac_t:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# bench_offline.py
+# offline.py（プロセスプールでの再抽出・再分類）の処理速度をワーカー数 1/2/4/8 で比べる
+# 合成した API ページの JSONL を作り、ワーカー数ごとに新しい DB へ取り込む
+#
+# 使い方:
+#   python scripts/bench_offline.py --items 50000
+#   python scripts/bench_offline.py --jsonl dumps/pages.jsonl --workers 1 2 4 8
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import offline  # noqa: E402
+from mock_civitai_server import make_item  # noqa: E402
+
+
+def write_dump(path, items, page_size=100):
+    """モックサーバーと同じ形のページ（{"items": [...], "metadata": {}}）を1行ずつ書く"""
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, items, page_size):
+            page = [make_item(i % 50, i) for i in range(start, min(start + page_size, items))]
+            f.write(json.dumps({"items": page, "metadata": {}}) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline multiprocess re-processing")
+    parser.add_argument("--jsonl", help="既存の JSONL（省略時は合成）")
+    parser.add_argument("--items", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dump = args.jsonl
+        if not dump:
+            dump = os.path.join(tmpdir, "pages.jsonl")
+            write_dump(dump, args.items)
+        print(f"cpu_count={os.cpu_count()}")
+        results = []
+        for workers in args.workers:
+            db_path = os.path.join(tmpdir, f"bench_{workers}.db")
+            results.append(offline.process_jsonl(db_path, [dump], workers=workers))
+        base = results[0]["items_per_sec"] or 1
+        print(f"{'workers':>8} {'items':>8} {'seconds':>9} {'write s':>9} {'items/s':>10} {'speedup':>8}")
+        for r in results:
+            print(f"{r['workers']:>8} {r['items']:>8} {r['seconds']:>9.2f} {r['write_seconds']:>9.2f} "
+                  f"{r['items_per_sec']:>10.0f} {r['items_per_sec'] / base:>7.2f}x")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# bench_raw_storage.py
+# raw_metadata を列にそのまま持つ旧形式と、raw_payloads（圧縮・重複排除）へ移した後とで
+# DB サイズとフルスキャン速度を比べる
+#
+# 使い方:
+#   python scripts/bench_raw_storage.py --count 50000
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import make_item  # noqa: E402
+
+SCAN_QUERIES = {
+    "full_scan": "SELECT COUNT(*), SUM(LENGTH(full_prompt)) FROM civitai_prompts",
+    "model_category_join": '''
+        SELECT p.model_name, c.category, COUNT(*) as cnt
+        FROM civitai_prompts p
+        JOIN prompt_categories c ON p.id = c.prompt_id
+        GROUP BY p.model_name, c.category
+    ''',
+}
+
+
+def build_legacy_db(db_path, count):
+    """旧形式（raw_metadata 列に JSON 全文）の DB を作る"""
+    collector = CivitaiPromptCollector(db_path=db_path, batch_size=1000)
+    batch = []
+    for i in range(count):
+        prompt_data = collector.extract_prompt_data(make_item(i % 40, i))
+        batch.append(prompt_data)
+        if len(batch) >= 1000:
+            collector.save_prompt_batch(batch)
+            batch = []
+    if batch:
+        collector.save_prompt_batch(batch)
+
+    # 新しい書き込み経路は raw_payloads に入れるので、旧形式に戻す
+    conn = collector._get_connection()
+    rows = conn.execute('''
+        SELECT p.id, r.codec, r.payload FROM civitai_prompts p JOIN raw_payloads r ON r.hash = p.raw_hash
+    ''').fetchall()
+    conn.executemany(
+        "UPDATE civitai_prompts SET raw_metadata = ?, raw_hash = NULL WHERE id = ?",
+        [(collector.raw_store.decode(codec, payload), pid) for pid, codec, payload in rows],
+    )
+    conn.execute("DELETE FROM raw_payloads")
+    conn.commit()
+    conn.execute("VACUUM")
+    collector.close()
+
+
+def measure(db_path, repeat=5):
+    """DB サイズ（バイト）と各クエリの最良時間（秒）"""
+    result = {"size_bytes": os.path.getsize(db_path)}
+    conn = sqlite3.connect(db_path)
+    for name, sql in SCAN_QUERIES.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result[name] = best
+    conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="raw_metadata storage benchmark")
+    parser.add_argument("--count", type=int, default=50_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_raw_")
+    try:
+        legacy_path = os.path.join(workdir, "legacy.db")
+        build_legacy_db(legacy_path, args.count)
+        before = measure(legacy_path)
+
+        migrated_path = os.path.join(workdir, "migrated.db")
+        shutil.copy(legacy_path, migrated_path)
+        collector = CivitaiPromptCollector(db_path=migrated_path)
+        start = time.perf_counter()
+        collector.migrate_raw_metadata()
+        migrate_t = time.perf_counter() - start
+        collector.close()
+        after = measure(migrated_path)
+
+        print(f"rows: {args.count}  migration: {migrate_t:.2f}s")
+        print(f"{'':22}{'before':>14}{'after':>14}{'ratio':>8}")
+        for key in before:
+            b, a = before[key], after[key]
+            if key == "size_bytes":
+                print(f"{'db size (MB)':22}{b / 1e6:14.2f}{a / 1e6:14.2f}{a / b:8.2f}")
+            else:
+                print(f"{key + ' (ms)':22}{b * 1e3:14.2f}{a * 1e3:14.2f}{a / b:8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
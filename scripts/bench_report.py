@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# bench_report.py
+# 分布図の作り方の比較（モデル数が多い DB）
+# - legacy: 変更前の visualize_category_distribution（全行を Python に読み、defaultdict → 密行列 → pyplot）
+#           図の幅がモデル数に比例し、約 230 モデルを超えると保存できないので --legacy-models 件までで測る
+# - report: report.generate_report（SQL で上位だけ集計、Figure + Agg で PNG 2枚 + CSV / HTML）
+# - repeat: 同じプロセスで report.render_distribution を --repeat 回描き、最大 RSS が増え続けないことを見る
+# 集計テーブル（model_category_stats）に直接、models × categories 行の件数を入れて測る
+#
+# 使い方:
+#   python scripts/bench_report.py --models 10000 --categories 30
+#   python scripts/bench_report.py --models 10000 --legacy-models 100 --repeat 50
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+
+import category_stats  # noqa: E402
+import report  # noqa: E402
+import storage  # noqa: E402
+
+
+def create_db(path, models, categories, seed=0):
+    """models × categories の集計行を入れた DB を作る（モデルの件数はべき分布）"""
+    rng = random.Random(seed)
+    conn = storage.open_database(path, storage.COLLECTOR_MIGRATIONS)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {category_stats.STATS_TABLE} (model_name, category, prompt_count) VALUES (?, ?, ?)",
+            ((f"model_{m:05d}", f"category_{c:02d}", max(1, int(rng.paretovariate(1.2) * 10)))
+             for m in range(models) for c in range(categories) if rng.random() < 0.8),
+        )
+    conn.close()
+
+
+def legacy_visualize(db_path, save_path, models_limit):
+    """変更前の visualize_category_distribution（比較用にそのまま残す。モデルは先頭 models_limit 件）"""
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    conn = storage.connect(db_path)
+    rows = category_stats.model_category_counts(conn)
+    conn.close()
+
+    data = defaultdict(lambda: defaultdict(int))
+    models_set = set()
+    categories_set = set()
+    for model_name, category, cnt in rows:
+        model_name = model_name or "Unknown"
+        data[model_name][category] += cnt
+        models_set.add(model_name)
+        categories_set.add(category)
+    model_names = sorted(models_set)[:models_limit]
+    categories = sorted(categories_set)
+    matrix = np.zeros((len(categories), len(model_names)), dtype=float)
+    for j, m in enumerate(model_names):
+        total = sum(data[m].values()) or 1
+        for i, cat in enumerate(categories):
+            matrix[i, j] = data[m].get(cat, 0) / total * 100.0
+
+    x = np.arange(len(model_names))
+    bottom = np.zeros(len(model_names))
+    cmap = plt.get_cmap("tab20")
+    plt.figure(figsize=(max(8, len(model_names) * 1.4), 6))
+    for i, cat in enumerate(categories):
+        plt.bar(x, matrix[i, :], bottom=bottom, label=cat, color=cmap(i % 20))
+        bottom += matrix[i, :]
+    plt.xticks(x, model_names, rotation=25, ha='right')
+    plt.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
+    plt.tight_layout()
+    # 幅はモデル数 × 1.4 インチ。dpi=200 だと約 230 モデルで Agg の上限（65536 ピクセル）を超えて保存できない
+    plt.savefig(save_path, dpi=200)
+    plt.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Category report rendering benchmark")
+    parser.add_argument("--models", type=int, default=10_000)
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--legacy-models", type=int, default=200, help="legacy で描くモデル数（0 で省略）")
+    parser.add_argument("--top-models", type=int, default=30)
+    parser.add_argument("--top-categories", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_report_")
+    try:
+        db_path = os.path.join(workdir, "report.db")
+        create_db(db_path, args.models, args.categories)
+        print(f"{args.models} models x {args.categories} categories")
+
+        started = time.perf_counter()
+        result = report.generate_report(db_path, os.path.join(workdir, "out"), top_models=args.top_models,
+                                        top_categories=args.top_categories)
+        print(f"  report ({result['model_count']} models){time.perf_counter() - started:10.2f}s"
+              f"  peak RSS {peak_rss_mb():.0f} MB")
+
+        conn = storage.connect(db_path, readonly=True)
+        started = time.perf_counter()
+        summary = report.category_summary(conn, top_models=args.top_models, top_categories=args.top_categories)
+        print(f"  category_summary (SQL){time.perf_counter() - started:10.3f}s")
+        conn.close()
+
+        rss = []
+        started = time.perf_counter()
+        for i in range(args.repeat):
+            report.render_distribution(summary, os.path.join(workdir, "repeat.png"))
+            if i in (0, args.repeat // 2, args.repeat - 1):
+                rss.append(round(peak_rss_mb()))
+        elapsed = time.perf_counter() - started
+        print(f"  render x{args.repeat}: {elapsed / args.repeat:.3f}s per chart, peak RSS (first/mid/last) {rss} MB")
+
+        # 最大 RSS は下がらないので legacy は最後に測る
+        if args.legacy_models:
+            started = time.perf_counter()
+            legacy_visualize(db_path, os.path.join(workdir, "legacy.png"), args.legacy_models)
+            print(f"  legacy ({args.legacy_models} models){time.perf_counter() - started:10.2f}s"
+                  f"  peak RSS {peak_rss_mb():.0f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# bench_sampler.py
+# sampler.PromptSampler（エイリアス法）の抽選速度を ORDER BY RANDOM() と比較する
+#
+# 使い方:
+#   python scripts/bench_sampler.py --db civitai_dataset.db                # 実データ
+#   python scripts/bench_sampler.py --rows 1000000                         # 合成 DB（一時ファイル）
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+
+from sampler import PromptSampler  # noqa: E402
+
+CATEGORIES = ["realism_quality", "lighting", "composition", "character_features", "technical",
+              "texture", "style", "mood", "nsfw_safe", "nsfw_suggestive", "nsfw_mature", "nsfw_explicit"]
+
+
+def build_synthetic_db(path, rows, seed=0):
+    """civitai_prompts / prompt_categories の必要な列だけを持つ合成 DB を作る"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+    CREATE TABLE civitai_prompts (
+        id INTEGER PRIMARY KEY, full_prompt TEXT, negative_prompt TEXT,
+        quality_score INTEGER, reaction_count INTEGER, collected_at TIMESTAMP
+    );
+    CREATE TABLE prompt_categories (id INTEGER PRIMARY KEY, prompt_id INTEGER, category TEXT, confidence REAL);
+    CREATE INDEX idx_prompt_categories_prompt_id ON prompt_categories (prompt_id);
+    ''')
+    chunk = 50_000
+    for start in range(1, rows + 1, chunk):
+        ids = range(start, min(start + chunk, rows + 1))
+        conn.executemany(
+            "INSERT INTO civitai_prompts VALUES (?, ?, '', ?, ?, '2025-01-01T00:00:00')",
+            [(i, f"prompt {i}", rng.randint(0, 10), rng.randint(0, 500)) for i in ids],
+        )
+        conn.executemany(
+            "INSERT INTO prompt_categories (prompt_id, category, confidence) VALUES (?, ?, 0.5)",
+            [(i, c) for i in ids for c in rng.sample(CATEGORIES, rng.randint(1, 5))],
+        )
+    conn.commit()
+    conn.close()
+
+
+def bench_order_by_random(db_path, category, draws):
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    for _ in range(draws):
+        conn.execute('''
+        SELECT p.id FROM civitai_prompts p
+        JOIN prompt_categories c ON c.prompt_id = p.id AND c.category = ?
+        ORDER BY RANDOM() LIMIT 1
+        ''', (category,)).fetchone()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return draws / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark weighted prompt sampling")
+    parser.add_argument("--db", help="既存 DB（省略時は合成 DB を作る）")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--draws", type=int, default=100_000)
+    parser.add_argument("--baseline-draws", type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = args.db
+    tmpdir = None
+    if not db_path:
+        tmpdir = tempfile.mkdtemp()
+        db_path = os.path.join(tmpdir, "bench_sampler.db")
+        started = time.perf_counter()
+        build_synthetic_db(db_path, args.rows)
+        print(f"synthetic db: {args.rows} rows ({time.perf_counter() - started:.1f}s)")
+
+    started = time.perf_counter()
+    sampler = PromptSampler(db_path, seed=0)
+    print(f"load: {len(sampler)} rows in {time.perf_counter() - started:.2f}s")
+
+    for categories in (None, ["lighting"], ["lighting", "composition"]):
+        label = "+".join(categories) if categories else "(all)"
+        started = time.perf_counter()
+        sampler.sample_ids(1, categories)
+        build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(args.draws // 10):
+            sampler.sample_ids(1, categories)
+        single = (args.draws // 10) / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        sampler.sample_ids(args.draws, categories)
+        batch = args.draws / (time.perf_counter() - started)
+        print(f"{label:22s} table build {build * 1000:8.1f} ms | "
+              f"single {single:12,.0f} draws/s | batch {batch:14,.0f} draws/s")
+
+    baseline = bench_order_by_random(db_path, "lighting", args.baseline_draws)
+    print(f"{'ORDER BY RANDOM()':22s} lighting {baseline:12,.1f} draws/s")
+
+    # 差分読み込み: 1000 行追加して refresh
+    conn = sqlite3.connect(db_path)
+    max_id = conn.execute("SELECT MAX(id) FROM civitai_prompts").fetchone()[0] or 0
+    conn.executemany(
+        "INSERT INTO civitai_prompts (id, full_prompt, negative_prompt, quality_score, reaction_count, collected_at) "
+        "VALUES (?, '', '', 5, 5, '2099-01-01T00:00:00')",
+        [(max_id + i,) for i in range(1, 1001)],
+    )
+    conn.executemany(
+        "INSERT INTO prompt_categories (prompt_id, category, confidence) VALUES (?, 'lighting', 0.5)",
+        [(max_id + i,) for i in range(1, 1001)],
+    )
+    conn.commit()
+    conn.close()
+    started = time.perf_counter()
+    loaded = sampler.refresh()
+    print(f"refresh: {loaded} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    if tmpdir:
+        os.remove(db_path)
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
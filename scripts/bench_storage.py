@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# bench_storage.py
+# 書き込み経路の比較
+# - prompts: 旧 db.save_prompts（1行ずつ INSERT + IntegrityError で重複スキップ、既定の PRAGMA）と
+#            新 db.save_prompts（storage.insert_prompts: executemany + INSERT OR IGNORE、WAL / synchronous=NORMAL）
+#            新しい方は呼び出しごとに接続を開閉する場合と、1本の接続を使い回す場合の両方を測る
+# - civitai_prompts: save_prompt_batch を素の sqlite3 接続と storage.connect の接続で
+# どちらも main.py / 収集と同じく「1回の呼び出し = 1ページ分」を繰り返す
+#
+# 使い方:
+#   python scripts/bench_storage.py --count 20000 --batch 50 --dup-ratio 0.2
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "collector"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import storage  # noqa: E402
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from db import init_db, save_prompts  # noqa: E402
+from mock_civitai_server import TAG_POOL, make_item  # noqa: E402
+
+
+def legacy_save_prompts(prompts, db_path):
+    """変更前の db.save_prompts（比較用にそのまま残す）"""
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    for p in prompts:
+        try:
+            cur.execute("INSERT INTO prompts (id, text) VALUES (?, ?)", (p["id"], p["text"]))
+        except sqlite3.IntegrityError:
+            continue  # 既にある場合はスキップ
+    conn.commit()
+    conn.close()
+
+
+def make_prompts(count, dup_ratio, seed=0):
+    """count 件のうち dup_ratio の割合を既出 id にした prompts 行"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        pid = rng.randint(1, max(1, i)) if i and rng.random() < dup_ratio else i + 1
+        rows.append({"id": pid, "text": ", ".join(rng.sample(TAG_POOL, 8))})
+    return rows
+
+
+def create_db(path, wal):
+    conn = storage.connect(path, wal=wal)
+    storage.migrate(conn, storage.PROMPTS_MIGRATIONS)
+    conn.close()
+
+
+def bench_prompts(workdir, prompts, batch):
+    results = {}
+    shared = {}
+
+    def shared_save(rows, path):
+        # main.py と同じく init_db が返した接続を使い回す
+        if path not in shared:
+            shared[path] = init_db(path)
+        save_prompts(rows, path, conn=shared[path])
+
+    cases = {
+        "legacy save_prompts": (False, legacy_save_prompts),
+        "save_prompts (per call)": (True, save_prompts),
+        "save_prompts (shared)": (True, shared_save),
+    }
+    for name, (wal, save) in cases.items():
+        path = os.path.join(workdir, f"prompts_{len(results)}.db")
+        create_db(path, wal)
+        started = time.perf_counter()
+        for i in range(0, len(prompts), batch):
+            save(prompts[i:i + batch], path)
+        if path in shared:
+            shared.pop(path).close()
+        elapsed = time.perf_counter() - started
+        conn = sqlite3.connect(path)
+        stored = conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+        conn.close()
+        results[name] = (elapsed, stored)
+    return results
+
+
+def _legacy_connect(path):
+    """変更前の収集側と同じ素の接続（ロールバックジャーナル・synchronous=FULL）"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    return conn
+
+
+def bench_collector(workdir, count, batch):
+    collector = CivitaiPromptCollector(db_path=os.path.join(workdir, "prepare.db"), collect_metrics=False)
+    prepared = [collector.prepare_item(make_item(i % 40, i)) for i in range(count)]
+    results = {}
+    for name, connect in (("sqlite3.connect", _legacy_connect), ("storage.connect", storage.connect)):
+        path = os.path.join(workdir, f"collector_{name}.db")
+        writer = CivitaiPromptCollector(db_path=path, collect_metrics=False)
+        conn = connect(path)
+        started = time.perf_counter()
+        for i in range(0, len(prepared), batch):
+            writer.save_prompt_batch(prepared[i:i + batch], conn=conn)
+        elapsed = time.perf_counter() - started
+        conn.close()
+        results[name] = (elapsed, count)
+    return results
+
+
+def report(title, results):
+    print(f"\n{title}")
+    print(f"{'':26}{'seconds':>10}{'rows/s':>12}{'stored':>10}")
+    base = None
+    for name, (elapsed, stored) in results.items():
+        base = base or elapsed
+        print(f"{name:26}{elapsed:10.2f}{stored / elapsed:12.0f}{stored:10}  x{base / elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite write path benchmark")
+    parser.add_argument("--count", type=int, default=20_000)
+    parser.add_argument("--batch", type=int, default=50, help="1回の保存で渡す件数（main.py の FETCH_LIMIT 相当）")
+    parser.add_argument("--dup-ratio", type=float, default=0.2, help="既出 id の割合")
+    parser.add_argument("--collector-count", type=int, default=10_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    try:
+        prompts = make_prompts(args.count, args.dup_ratio)
+        report(f"prompts: {args.count} rows, batch {args.batch}, dup {args.dup_ratio:.0%}",
+               bench_prompts(workdir, prompts, args.batch))
+        report(f"civitai_prompts (save_prompt_batch): {args.collector_count} rows, batch 100",
+               bench_collector(workdir, args.collector_count, 100))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# bench_suite.py
+# 収集パイプラインのベンチマーク一式。結果を JSON に書き、前回の JSON と比べて劣化を検出する
+# - コーパス: scripts/fixtures/civitai_images_pages.jsonl（実 API と同じ形の item）を id を振り直して必要件数まで増やす
+# - 段ごと: extract_prompt_data / categorize_prompt / save_prompt_data（1件ずつ）/ save_prompt_batch
+# - 通し: モックサーバー（遅延・ジッター・429 注入あり）に対する collect_dataset と
+#         visualize_category_distribution（Agg で PNG に保存）
+# 件数ごと（既定 1k / 100k。1M は --sizes で指定）に測る
+#
+# 使い方:
+#   python scripts/bench_suite.py --out bench_results/$(git rev-parse --short HEAD).json
+#   python scripts/bench_suite.py --sizes 1000,100000,1000000 --latency-ms 5 --rate-limit-ratio 0.01
+#   python scripts/bench_suite.py --sizes 1000 --compare bench_results/old.json --fail-on-regression
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "..", "src", "collector"))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import corpus_item, load_corpus, start_server  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(SCRIPTS_DIR, "fixtures", "civitai_images_pages.jsonl")
+MODEL_VERSION_ID = "2091367"
+CHUNK = 5000
+
+
+def iter_chunks(corpus, count):
+    """コーパスを id を振り直しながら count 件まで増やし、CHUNK 件ずつ返す（全件をメモリに持たない）"""
+    for start in range(0, count, CHUNK):
+        yield [corpus_item(corpus, MODEL_VERSION_ID, i) for i in range(start, min(start + CHUNK, count))]
+
+
+def _result(items, seconds, **extra):
+    return dict(items=items, seconds=round(seconds, 4), items_per_sec=round(items / max(seconds, 1e-9), 1), **extra)
+
+
+def bench_stages(workdir, corpus, count, batch_size, single_save_limit):
+    """抽出・分類・保存を段ごとに測る（データ生成の時間は含めない）"""
+    collector = CivitaiPromptCollector(db_path=os.path.join(workdir, f"stages_{count}.db"), collect_metrics=False)
+    timings = {"extract_prompt_data": 0.0, "categorize_prompt": 0.0, "save_prompt_batch": 0.0}
+    extracted = single_saved = 0
+    single_seconds = 0.0
+    perf_counter = time.perf_counter
+    for chunk in iter_chunks(corpus, count):
+        started = perf_counter()
+        rows = [collector.extract_prompt_data(item) for item in chunk]
+        timings["extract_prompt_data"] += perf_counter() - started
+        rows = [r for r in rows if r and r["full_prompt"]]
+        extracted += len(rows)
+
+        started = perf_counter()
+        for r in rows:
+            r["categories"] = collector.categorize_prompt(r["full_prompt"])
+        timings["categorize_prompt"] += perf_counter() - started
+
+        # 1件ずつの保存は遅いので先頭 single_save_limit 件だけ（残りはまとめて保存）
+        single = rows[:max(0, single_save_limit - single_saved)]
+        started = perf_counter()
+        for r in single:
+            collector.save_prompt_data(r)
+        single_seconds += perf_counter() - started
+        single_saved += len(single)
+
+        rest = rows[len(single):]
+        started = perf_counter()
+        for i in range(0, len(rest), batch_size):
+            collector.save_prompt_batch(rest[i:i + batch_size])
+        timings["save_prompt_batch"] += perf_counter() - started
+    collector.close()
+    results = {
+        "extract_prompt_data": _result(count, timings["extract_prompt_data"]),
+        "categorize_prompt": _result(extracted, timings["categorize_prompt"]),
+        "save_prompt_data": _result(single_saved, single_seconds),
+    }
+    if extracted > single_saved:
+        results["save_prompt_batch"] = _result(extracted - single_saved, timings["save_prompt_batch"],
+                                               batch_size=batch_size)
+    return results
+
+
+def bench_collect(workdir, corpus, count, args):
+    """モックサーバーに対する collect_dataset と、その DB での visualize_category_distribution"""
+    server, base_url = start_server(
+        items_per_model=count, retry_after=args.retry_after, latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000, rate_limit_ratio=args.rate_limit_ratio, corpus=corpus,
+    )
+    db_path = os.path.join(workdir, f"collect_{count}.db")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            collector = CivitaiPromptCollector(db_path=db_path, base_url=base_url, stream_json=args.stream_json)
+        # 実 API 向けの送信レート上限はベンチでは外す。429 後の加算的な戻り（既定 +0.05 req/s）も
+        # 上限に合わせて大きくしないと、注入した 429 の後はほぼ待ち時間だけを測ることになる
+        limiter = collector.rate_limiter
+        limiter.max_rate = limiter.rate = args.max_rate
+        limiter.increase = args.max_rate / 20
+        collector.metrics.reset()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = collector.collect_dataset(model_id=MODEL_VERSION_ID, model_name="bench", max_items=count)
+        elapsed = time.perf_counter() - started
+        collect = _result(result["collected"], elapsed, saved=result["saved"],
+                          rate_limiter=collector.rate_limiter.snapshot(), stages=collector.metrics.report())
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            collector.visualize_category_distribution(show=False, save_path=os.path.join(workdir, "plot.png"))
+        plot = {"seconds": round(time.perf_counter() - started, 4)}
+        collector.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {"collect_dataset": collect, "visualize_category_distribution": plot}
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=SCRIPTS_DIR,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                    text=True, cwd=SCRIPTS_DIR).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(current, previous, threshold):
+    """items_per_sec（無ければ seconds の逆数）を段ごとに比べ、threshold 以上遅くなった段を返す"""
+    regressions = []
+    print(f"\n{'size':>9} {'stage':34}{'previous':>14}{'current':>14}{'ratio':>8}")
+    for size, stages in current["results"].items():
+        for stage, now in stages.items():
+            before = previous.get("results", {}).get(size, {}).get(stage)
+            if not before:
+                continue
+            if "items_per_sec" in now and "items_per_sec" in before:
+                old, new = before["items_per_sec"], now["items_per_sec"]
+            else:
+                old, new = 1 / max(before["seconds"], 1e-9), 1 / max(now["seconds"], 1e-9)
+            ratio = new / max(old, 1e-9)
+            flag = "  <-- regression" if ratio < 1 - threshold else ""
+            print(f"{size:>9} {stage:34}{old:14.1f}{new:14.1f}{ratio:8.2f}{flag}")
+            if flag:
+                regressions.append((size, stage, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CivitAI collector benchmark suite")
+    parser.add_argument("--sizes", default="1000,100000", help="件数（カンマ区切り）。例: 1000,100000,1000000")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--single-save-limit", type=int, default=2000, help="save_prompt_data で1件ずつ保存する件数")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.01)
+    parser.add_argument("--retry-after", default="0")
+    parser.add_argument("--max-rate", type=float, default=1000.0, help="ベンチ中の送信レート上限（req/s）")
+    parser.add_argument("--stream-json", action="store_true")
+    parser.add_argument("--skip-collect", action="store_true")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="この割合以上遅くなったら劣化とみなす")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    commit, dirty = git_revision()
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": commit,
+            "git_dirty": dirty,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus": os.path.relpath(args.corpus),
+            "corpus_items": len(corpus),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    try:
+        for size in sizes:
+            print(f"[bench_suite] size={size}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = bench_stages(workdir, corpus, size, args.batch_size, args.single_save_limit)
+            if not args.skip_collect:
+                results.update(bench_collect(workdir, corpus, size, args))
+            report["results"][str(size)] = results
+            for stage, r in results.items():
+                rate = f"{r['items_per_sec']:>12.1f}/s" if "items_per_sec" in r else ""
+                print(f"  {stage:34}{r['seconds']:10.3f}s{rate}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench_suite] Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# load_test_api.py
+# 読み取り API（src/collector/api.py）に一定レートでリクエストを送り、レイテンシの p50/p99 を出す
+# - オープンループ: 応答を待たずに予定時刻どおり送る（遅くなってもレートを落とさないので、待ち行列の遅延も測れる）
+# - --url を省くと --db から API をこのプロセス内で起動して測る
+#
+# 使い方:
+#   python scripts/load_test_api.py --db civitai_dataset.db --rate 200 --duration 10
+#   python scripts/load_test_api.py --url http://127.0.0.1:8000 --rate 500 --duration 30 --workers 64
+
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 叩く URL の組み合わせ（ComfyUI から来そうな検索・サンプル・統計を混ぜる）
+DEFAULT_PATHS = [
+    "/prompts?limit=50",
+    "/prompts?category=lighting&limit=20",
+    "/prompts?category=composition&min_quality=5&limit=20",
+    "/prompts?nsfw=suggestive&limit=50",
+    "/sample?category=lighting&n=3",
+    "/sample?nsfw=safe&n=1",
+    "/stats/categories",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def start_local_server(db_path):
+    """API を別スレッドの uvicorn で起動し、ベース URL を返す"""
+    import uvicorn
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "collector"))
+    from api import create_app
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(create_app(db_path), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(base_url + "/health", timeout=1)
+            return base_url, server
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("API server did not start")
+
+
+def run_load(base_url, rate, duration, paths=None, workers=32, timeout=10):
+    """rate req/s で duration 秒送り、レイテンシ統計の dict を返す"""
+    paths = paths or DEFAULT_PATHS
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    latencies, errors, lateness = [], [], []
+    lock = threading.Lock()
+
+    def one(path, scheduled):
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=timeout)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        # 予定時刻からの経過で測る（送信待ちの遅れもレイテンシに含める）
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(path)
+            lateness.append(start - scheduled)
+
+    total = int(rate * duration)
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(total):
+            scheduled = started + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(one, random.choice(paths), scheduled)
+    wall = time.perf_counter() - started
+
+    result = {
+        "target_rps": rate,
+        "achieved_rps": round(len(latencies) / wall, 1),
+        "requests": total,
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "max_send_lag_ms": round(max(lateness) * 1000, 2) if lateness else None,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the read-only prompt API")
+    parser.add_argument("--url", help="API のベース URL（省略時は --db から起動）")
+    parser.add_argument("--db", default="civitai_dataset.db")
+    parser.add_argument("--rate", type=float, default=100, help="目標リクエスト/秒")
+    parser.add_argument("--duration", type=float, default=10, help="秒")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--path", action="append", help="叩くパス（複数可、省略時は既定の組み合わせ）")
+    args = parser.parse_args()
+
+    base_url = args.url
+    if not base_url:
+        base_url, _ = start_local_server(args.db)
+    result = run_load(base_url, args.rate, args.duration, paths=args.path, workers=args.workers)
+    try:
+        result["server_cache"] = requests.get(base_url + "/health", timeout=5).json().get("cache")
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
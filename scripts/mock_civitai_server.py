@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# mock_civitai_server.py
+# ローカル用の CivitAI /api/v1/images モックサーバー
+# - modelVersionId ごとに決まった件数の合成データを返す
+# - metadata.nextPage にカーソル付き URL を入れてページングを再現
+# - --script で 429/5xx を決まった順番で返せる（レート制御・バックオフの確認用）
+# - --latency-ms / --jitter-ms で応答の遅延、--rate-limit-ratio で確率的な 429 を入れられる
+# - --corpus に API ページ（または item）の JSONL を渡すと、合成データの代わりにその item を id を振り直して返す
+#   （scripts/fixtures/civitai_images_pages.jsonl は実 API と同じ形の meta / stats を持つ同梱コーパス）
+#
+# 使い方:
+#   python scripts/mock_civitai_server.py --port 8765 --items-per-model 200
+#   python scripts/mock_civitai_server.py --script 200,429,429,503,200 --retry-after 2
+#   python scripts/mock_civitai_server.py --corpus scripts/fixtures/civitai_images_pages.jsonl \
+#       --latency-ms 80 --jitter-ms 40 --rate-limit-ratio 0.02
+#   python scripts/mock_civitai_server.py --write-corpus scripts/fixtures/civitai_images_pages.jsonl --corpus-pages 5
+#   collector = CivitaiPromptCollector(base_url="http://127.0.0.1:8765/api/v1/images")
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+TAG_POOL = [
+    "masterpiece", "best quality", "highres", "8k", "photorealistic", "realistic skin",
+    "cinematic lighting", "soft lighting", "golden hour", "rim light", "portrait",
+    "full body", "close-up", "upper body", "detailed face", "expressive eyes",
+    "anime", "oil painting", "watercolor", "digital art", "moody", "elegant", "dark",
+    "1girl", "solo", "long hair", "smile", "outdoors", "city", "night", "dress",
+    "bikini", "cleavage", "nsfw", "skin texture", "hair detail", "rule of thirds",
+]
+
+
+def make_item(model_version_id, index):
+    """1件分の合成 API アイテムを作る（同じ引数なら常に同じ内容）"""
+    rng = random.Random(f"{model_version_id}:{index}")
+    tags = rng.sample(TAG_POOL, rng.randint(6, 18))
+    image_id = int(model_version_id or 0) * 1_000_000 + index
+    return {
+        "id": image_id,
+        "url": f"https://image.example/{image_id}.jpeg",
+        "width": 832,
+        "height": 1216,
+        "nsfw": "nsfw" in tags,
+        "nsfwLevel": "X" if "nsfw" in tags else "None",
+        "createdAt": "2025-01-01T00:00:00.000Z",
+        "postId": image_id // 4,
+        "modelVersionId": int(model_version_id or 0),
+        "stats": {
+            "cryCount": rng.randint(0, 5),
+            "laughCount": rng.randint(0, 20),
+            "likeCount": rng.randint(0, 300),
+            "heartCount": rng.randint(0, 200),
+            "commentCount": rng.randint(0, 30),
+            "reactionCount": rng.randint(0, 500),
+        },
+        "username": f"user{rng.randint(1, 5000)}",
+        "meta": {
+            "prompt": ", ".join(tags),
+            "negativePrompt": "lowres, bad anatomy, bad hands, worst quality",
+            "Model": f"Mock Model {model_version_id}",
+            "steps": rng.choice([20, 25, 30]),
+            "sampler": rng.choice(["Euler a", "DPM++ 2M Karras"]),
+            "cfgScale": rng.choice([5, 6, 7]),
+            "seed": rng.randint(0, 2**32 - 1),
+            "Size": "832x1216",
+        },
+    }
+
+
+# 実 API の meta に出てくる付随情報（プロンプト以外）
+_LORAS = ["add_detail", "epiNoiseoffset", "more_details", "film_grain", "skin_tone_slider"]
+_SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DPM++ SDE Karras", "DPM++ 2M SDE", "UniPC"]
+_BASE_MODELS = ["SDXL 1.0", "Pony", "Illustrious", "SD 1.5"]
+_NSFW_LEVELS = ["None", "Soft", "Mature", "X"]
+
+
+def make_realistic_item(index, seed=0):
+    """実際の /api/v1/images の item と同じ形の合成データ
+    強調・重み付きタグ、LoRA 記法、BREAK、resources / hashes、meta が null の画像、
+    negativePrompt や stats の一部キーが無い画像などを混ぜる
+    """
+    rng = random.Random(f"realistic:{seed}:{index}")
+    tags = rng.sample(TAG_POOL, rng.randint(8, 24))
+    parts = []
+    for tag in tags:
+        roll = rng.random()
+        if roll < 0.12:
+            parts.append(f"({tag}:{rng.choice([0.8, 1.1, 1.2, 1.3, 1.4])})")
+        elif roll < 0.18:
+            parts.append(f"(({tag}))")
+        elif roll < 0.21:
+            parts.append(f"[{tag}]")
+        else:
+            parts.append(tag)
+    if rng.random() < 0.15:
+        parts.insert(rng.randint(1, len(parts)), "BREAK")
+    loras = rng.sample(_LORAS, rng.randint(0, 2))
+    prompt = ", ".join(parts) + "".join(f" <lora:{name}:{rng.choice([0.4, 0.6, 0.8, 1])}>" for name in loras)
+
+    image_id = 10_000_000 + index
+    model_version_id = rng.choice([2091367, 128713, 290640, 354657])
+    meta = {
+        "prompt": prompt,
+        "negativePrompt": "lowres, bad anatomy, bad hands, text, error, missing fingers, worst quality, low quality, "
+                          "jpeg artifacts, signature, watermark",
+        "Model": rng.choice(["Realism Illustrious By Stable Yogi", "ponyDiffusionV6XL", "juggernautXL_v9"]),
+        "Model hash": hashlib.sha256(str(model_version_id).encode()).hexdigest()[:10],
+        "steps": rng.choice([20, 25, 28, 30, 35]),
+        "sampler": rng.choice(_SAMPLERS),
+        "cfgScale": rng.choice([3.5, 4, 5, 6, 7]),
+        "seed": rng.randint(0, 2**32 - 1),
+        "Size": rng.choice(["832x1216", "1024x1024", "1216x832"]),
+        "Clip skip": rng.choice([1, 2]),
+        "hashes": {"model": hashlib.sha256(str(model_version_id).encode()).hexdigest()[:10]},
+        "resources": [{"name": name, "type": "lora", "weight": 0.8} for name in loras],
+        "civitaiResources": [{"type": "checkpoint", "modelVersionId": model_version_id}],
+    }
+    roll = rng.random()
+    if roll < 0.05:
+        meta = None                          # メタデータを消した画像
+    elif roll < 0.15:
+        del meta["negativePrompt"]
+    stats = {
+        "cryCount": rng.randint(0, 5),
+        "laughCount": rng.randint(0, 20),
+        "likeCount": int(rng.paretovariate(1.2) * 10),
+        "dislikeCount": 0,
+        "heartCount": int(rng.paretovariate(1.3) * 5),
+        "commentCount": rng.randint(0, 30),
+    }
+    if rng.random() < 0.9:
+        stats["reactionCount"] = stats["likeCount"] + stats["heartCount"] + stats["laughCount"] + stats["cryCount"]
+    nsfw_level = rng.choice(_NSFW_LEVELS)
+    return {
+        "id": image_id,
+        "url": f"https://image.civitai.com/xG1nkqKTMzGDvpLrqFT7WA/{hashlib.md5(str(image_id).encode()).hexdigest()}"
+               f"/width=832/{image_id}.jpeg",
+        "hash": "U" + hashlib.md5(str(index).encode()).hexdigest()[:27],
+        "width": 832,
+        "height": 1216,
+        "nsfwLevel": nsfw_level,
+        "nsfw": nsfw_level != "None",
+        "browsingLevel": _NSFW_LEVELS.index(nsfw_level) + 1,
+        "createdAt": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.000Z",
+        "postId": image_id // 4,
+        "stats": stats,
+        "meta": meta,
+        "username": f"user{rng.randint(1, 5000)}",
+        "baseModel": rng.choice(_BASE_MODELS),
+        "modelVersionIds": [model_version_id],
+    }
+
+
+def write_corpus(path, pages=5, items_per_page=20, seed=0):
+    """make_realistic_item のページを1行1ページの JSONL に書く（offline.py / --corpus でそのまま読める形）"""
+    with open(path, "w", encoding="utf-8") as f:
+        for page in range(pages):
+            items = [make_realistic_item(page * items_per_page + i, seed) for i in range(items_per_page)]
+            metadata = {"nextCursor": str((page + 1) * items_per_page)} if page + 1 < pages else {}
+            f.write(json.dumps({"items": items, "metadata": metadata}, ensure_ascii=False) + "\n")
+    return path
+
+
+def load_corpus(path):
+    """JSONL（1行1ページ or 1行1アイテム）から item のリストを読む"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if isinstance(obj, dict) and isinstance(obj.get("items"), list):
+                items.extend(obj["items"])
+            else:
+                items.append(obj)
+    return items
+
+
+def corpus_item(corpus, model_version_id, index):
+    """コーパスの item を (modelVersionId, index) ごとに一意な id に振り直して返す"""
+    item = json.loads(json.dumps(corpus[index % len(corpus)]))
+    item["id"] = int(model_version_id or 0) * 1_000_000 + index
+    item["modelVersionId"] = int(model_version_id or 0)
+    return item
+
+
+class MockCivitaiHandler(BaseHTTPRequestHandler):
+    # サーバー起動時に上書きされる設定
+    items_per_model = 200
+    # リクエスト順に返すステータスの台本（使い切ったら 200）。429 には retry_after を付ける
+    status_script = []
+    retry_after = "1"
+    # 応答前に latency + U(0, jitter) 秒待つ。rate_limit_ratio の確率で（台本とは別に）429 を返す
+    latency = 0.0
+    jitter = 0.0
+    rate_limit_ratio = 0.0
+    corpus = None
+    _rng = random.Random(0)
+    _script_lock = threading.Lock()
+    _request_count = 0
+
+    @classmethod
+    def _next_scripted_status(cls):
+        with cls._script_lock:
+            index = cls._request_count
+            cls._request_count += 1
+            injected = cls.rate_limit_ratio and cls._rng.random() < cls.rate_limit_ratio
+            delay = cls.latency + (cls._rng.uniform(0, cls.jitter) if cls.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if index < len(cls.status_script):
+            return cls.status_script[index]
+        return 429 if injected else 200
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != "/api/v1/images":
+            self._send_json(404, {"error": "not found"})
+            return
+        status = self._next_scripted_status()
+        if status == 429:
+            body = b'{"error": "Too Many Requests"}'
+            self.send_response(429)
+            if self.retry_after:
+                self.send_header("Retry-After", self.retry_after)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if status != 200:
+            self._send_json(status, {"error": f"scripted status {status}"})
+            return
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        limit = max(1, min(200, int(query.get("limit", 100))))
+        cursor = int(query.get("cursor", 0))
+        model_version_id = query.get("modelVersionId", "0")
+
+        end = min(cursor + limit, self.items_per_model)
+        if self.corpus:
+            items = [corpus_item(self.corpus, model_version_id, i) for i in range(cursor, end)]
+        else:
+            items = [make_item(model_version_id, i) for i in range(cursor, end)]
+        metadata = {}
+        if end < self.items_per_model:
+            next_query = dict(query, cursor=str(end))
+            host = self.headers.get("Host") or f"127.0.0.1:{self.server.server_port}"
+            metadata["nextCursor"] = str(end)
+            metadata["nextPage"] = f"http://{host}{parsed.path}?{urlencode(next_query)}"
+        self._send_json(200, {"items": items, "metadata": metadata})
+
+
+def make_handler(items_per_model=200, status_script=None, retry_after="1", latency=0.0, jitter=0.0,
+                 rate_limit_ratio=0.0, corpus=None, seed=0):
+    """設定を埋め込んだハンドラクラスを作る（サーバーごとに台本のカウンタを分ける）"""
+    return type("Handler", (MockCivitaiHandler,), {
+        "items_per_model": items_per_model,
+        "status_script": list(status_script or []),
+        "retry_after": retry_after,
+        "latency": latency,
+        "jitter": jitter,
+        "rate_limit_ratio": rate_limit_ratio,
+        "corpus": corpus,
+        "_rng": random.Random(seed),
+        "_script_lock": threading.Lock(),
+        "_request_count": 0,
+    })
+
+
+def start_server(port=0, items_per_model=200, status_script=None, retry_after="1", latency=0.0, jitter=0.0,
+                 rate_limit_ratio=0.0, corpus=None, seed=0):
+    """バックグラウンドスレッドでモックサーバーを起動し (server, base_url) を返す"""
+    handler = make_handler(items_per_model, status_script, retry_after, latency, jitter,
+                           rate_limit_ratio, corpus, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/v1/images"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock CivitAI /api/v1/images server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--items-per-model", type=int, default=200)
+    parser.add_argument("--script", default="", help="返すステータスの順番（例: 200,429,503,200）")
+    parser.add_argument("--retry-after", default="1", help="429 に付ける Retry-After（空なら付けない）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="応答ごとの固定遅延")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="固定遅延に足す一様乱数の幅")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429 を返す確率")
+    parser.add_argument("--corpus", default=None, help="返す item の JSONL（省略時は make_item の合成データ）")
+    parser.add_argument("--write-corpus", default=None, help="make_realistic_item のコーパスを書き出して終了")
+    parser.add_argument("--corpus-pages", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        write_corpus(args.write_corpus, pages=args.corpus_pages)
+        print(f"Wrote {args.corpus_pages} pages to {args.write_corpus}")
+        return
+
+    script = [int(s) for s in args.script.split(",") if s.strip()]
+    corpus = load_corpus(args.corpus) if args.corpus else None
+    handler = make_handler(args.items_per_model, script, args.retry_after, args.latency_ms / 1000,
+                           args.jitter_ms / 1000, args.rate_limit_ratio, corpus)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Mock CivitAI server: http://127.0.0.1:{args.port}/api/v1/images")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
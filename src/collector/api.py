@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# api.py
+# 収集済みプロンプト・カテゴリを返す読み取り専用の REST API（README Step 3）
+# - SQLite は WAL + 読み取り専用接続のプールで読む（収集中の書き込みを止めない）
+# - よく叩かれる検索結果は LRU キャッシュ（短い TTL 付き）から返す
+# - 一覧は id のキーセットページング（?after_id=...）。OFFSET を使わないので深いページでも遅くならない
+#
+# 使い方:
+#   python src/collector/api.py --db civitai_dataset.db --port 8000
+#   curl "http://127.0.0.1:8000/prompts?category=lighting&min_quality=5&nsfw=suggestive&limit=20"
+#   curl "http://127.0.0.1:8000/sample?category=lighting&category=composition&n=3"
+
+import argparse
+import json
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+
+import category_stats
+import storage
+
+# NSFW の段階（弱い順）。?nsfw=<tier> はその段階までを許可し、それより強いカテゴリを含む行を除く
+NSFW_TIERS = ["safe", "suggestive", "mature", "explicit"]
+
+PROMPT_FIELDS = ("id", "civitai_id", "full_prompt", "negative_prompt", "quality_score",
+                 "reaction_count", "comment_count", "model_name", "model_id", "collected_at")
+
+
+class ReadOnlyPool:
+    """読み取り専用 SQLite 接続のプール。接続はスレッドをまたいで使い回す（同時に使うのは1スレッドだけ）"""
+
+    def __init__(self, db_path, size=8, enable_wal=True):
+        self.db_path = db_path
+        if enable_wal:
+            # WAL は DB ファイルに残る設定なので、書き込み可能な接続で一度だけ切り替える
+            storage.connect(db_path).close()
+        self._pool = queue.LifoQueue()
+        for _ in range(size):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        # 接続数ぶんページキャッシュを持つので、1本あたりは小さめにする（mmap は全接続で共有）
+        conn = storage.connect(self.db_path, readonly=True, pragmas={"cache_size": -16000},
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+class QueryCache:
+    """検索結果の LRU キャッシュ。収集で中身が変わるので ttl 秒で期限切れにする"""
+
+    def __init__(self, maxsize=1024, ttl=10.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+        value = compute()
+        with self._lock:
+            self._data[key] = (now, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+
+def _filters(model=None, categories=None, min_quality=None, nsfw=None):
+    """共通の絞り込み条件を (WHERE 句のリスト, パラメータ) にする"""
+    where, params = [], []
+    if model:
+        where.append("p.model_name = ?")
+        params.append(model)
+    for category in categories or []:
+        where.append("EXISTS (SELECT 1 FROM prompt_categories c WHERE c.prompt_id = p.id AND c.category = ?)")
+        params.append(category)
+    if min_quality is not None:
+        where.append("p.quality_score >= ?")
+        params.append(min_quality)
+    if nsfw:
+        if nsfw not in NSFW_TIERS:
+            raise HTTPException(status_code=400, detail=f"nsfw must be one of {NSFW_TIERS}")
+        stronger = [f"nsfw_{t}" for t in NSFW_TIERS[NSFW_TIERS.index(nsfw) + 1:]]
+        if stronger:
+            where.append(
+                "NOT EXISTS (SELECT 1 FROM prompt_categories c WHERE c.prompt_id = p.id AND c.category IN ("
+                + ", ".join("?" for _ in stronger) + "))"
+            )
+            params.extend(stronger)
+    return where, params
+
+
+def _attach_categories(conn, rows):
+    """行の dict に categories（{category: confidence}）を付ける。ページ分を1クエリで引く"""
+    items = [dict(row) for row in rows]
+    if not items:
+        return items
+    by_id = {item["id"]: item for item in items}
+    for item in items:
+        item["categories"] = {}
+    placeholders = ", ".join("?" for _ in by_id)
+    for prompt_id, category, confidence in conn.execute(
+        f"SELECT prompt_id, category, confidence FROM prompt_categories WHERE prompt_id IN ({placeholders})",
+        list(by_id),
+    ):
+        by_id[prompt_id]["categories"][category] = confidence
+    return items
+
+
+def list_prompts(conn, after_id=0, limit=50, model=None, categories=None, min_quality=None, nsfw=None):
+    where, params = _filters(model, categories, min_quality, nsfw)
+    where.insert(0, "p.id > ?")
+    params.insert(0, after_id)
+    rows = conn.execute(
+        f"SELECT {', '.join('p.' + f for f in PROMPT_FIELDS)} FROM civitai_prompts p "
+        f"WHERE {' AND '.join(where)} ORDER BY p.id LIMIT ?",
+        params + [limit],
+    ).fetchall()
+    items = _attach_categories(conn, rows)
+    return {
+        "items": items,
+        "next_after_id": items[-1]["id"] if len(items) == limit else None,
+    }
+
+
+def sample_prompts(conn, n=1, model=None, categories=None, min_quality=None, nsfw=None, rng=random):
+    """条件に合う行を n 件ランダムに返す
+    ORDER BY RANDOM() で全件を並べ替えず、id の範囲に乱数を打って「その id 以上で条件に合う最初の行」を取る
+    （id に欠番や条件の偏りがあると完全な一様にはならない。重み付きの大量抽選は sampler 側を使う）
+    """
+    where, params = _filters(model, categories, min_quality, nsfw)
+    lo, hi = conn.execute("SELECT MIN(id), MAX(id) FROM civitai_prompts").fetchone()
+    if lo is None:
+        return []
+    sql = (f"SELECT {', '.join('p.' + f for f in PROMPT_FIELDS)} FROM civitai_prompts p "
+           f"WHERE {' AND '.join(['p.id >= ?'] + where)} ORDER BY p.id LIMIT 1")
+    rows, seen = [], set()
+    for _ in range(n * 4):
+        if len(rows) >= n:
+            break
+        row = conn.execute(sql, [rng.randint(lo, hi)] + params).fetchone()
+        if row is None:
+            # 乱数がヒットする行より後ろだった: 先頭から取り直す
+            row = conn.execute(sql, [lo] + params).fetchone()
+            if row is None:
+                break
+        if row["id"] not in seen:
+            seen.add(row["id"])
+            rows.append(row)
+    return _attach_categories(conn, rows)
+
+
+def create_app(db_path, pool_size=8, cache_size=1024, cache_ttl=10.0, enable_wal=True):
+    pool = ReadOnlyPool(db_path, size=pool_size, enable_wal=enable_wal)
+    cache = QueryCache(maxsize=cache_size, ttl=cache_ttl)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        pool.close()
+
+    app = FastAPI(title="CivitAI Prompt API", version="1.0", lifespan=lifespan)
+    app.state.pool = pool
+    app.state.cache = cache
+
+    def cached(name, params, compute):
+        key = (name, json.dumps(params, sort_keys=True))
+        return cache.get_or_compute(key, compute)
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok", "cache": dict(cache.stats)}
+
+    @app.get("/prompts")
+    def get_prompts(after_id: int = 0,
+                    limit: int = Query(50, ge=1, le=500),
+                    model: Optional[str] = None,
+                    category: List[str] = Query(default=[]),
+                    min_quality: Optional[int] = None,
+                    nsfw: Optional[str] = None):
+        params = dict(after_id=after_id, limit=limit, model=model, categories=category,
+                      min_quality=min_quality, nsfw=nsfw)
+
+        def compute():
+            with pool.connection() as conn:
+                return list_prompts(conn, **params)
+        return cached("prompts", params, compute)
+
+    @app.get("/prompts/{prompt_id}")
+    def get_prompt(prompt_id: int):
+        def compute():
+            with pool.connection() as conn:
+                rows = conn.execute(
+                    f"SELECT {', '.join('p.' + f for f in PROMPT_FIELDS)} FROM civitai_prompts p WHERE p.id = ?",
+                    (prompt_id,),
+                ).fetchall()
+                return _attach_categories(conn, rows)
+        items = cached("prompt", {"id": prompt_id}, compute)
+        if not items:
+            raise HTTPException(status_code=404, detail="prompt not found")
+        return items[0]
+
+    @app.get("/sample")
+    def get_sample(n: int = Query(1, ge=1, le=100),
+                   model: Optional[str] = None,
+                   category: List[str] = Query(default=[]),
+                   min_quality: Optional[int] = None,
+                   nsfw: Optional[str] = None):
+        # 毎回違う結果を返すのでキャッシュしない
+        with pool.connection() as conn:
+            return {"items": sample_prompts(conn, n=n, model=model, categories=category,
+                                            min_quality=min_quality, nsfw=nsfw)}
+
+    @app.get("/stats/categories")
+    def get_category_stats(model: List[str] = Query(default=[])):
+        def compute():
+            with pool.connection() as conn:
+                rows = category_stats.model_category_counts(conn, model or None)
+            return [{"model_name": m, "category": c, "count": n} for m, c, n in rows]
+        return cached("stats", {"model": model}, compute)
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Read-only CivitAI prompt API")
+    parser.add_argument("--db", default="civitai_dataset.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--cache-ttl", type=float, default=10.0)
+    args = parser.parse_args()
+    app = create_app(args.db, pool_size=args.pool_size, cache_size=args.cache_size, cache_ttl=args.cache_ttl)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# model_name × category の件数を持つ集計テーブル。prompt_categories / civitai_prompts のトリガーで増減する
+# model_name が NULL か空文字の行は "Unknown" として数える（可視化の表示名 model_name or "Unknown" と同じ）
+STATS_TABLE = "model_category_stats"
+UNKNOWN_MODEL = "Unknown"
+
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_prompt_categories_prompt_id ON prompt_categories (prompt_id)",
+    "CREATE INDEX IF NOT EXISTS idx_civitai_prompts_model_name ON civitai_prompts (model_name)",
+]
+
+_TRIGGERS = {
+    # カテゴリ行の追加: プロンプトが存在する時だけ加算（JOIN 集計と同じく孤立行は数えない）
+    "model_category_stats_ai": f"""
+    CREATE TRIGGER IF NOT EXISTS model_category_stats_ai AFTER INSERT ON prompt_categories BEGIN
+        INSERT INTO {STATS_TABLE} (model_name, category, prompt_count)
+        SELECT COALESCE(NULLIF(p.model_name, ''), '{UNKNOWN_MODEL}'), new.category, 1
+        FROM civitai_prompts p WHERE p.id = new.prompt_id
+        ON CONFLICT (model_name, category) DO UPDATE SET prompt_count = prompt_count + 1;
+    END
+    """,
+    # カテゴリ行の削除
+    "model_category_stats_ad": f"""
+    CREATE TRIGGER IF NOT EXISTS model_category_stats_ad AFTER DELETE ON prompt_categories BEGIN
+        UPDATE {STATS_TABLE} SET prompt_count = prompt_count - 1
+        WHERE category = old.category
+          AND model_name = (SELECT COALESCE(NULLIF(model_name, ''), '{UNKNOWN_MODEL}')
+                            FROM civitai_prompts WHERE id = old.prompt_id);
+    END
+    """,
+    # プロンプトのモデル名が変わった: そのプロンプトのカテゴリ分を旧モデルから新モデルへ移す
+    "model_category_stats_au": f"""
+    CREATE TRIGGER IF NOT EXISTS model_category_stats_au AFTER UPDATE OF model_name ON civitai_prompts
+    WHEN COALESCE(NULLIF(old.model_name, ''), '{UNKNOWN_MODEL}')
+         <> COALESCE(NULLIF(new.model_name, ''), '{UNKNOWN_MODEL}')
+    BEGIN
+        UPDATE {STATS_TABLE} SET prompt_count = prompt_count - (
+            SELECT COUNT(*) FROM prompt_categories c
+            WHERE c.prompt_id = old.id AND c.category = {STATS_TABLE}.category
+        )
+        WHERE model_name = COALESCE(NULLIF(old.model_name, ''), '{UNKNOWN_MODEL}');
+        INSERT INTO {STATS_TABLE} (model_name, category, prompt_count)
+        SELECT COALESCE(NULLIF(new.model_name, ''), '{UNKNOWN_MODEL}'), c.category, COUNT(*)
+        FROM prompt_categories c WHERE c.prompt_id = new.id
+        GROUP BY c.category
+        ON CONFLICT (model_name, category) DO UPDATE SET prompt_count = prompt_count + excluded.prompt_count;
+    END
+    """,
+    # プロンプトの削除: 残ったカテゴリ行は JOIN されなくなるので、その分を引く
+    "model_category_stats_pd": f"""
+    CREATE TRIGGER IF NOT EXISTS model_category_stats_pd AFTER DELETE ON civitai_prompts BEGIN
+        UPDATE {STATS_TABLE} SET prompt_count = prompt_count - (
+            SELECT COUNT(*) FROM prompt_categories c
+            WHERE c.prompt_id = old.id AND c.category = {STATS_TABLE}.category
+        )
+        WHERE model_name = COALESCE(NULLIF(old.model_name, ''), '{UNKNOWN_MODEL}');
+    END
+    """,
+}
+
+
+def setup_aggregates(conn, backfill=True):
+    """集計テーブル・索引・同期用トリガーを作る。新しく作った時は既存行から集計する
+    executescript を使わないので、呼び出し側のトランザクションの中でも使える
+    作成した場合 True、既にあった場合 False を返す
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATS_TABLE,)
+    ).fetchone()
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+        model_name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        prompt_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (model_name, category)
+    ) WITHOUT ROWID
+    """)
+    for sql in _INDEXES:
+        conn.execute(sql)
+    create_triggers(conn)
+    if exists:
+        return False
+    if backfill:
+        rebuild_aggregates(conn)
+    return True
+
+
+def create_triggers(conn):
+    for sql in _TRIGGERS.values():
+        conn.execute(sql)
+
+
+def drop_triggers(conn):
+    """一括で作り直す処理（全件再分類など）の間だけ行ごとの増減を止める。後で rebuild_aggregates + create_triggers"""
+    for name in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_aggregates(conn, commit=True):
+    """集計テーブルを元テーブルから作り直し、集計した (model, category) の組数を返す（既存 DB 用）"""
+    conn.execute(f"DELETE FROM {STATS_TABLE}")
+    cursor = conn.execute(f"""
+    INSERT INTO {STATS_TABLE} (model_name, category, prompt_count)
+    SELECT COALESCE(NULLIF(p.model_name, ''), '{UNKNOWN_MODEL}'), c.category, COUNT(*)
+    FROM civitai_prompts p
+    JOIN prompt_categories c ON p.id = c.prompt_id
+    GROUP BY 1, 2
+    """)
+    if commit:
+        conn.commit()
+    return cursor.rowcount
+
+
+def model_category_counts(conn, models=None):
+    """(model_name, category, count) のリストを返す。models を渡すとそのモデルだけ"""
+    sql = f"SELECT model_name, category, prompt_count FROM {STATS_TABLE} WHERE prompt_count > 0"
+    params = []
+    if models:
+        sql += f" AND model_name IN ({', '.join('?' for _ in models)})"
+        params = list(models)
+    return conn.execute(sql + " ORDER BY model_name, category", params).fetchall()
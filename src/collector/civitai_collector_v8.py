@@ -5,102 +5,209 @@
 # - 収集: API ページング、limit=100、max_items デフォルト 5000
 # - 分類: キーワードベースでカテゴリ分類（NSFW 含む）
 # - 可視化: モデルごとカテゴリ分布をスタック棒グラフで表示
+# - matplotlib / numpy / pyarrow は必要なサブコマンドの中でだけ読み込む（collect / search は起動が軽い）
+#
+# 使い方:
+#   python src/collector/civitai_collector_v8.py collect --model "Realism Illustrious=2091367" --max-items 5000
+#   python src/collector/civitai_collector_v8.py --db civitai_dataset.db recategorize
+#   python src/collector/civitai_collector_v8.py plot --out category_distribution.png
+#   python src/collector/civitai_collector_v8.py report report/ --top-models 30
+#   python src/collector/civitai_collector_v8.py search "1girl, smile" --limit 10
+#   python src/collector/civitai_collector_v8.py export out/ --format parquet --incremental
 
 import requests
 import json
+import hashlib
 import sqlite3
 import time
 from datetime import datetime
-from collections import defaultdict
-import matplotlib.pyplot as plt
-import numpy as np
 import sys
-import re
 import os  # 追加
+import queue
+import threading
+import asyncio
+import tracemalloc
+
+# matplotlib / numpy / pyarrow（exporter）/ dedup（numpy）は使うメソッドの中で import する
+# 収集・検索だけの実行（cron など）で読み込み時間とメモリを払わないため
+import category_stats
+import fts_index
+import storage
+import tags
+from config import CIVITAI_API_ENV
+from http_client import CachedHttpClient, ResponseCache, get_session
+from json_stream import ItemStreamParser, loads as json_loads
+from keyword_matcher import KeywordMatcher
+from metrics import Metrics, profile_call
+from rate_limiter import AdaptiveRateLimiter
+from raw_store import RawPayloadStore
+
+# カテゴリ定義（必要に応じて語彙を追加してください）
+CATEGORIES = {
+    "realism_quality": ["realistic skin", "intricate details", "ultra-detailed", "photorealistic"],
+    "lighting": ["cinematic lighting", "dynamic lighting", "soft lighting", "studio lighting", "dramatic lighting", "golden hour", "backlight", "rim light"],
+    "composition": ["portrait", "full body", "close-up", "upper body", "headshot", "wide shot", "rule of thirds"],
+    "character_features": ["detailed face", "expressive eyes", "facial features", "beautiful", "hands detail"],
+    "technical": ["highres", "masterpiece", "best quality", "high resolution", "8k", "ultra high res"],
+    "texture": ["skin texture", "hair detail", "fabric detail", "detailed texture", "rough texture"],
+    "style": ["anime", "manga", "3d render", "oil painting", "watercolor", "digital art", "photorealism", "realistic"],
+    "mood": ["melancholic", "cheerful", "mysterious", "elegant", "energetic", "moody", "dark"],
+    "nsfw_safe": ["clothed", "sfw", "dress", "casual wear", "fully clothed", "covered"],
+    "nsfw_suggestive": ["cleavage", "revealing clothing", "tight clothing", "suggestive pose", "see-through"],
+    "nsfw_mature": ["lingerie", "underwear", "bikini", "swimsuit", "partial nudity", "braless"],
+    "nsfw_explicit": ["nude", "naked", "nsfw", "explicit", "uncensored", "full nudity"]
+}
+
+# 品質スコア用の語彙（technical は 1語 2点、detail は 1語 1点）
+QUALITY_KEYWORDS = {
+    "technical": ["masterpiece", "best quality", "ultra-detailed", "highres", "high resolution", "8k"],
+    "detail": ["intricate", "detailed", "realistic", "sharp", "clear"],
+}
+
+
+def _process_peak_rss_mb():
+    """プロセス起動からの最大 RSS（MB。_reset_peak_rss で戻した後はそこからの最大）。取得できない環境では None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _reset_peak_rss():
+    """プロセスの最大 RSS（VmHWM / ru_maxrss）を今の RSS に戻す（Linux の /proc/self/clear_refs）。できなければ False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_since_reset_mb():
+    """_reset_peak_rss からの最大 RSS（MB）。読めなければ None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+class StreamBrokenError(Exception):
+    """ページ本文の途中で接続が切れた（それまでの item は返してしまっているので、やり直しは呼び出し側で行う）"""
+
 
 class CivitaiPromptCollector:
-    def __init__(self, db_path="civitai_dataset.db", user_agent=None):
-        self.base_url = "https://civitai.com/api/v1/images"
+    def __init__(self, db_path="civitai_dataset.db", user_agent=None, batch_size=100, base_url=None,
+                 word_boundary=False, cache_path=None, cache_ttl=3600, stream_json=False,
+                 dedup_clusters=False, setup_db=True, collect_metrics=True):
+        self.base_url = base_url or "https://civitai.com/api/v1/images"
         self.db_path = db_path
         self.user_agent = user_agent or "CivitaiPromptCollector/1.0 (+https://example.com)"
-        self.setup_database()
-
-        # カテゴリ定義（必要に応じて語彙を追加してください）
-        self.categories = {
-            "realism_quality": ["realistic skin", "intricate details", "ultra-detailed", "photorealistic"],
-            "lighting": ["cinematic lighting", "dynamic lighting", "soft lighting", "studio lighting", "dramatic lighting", "golden hour", "backlight", "rim light"],
-            "composition": ["portrait", "full body", "close-up", "upper body", "headshot", "wide shot", "rule of thirds"],
-            "character_features": ["detailed face", "expressive eyes", "facial features", "beautiful", "hands detail"],
-            "technical": ["highres", "masterpiece", "best quality", "high resolution", "8k", "ultra high res"],
-            "texture": ["skin texture", "hair detail", "fabric detail", "detailed texture", "rough texture"],
-            "style": ["anime", "manga", "3d render", "oil painting", "watercolor", "digital art", "photorealism", "realistic"],
-            "mood": ["melancholic", "cheerful", "mysterious", "elegant", "energetic", "moody", "dark"],
-            "nsfw_safe": ["clothed", "sfw", "dress", "casual wear", "fully clothed", "covered"],
-            "nsfw_suggestive": ["cleavage", "revealing clothing", "tight clothing", "suggestive pose", "see-through"],
-            "nsfw_mature": ["lingerie", "underwear", "bikini", "swimsuit", "partial nudity", "braless"],
-            "nsfw_explicit": ["nude", "naked", "nsfw", "explicit", "uncensored", "full nudity"]
-        }
+        # ヘッダーは一度だけ作り、接続は共有セッションで使い回す
+        # cache_path を渡すとレスポンスをディスクにキャッシュする（開発中の再実行・クラッシュ後のやり直し用）
+        self.headers = self._build_headers()
+        self.http = CachedHttpClient(
+            get_session(),
+            cache=ResponseCache(cache_path, ttl=cache_ttl) if cache_path else None,
+        )
+        # 何件たまったら1トランザクションで書き込むか（1ページ=20件なので既定は約5ページ分）
+        self.batch_size = max(1, int(batch_size))
+        self._conn = None
+        # 送信レートの制御（初期 1/1.2 req/s、正常応答で徐々に上げ 429 で下げる。Retry-After を優先）
+        # 同期・非同期どちらの取得経路もこの1つを共有する
+        self.rate_limiter = AdaptiveRateLimiter(initial_rate=1 / 1.2, max_rate=5.0)
+        self._throttle_wait = 0.0
+        # モデル名 -> {"pages", "collected", "saved", "done", "aborted"}（acollect_for_models の進捗）
+        self.progress = {}
+        # True ならページ本文をストリーミングで読み、item ごとに生バイト列のまま扱う
+        self.stream_json = stream_json
+        self.last_page_stats = {}
+        self._peak_rss_mb = None  # これまでのページの最大 RSS（_reset_peak_rss で VmHWM を戻すので自分で持つ）
+        # save_prompt_batch の書き込み内訳（新規 / 内容更新 / 数値のみ更新 / 変化なし）
+        self.write_stats = {"inserted": 0, "updated": 0, "stats_only": 0, "unchanged": 0}
+        # 段階ごとの処理時間（fetch / parse / extract / categorize / save / sleep）とカウンタ
+        self.metrics = Metrics(enabled=collect_metrics)
+        # True なら保存のたびに新しい行を MinHash/LSH で近似重複クラスタ（cluster_id）に振り分ける
+        self.dedup_index = None
+        if dedup_clusters:
+            import dedup
+            self.dedup_index = dedup.NearDuplicateIndex()
+        # タグ名 -> tags.id のキャッシュ（書き込みスレッドで使う）
+        self.tag_interner = tags.TagInterner()
+        # raw_metadata の圧縮ストア（学習済み zstd 辞書があれば読み込む）
+        self.raw_store = RawPayloadStore()
+        # setup_db=False は DB に触らない（オフライン処理のワーカーなど、抽出・分類だけに使う場合）
+        if setup_db:
+            self.setup_database()
+            conn = storage.connect(self.db_path)
+            try:
+                self.raw_store.load_dictionaries(conn)
+            finally:
+                conn.close()
+
+        # カテゴリ定義・品質スコア語彙（モジュールの CATEGORIES / QUALITY_KEYWORDS の複製。インスタンスごとに編集してよい）
+        self.categories = {name: list(keywords) for name, keywords in CATEGORIES.items()}
+        self.quality_keywords = {name: list(keywords) for name, keywords in QUALITY_KEYWORDS.items()}
 
         # 単純化のため、キーワードマッチングは小文字で比較する
+        # word_boundary=True にすると "dark" が "darkness" に、"sfw" が "nsfw" にマッチしなくなる
+        self.word_boundary = word_boundary
+        self._match_cache = threading.local()
         self._prepare_keyword_patterns()
 
     def _prepare_keyword_patterns(self):
-        """キーワードリストから正規表現パターンを作る（語順や小文字化に強くする）"""
-        self.category_patterns = {}
-        for cat, keywords in self.categories.items():
-            # escape each keyword, match word boundaries when appropriate
-            patterns = []
-            for kw in keywords:
-                kw_escaped = re.escape(kw.lower())
-                # allow matching inside prompt text (simple contains); use word boundaries for single-word tokens
-                patterns.append(re.compile(kw_escaped))
-            self.category_patterns[cat] = patterns
-
-    def setup_database(self):
-        """SQLite データベースとテーブルを作成"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """カテゴリ語彙と品質スコア語彙から Aho-Corasick マッチャを1つ作る
+        self.categories を編集した後はこれを呼び直すこと
+        """
+        groups = dict(self.categories)
+        for name, keywords in self.quality_keywords.items():
+            groups[f"quality:{name}"] = keywords
+        self.keyword_matcher = KeywordMatcher(groups, word_boundary=self.word_boundary)
 
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS civitai_prompts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            civitai_id TEXT UNIQUE,
-            full_prompt TEXT,
-            negative_prompt TEXT,
-            quality_score INTEGER,
-            reaction_count INTEGER,
-            comment_count INTEGER,
-            download_count INTEGER,
-            prompt_length INTEGER,
-            tag_count INTEGER,
-            model_name TEXT,
-            model_id TEXT,
-            collected_at TIMESTAMP,
-            raw_metadata TEXT
-        )
-        ''')
+    def _match_keywords(self, text):
+        """プロンプトを1回だけ走査して {ラベル: [キーワード, ...]} を返す
+        直前と同じテキストならスレッドごとのキャッシュを返す（抽出→分類で同じ文を2回走査しない）
+        """
+        cache = self._match_cache
+        if getattr(cache, "text", None) == text:
+            return cache.groups
+        groups = self.keyword_matcher.match_groups(text)
+        cache.text, cache.groups = text, groups
+        return groups
 
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prompt_categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prompt_id INTEGER,
-            category TEXT,
-            keywords TEXT,
-            confidence REAL,
-            FOREIGN KEY (prompt_id) REFERENCES civitai_prompts (id)
-        )
-        ''')
+    def setup_database(self):
+        """SQLite データベースを作成し、スキーマを最新にする（storage.COLLECTOR_MIGRATIONS の未適用分を流す）"""
+        conn = storage.connect(self.db_path)
+        try:
+            storage.migrate(conn, storage.COLLECTOR_MIGRATIONS)
+        finally:
+            conn.close()
 
-        conn.commit()
-        conn.close()
+    def search_prompts(self, query, limit=20, offset=0):
+        """full_prompt を bm25 順に検索。(id, civitai_id, model_name, full_prompt, score) のリストを返す
+        カンマ区切りでタグ単位の AND 検索、末尾 * で前方一致。"fts:" で始めると FTS5 の構文として扱う
+        読み取り専用の接続で引く（スキーマが古ければ先に1回だけマイグレーションする。DB が無い・開けない時は sqlite3.Error）
+        """
+        conn = storage.open_readonly(self.db_path, storage.COLLECTOR_MIGRATIONS)
+        try:
+            return fts_index.search(conn, "civitai_prompts", query,
+                                    columns=("id", "civitai_id", "model_name", "full_prompt"),
+                                    limit=limit, offset=offset)
+        finally:
+            conn.close()
 
-    def fetch_batch(self, url_or_params, max_retries=3):
-        """APIから1ページ分を取得（nextPage/cursor対応、リトライ付き）"""
+    def _build_headers(self):
+        """API リクエスト用ヘッダーを作る（APIキー付与・Latin-1 安全化込み）"""
         headers = {
             "User-Agent": self.user_agent,
             "Accept": "application/json",
         }
-        from .config import CIVITAI_API_ENV  # type: ignore
         api_key = os.getenv(CIVITAI_API_ENV)
         if api_key:
             headers["Authorization"] = f"Bearer {api_key}"
@@ -120,35 +227,213 @@ class CivitaiPromptCollector:
         if unsafe:
             print(f"[fetch_batch] sanitized headers with non-latin1 characters: {unsafe}")
         # --- 追加終了 ---
+        return headers
 
+    def _throttle(self):
+        """リクエストを送る直前にレート制御器の枠を待つ（self.http.get の before_request）
+        待った秒数は sleep に入れ、fetch から引けるよう self._throttle_wait にも残す
+        """
+        self._throttle_wait = self.rate_limiter.acquire()
+        self.metrics.add_time("sleep", self._throttle_wait)
+        self.metrics.incr("requests")
+
+    def _http_get(self, url_or_params, stream=False):
+        """1リクエスト分の GET。レート制御の待ちはキャッシュを返さない時だけで、fetch の時間には含めない"""
+        self._throttle_wait = 0.0
+        started = time.perf_counter()
+        if isinstance(url_or_params, dict):
+            response = self.http.get(self.base_url, params=url_or_params, headers=self.headers, timeout=(5, 100),
+                                     stream=stream, before_request=self._throttle)
+        else:
+            response = self.http.get(url_or_params, headers=self.headers, timeout=(5, 100), stream=stream,
+                                     before_request=self._throttle)
+        self.metrics.add_time("fetch", time.perf_counter() - started - self._throttle_wait)
+        return response
+
+    def _classify_response(self, response, attempt, max_retries, tag):
+        """ステータスをレート制御器へ伝え、"ok" / "retry" / "fail" を返す（キャッシュから返した応答は伝えない）"""
+        status = response.status_code
+        if status == 200:
+            if not getattr(response, "from_cache", False):
+                self.rate_limiter.on_success(response.headers)
+            return "ok"
+        if status == 429:
+            self.metrics.incr("rate_limited")
+            wait = self.rate_limiter.on_rate_limited(response.headers, attempt)
+            print(f"[{tag}] 429 Rate limited. Backing off {wait:.1f}s, rate now "
+                  f"{self.rate_limiter.current_rate:.2f} req/s (attempt {attempt}/{max_retries})")
+            return "retry"
+        if status >= 500:
+            self.metrics.incr("server_errors")
+            wait = self.rate_limiter.on_error(attempt)
+            print(f"[{tag}] HTTP {status}. Retrying in {wait:.1f}s (attempt {attempt}/{max_retries})")
+            return "retry"
+        print(f"[{tag}] HTTP {status}: {response.text[:200]}")
+        return "fail"
+
+    def fetch_batch(self, url_or_params, max_retries=5):
+        """APIから1ページ分を取得（nextPage/cursor対応、リトライ付き）
+        送信間隔・待機はすべて self.rate_limiter が決める（固定 sleep はしない。キャッシュから返す時は待たない）
+        リトライを使い切った時は requests.exceptions.RetryError、再送しても変わらない 4xx は
+        requests.exceptions.HTTPError を送出する（「API がもう返さない」と区別するため。空のページは ([], None) で返す）
+        """
+        metrics = self.metrics
         for attempt in range(1, max_retries + 1):
             try:
-                if isinstance(url_or_params, dict):
-                    response = requests.get(self.base_url, params=url_or_params, headers=headers, timeout=(5, 100))
-                else:
-                    response = requests.get(url_or_params, headers=headers, timeout=(5, 100))
-                if response.status_code == 200:
-                    data = response.json()
+                response = self._http_get(url_or_params)
+                action = self._classify_response(response, attempt, max_retries, "fetch_batch")
+                if action == "ok":
+                    metrics.incr("bytes_downloaded", len(response.content))
+                    with metrics.timer("parse"):
+                        data = response.json()
                     items = data.get("items", [])
                     next_page = data.get("metadata", {}).get("nextPage")
+                    metrics.incr("pages")
+                    metrics.incr("items", len(items))
                     return items, next_page
-                elif response.status_code == 429:
-                    wait = 60
-                    print(f"[fetch_batch] 429 Rate limited. Waiting {wait} seconds... (attempt {attempt}/{max_retries})")
-                    time.sleep(wait)
+                elif action == "retry":
                     continue
                 else:
-                    print(f"[fetch_batch] HTTP {response.status_code}: {response.text[:200]}")
-                    return [], None
+                    raise requests.exceptions.HTTPError(
+                        f"HTTP {response.status_code} for: {url_or_params}", response=response)
+            except requests.exceptions.HTTPError:
+                raise
             except requests.exceptions.RequestException as e:
-                print(f"[fetch_batch] Attempt {attempt} failed: {e}")
-                time.sleep(3 * attempt)
+                metrics.incr("request_errors")
+                wait = self.rate_limiter.on_error(attempt)
+                print(f"[fetch_batch] Attempt {attempt} failed: {e} (retrying in {wait:.1f}s)")
+                continue
+        raise requests.exceptions.RetryError(f"All retries failed for: {url_or_params}")
+
+    def _open_stream(self, url_or_params, attempt, max_retries):
+        """ストリーミング取得の1回分のリクエスト。本文を読める応答を返し、リトライする時は None
+        （待ちはレート制御器が次の送信で入れる）。再送しても変わらない 4xx は requests.exceptions.HTTPError
+        読まない応答（429 / 5xx / 4xx）は閉じて接続をプールへ返す
+        """
+        try:
+            response = self._http_get(url_or_params, stream=True)
+        except requests.exceptions.RequestException as e:
+            self.metrics.incr("request_errors")
+            wait = self.rate_limiter.on_error(attempt)
+            print(f"[fetch_batch_stream] Attempt {attempt} failed: {e} (retrying in {wait:.1f}s)")
+            return None
+        action = self._classify_response(response, attempt, max_retries, "fetch_batch_stream")
+        if action == "ok":
+            return response
+        response.close()
+        if action == "retry":
+            return None
+        raise requests.exceptions.HTTPError(f"HTTP {response.status_code} for: {url_or_params}", response=response)
+
+    def _iter_page(self, response, chunk_size=64 * 1024):
+        """応答の本文をチャンクで読みながら (item, 生バイト列) を1件ずつ返す。戻り値は nextPage
+        本文の途中で接続が切れた時は StreamBrokenError（途中まで返した item は呼び出し側で捨てる）
+        """
+        metrics = self.metrics
+        parser = ItemStreamParser()
+        count = 0
+        # ページごとのピーク: RSS の最大値（Linux の VmHWM）をページの最初に今の値へ戻して測る
+        # それができない環境では tracemalloc を始めて Python の割り当てのピークを測る
+        rss_reset = _reset_peak_rss()
+        if not rss_reset and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        # 本文の受信と解析が交互に進むので、チャンク待ちを fetch、feed と loads を parse に分けて足す
+        # （yield の先で使われている時間はどちらにも入れない）
+        fetch_seconds = parse_seconds = 0.0
+        perf_counter = time.perf_counter
+        try:
+            chunks = response.iter_content(chunk_size)
+            while True:
+                started = perf_counter()
+                chunk = next(chunks, None)
+                fetch_seconds += perf_counter() - started
+                if chunk is None:
+                    break
+                started = perf_counter()
+                parsed = [(json_loads(raw), raw) for raw in parser.feed(chunk)]
+                parse_seconds += perf_counter() - started
+                for pair in parsed:
+                    count += 1
+                    yield pair
+        except requests.exceptions.RequestException as e:
+            # 途中まで返した分はここではやり直せないので呼び出し側へ伝える
+            # （None を返すと最後のページと区別できず、チェックポイントが消えてしまう）
+            metrics.incr("request_errors")
+            raise StreamBrokenError(f"stream broken after {count} items: {e}") from e
+        finally:
+            response.close()
+            metrics.add_time("fetch", fetch_seconds, count=0)
+            metrics.add_time("parse", parse_seconds)
+            metrics.incr("bytes_downloaded", parser.bytes_read)
+        rest = parser.close()
+        metrics.incr("pages")
+        metrics.incr("items", count)
+        # page_peak_rss_mb: このページを読んでいる間のプロセスの最大 RSS（他スレッドの分も含む）
+        # page_peak_alloc_mb: このページを読んでいる間に増えた Python の割り当ての最大値（tracemalloc の時だけ）
+        # process_peak_rss_mb: 起動からの最大 RSS（VmHWM を戻しても下がらないよう、これまでのページの最大も含める）
+        page_rss = _peak_rss_since_reset_mb() if rss_reset else None
+        page_alloc = None
+        if tracing:
+            page_alloc = round((tracemalloc.get_traced_memory()[1] - traced_before) / (1024 * 1024), 3)
+        self._peak_rss_mb = max(v for v in (self._peak_rss_mb, page_rss, _process_peak_rss_mb(), 0.0)
+                                if v is not None)
+        self.last_page_stats = {
+            "items": count,
+            "bytes": parser.bytes_read,
+            "page_peak_rss_mb": page_rss,
+            "page_peak_alloc_mb": page_alloc,
+            "process_peak_rss_mb": self._peak_rss_mb or None,
+        }
+        print(f"[fetch_batch_stream] items={count} bytes={parser.bytes_read} "
+              f"page_peak_rss={page_rss} MB page_peak_alloc={page_alloc} MB "
+              f"process_peak_rss={self.last_page_stats['process_peak_rss_mb']} MB")
+        return (rest.get("metadata") or {}).get("nextPage")
+
+    def iter_batch_stream(self, url_or_params, max_retries=5, chunk_size=64 * 1024):
+        """fetch_batch のストリーミング版。本文をチャンクで読みながら (item, 生バイト列) を1件ずつ返す
+        ページ全体の JSON 文字列や item の再シリアライズを持たないので、1ページあたりのピークメモリが小さい
+        ジェネレータの戻り値（StopIteration.value）が nextPage。統計は self.last_page_stats に入る
+        本文の途中で接続が切れた時は StreamBrokenError を送出する（途中まで返した item は呼び出し側で捨てる）
+        リトライを使い切った時は requests.exceptions.RetryError、再送しても変わらない 4xx は requests.exceptions.HTTPError
+        """
+        for attempt in range(1, max_retries + 1):
+            response = self._open_stream(url_or_params, attempt, max_retries)
+            if response is not None:
+                return (yield from self._iter_page(response, chunk_size))
+        raise requests.exceptions.RetryError(f"All retries failed for: {url_or_params}")
+
+    def fetch_batch_stream(self, url_or_params, max_retries=5):
+        """ストリーミングで1ページ分を読み切って ([(item, 生バイト列), ...], nextPage) を返す
+        本文の途中で切れたページは、読んだ分を捨ててページの先頭から取り直す
+        429 / 5xx / 通信エラー / 本文の途中の切断を合わせて max_retries 回まで（リトライは1か所だけで数える）
+        """
+        for attempt in range(1, max_retries + 1):
+            response = self._open_stream(url_or_params, attempt, max_retries)
+            if response is None:
                 continue
-        print("[fetch_batch] All retries failed for:", url_or_params)
-        return [], None
+            pairs = []
+            stream = self._iter_page(response)
+            try:
+                while True:
+                    try:
+                        pairs.append(next(stream))
+                    except StopIteration as stop:
+                        return pairs, stop.value
+            except StreamBrokenError as e:
+                if attempt == max_retries:
+                    raise
+                wait = self.rate_limiter.on_error(attempt)
+                print(f"[fetch_batch_stream] Refetching page ({e}); retrying in {wait:.1f}s")
+        raise requests.exceptions.RetryError(f"All retries failed for: {url_or_params}")
 
-    def extract_prompt_data(self, item):
-        """API レスポンス項目から必要フィールドを抜き出す"""
+    def extract_prompt_data(self, item, raw=None):
+        """API レスポンス項目から必要フィールドを抜き出す
+        raw（ストリーミング取得した元 JSON のバイト列）があれば raw_metadata は再シリアライズせずそれを使う
+        """
         try:
             meta = item.get("meta", {}) or {}
             stats = item.get("stats", {}) or {}
@@ -165,12 +450,15 @@ class CivitaiPromptCollector:
                 "download_count": stats.get("downloadCount", 0),
                 "model_name": meta.get("Model") or meta.get("model") or item.get("model") or "",
                 "model_id": str(item.get("modelId") or meta.get("ModelId") or ""),
-                "raw_metadata": json.dumps(item, ensure_ascii=False)
+                "raw_metadata": raw.decode("utf-8") if raw is not None else json.dumps(item, ensure_ascii=False)
             }
 
             prompt_text = prompt_data["full_prompt"] or ""
             prompt_data["prompt_length"] = len(prompt_text)
-            prompt_data["tag_count"] = len([t for t in [s.strip() for s in prompt_text.split(",")] if t])
+            # 正規化したタグは prompt_tags の書き込みにそのまま使う
+            prompt_data["tags"] = tags.split_tags(prompt_text)
+            # tag_count は従来どおりカンマ区切りの要素数（括弧グループを展開したタグ数ではない）
+            prompt_data["tag_count"] = tags.count_segments(prompt_text)
             prompt_data["quality_score"] = self.calculate_quality_score(prompt_text, stats)
 
             return prompt_data
@@ -181,13 +469,10 @@ class CivitaiPromptCollector:
     def calculate_quality_score(self, prompt, stats):
         """シンプルな品質スコア計算（キーワード＋リアクション）"""
         score = 0
-        pl = (prompt or "").lower()
-
-        technical_keywords = ["masterpiece", "best quality", "ultra-detailed", "highres", "high resolution", "8k"]
-        score += sum(2 for kw in technical_keywords if kw in pl)
+        matched = self._match_keywords(prompt or "")
 
-        detail_keywords = ["intricate", "detailed", "realistic", "sharp", "clear"]
-        score += sum(1 for kw in detail_keywords if kw in pl)
+        score += 2 * len(matched.get("quality:technical", []))
+        score += len(matched.get("quality:detail", []))
 
         reactions = stats.get("reactionCount", 0)
         score += min(reactions // 5, 20)
@@ -201,15 +486,11 @@ class CivitaiPromptCollector:
     def categorize_prompt(self, prompt_text):
         """キーワードマッチベースのカテゴリ分け。返却: {category: {keywords: [...], confidence: float}}"""
         categories_found = {}
-        text = (prompt_text or "").lower()
-
-        # キーワードのパターンでマッチを探す
-        for category, patterns in self.category_patterns.items():
-            found = []
-            for pat in patterns:
-                if pat.search(text):
-                    # マッチした語句を取り出（pattern.pattern から人間用に加工）
-                    found.append(pat.pattern)
+        matched = self._match_keywords(prompt_text or "")
+
+        # マッチャが返したヒットをカテゴリごとに集計
+        for category in self.categories:
+            found = matched.get(category)
             if found:
                 # 簡易 confidence = マッチ語数 / 定義語数
                 confidence = float(len(found)) / max(1, len(self.categories.get(category, [])))
@@ -221,123 +502,710 @@ class CivitaiPromptCollector:
 
         return categories_found
 
-    def save_prompt_data(self, prompt_data):
-        """DB に保存。既存の civitai_id があれば更新して prompt_id を返す"""
-        conn = sqlite3.connect(self.db_path)
+    def _get_connection(self):
+        """書き込み用の長寿命コネクションを返す（初回のみ接続）"""
+        if self._conn is None:
+            self._conn = storage.connect(self.db_path)
+        return self._conn
+
+    def close(self):
+        """長寿命コネクションを閉じる"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _lookup_prompt_ids(self, cursor, civitai_ids):
+        """civitai_id -> civitai_prompts.id の対応をまとめて引く（IN 句はチャンク分割）"""
+        id_map = {}
+        chunk = 500
+        for i in range(0, len(civitai_ids), chunk):
+            part = civitai_ids[i:i + chunk]
+            placeholders = ",".join("?" * len(part))
+            cursor.execute(
+                f"SELECT civitai_id, id FROM civitai_prompts WHERE civitai_id IN ({placeholders})",
+                part,
+            )
+            id_map.update(cursor.fetchall())
+        return id_map
+
+    def _lookup_existing(self, cursor, civitai_ids):
+        """civitai_id -> (id, content_hash, stats_hash) をまとめて引く（IN 句はチャンク分割）"""
+        existing = {}
+        chunk = 500
+        for i in range(0, len(civitai_ids), chunk):
+            part = civitai_ids[i:i + chunk]
+            placeholders = ",".join("?" * len(part))
+            cursor.execute(
+                f"SELECT civitai_id, id, content_hash, stats_hash FROM civitai_prompts "
+                f"WHERE civitai_id IN ({placeholders})",
+                part,
+            )
+            for civitai_id, prompt_id, content_hash, stats_hash in cursor.fetchall():
+                existing[civitai_id] = (prompt_id, content_hash, stats_hash)
+        return existing
+
+    @staticmethod
+    def _hash_fields(*values):
+        """値の並びから短いハッシュ（hex）を作る"""
+        h = hashlib.blake2b(digest_size=16)
+        for v in values:
+            h.update(str(v if v is not None else "").encode("utf-8"))
+            h.update(b"\x1f")
+        return h.hexdigest()
+
+    def _change_hashes(self, prompt_data):
+        """(content_hash, stats_hash) を返す
+        content_hash: カテゴリ分けに影響する項目（プロンプト・ネガティブ・モデル）
+        stats_hash: リアクション等の数値と品質スコア
+        """
+        content_hash = self._hash_fields(
+            prompt_data["full_prompt"], prompt_data["negative_prompt"],
+            prompt_data["model_name"], prompt_data["model_id"],
+        )
+        stats_hash = self._hash_fields(
+            prompt_data["reaction_count"], prompt_data["comment_count"],
+            prompt_data["download_count"], prompt_data["quality_score"],
+        )
+        return content_hash, stats_hash
+
+    def save_prompt_batch(self, prompt_list, conn=None, force=False, raise_errors=False, keep_collected_at=False):
+        """複数件を1トランザクションでまとめて保存。処理件数（変化なしも含む）を返す
+        既存行とハッシュを比べて 3通りに振り分ける:
+          - 新規 / 内容が変わった行: UPSERT してカテゴリを作り直す
+          - 数値だけ変わった行: カウンタ類だけ UPDATE（再分類しない）
+          - 変化なし: 書き込まない
+        内訳は self.write_stats に積算する。conn を省略するとインスタンスの長寿命コネクションを使う
+        force=True なら内容が同じでも全件 UPSERT してカテゴリ・タグを作り直す（語彙を変えた後の再処理用）
+        keep_collected_at=True なら既存行の collected_at を変えない（保存済みデータの再処理用。
+        collected_at は差分出力の位置なので、収集していない行の値を進めると次の差分出力に全部入ってしまう）
+        書き込みに失敗するとロールバックして 0 を返す（空のバッチと区別できないので、
+        失敗を知る必要がある呼び出し側は raise_errors=True で例外を受け取る）
+        """
+        # 同一バッチ内で civitai_id が重複した場合は後勝ち
+        records = {}
+        for p in prompt_list:
+            if p and p.get("civitai_id"):
+                records[p["civitai_id"]] = p
+        if not records:
+            return 0
+
+        conn = conn or self._get_connection()
         cursor = conn.cursor()
+        collected_at = datetime.now().isoformat()
+        # 既存行に書く collected_at（None なら SQL の COALESCE で今の値を残す）
+        existing_collected_at = None if keep_collected_at else collected_at
+        metrics = self.metrics
+        save_started = time.perf_counter()
         try:
-            # UPSERT 相当の処理: 既存なら更新、存在しなければ挿入
-            cursor.execute('''
-            INSERT INTO civitai_prompts
-            (civitai_id, full_prompt, negative_prompt, quality_score,
-             reaction_count, comment_count, download_count, prompt_length, tag_count,
-             model_name, model_id, collected_at, raw_metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(civitai_id) DO UPDATE SET
-                full_prompt=excluded.full_prompt,
-                negative_prompt=excluded.negative_prompt,
-                quality_score=excluded.quality_score,
-                reaction_count=excluded.reaction_count,
-                comment_count=excluded.comment_count,
-                download_count=excluded.download_count,
-                prompt_length=excluded.prompt_length,
-                tag_count=excluded.tag_count,
-                model_name=excluded.model_name,
-                model_id=excluded.model_id,
-                collected_at=excluded.collected_at,
-                raw_metadata=excluded.raw_metadata
-            ''', (
-                prompt_data["civitai_id"],
-                prompt_data["full_prompt"],
-                prompt_data["negative_prompt"],
-                prompt_data["quality_score"],
-                prompt_data["reaction_count"],
-                prompt_data["comment_count"],
-                prompt_data["download_count"],
-                prompt_data["prompt_length"],
-                prompt_data["tag_count"],
-                prompt_data["model_name"],
-                prompt_data["model_id"],
-                datetime.now().isoformat(),
-                prompt_data["raw_metadata"]
-            ))
-            conn.commit()
+            existing = self._lookup_existing(cursor, list(records.keys()))
+            upserts = []
+            stats_updates = []
+            unchanged = 0
+            for civitai_id, p in records.items():
+                content_hash, stats_hash = self._change_hashes(p)
+                old = existing.get(civitai_id)
+                if force or old is None or old[1] != content_hash:
+                    upserts.append((p, content_hash, stats_hash))
+                elif old[2] != stats_hash:
+                    stats_updates.append((
+                        p["quality_score"],
+                        p["reaction_count"],
+                        p["comment_count"],
+                        p["download_count"],
+                        stats_hash,
+                        existing_collected_at,
+                        old[0]
+                    ))
+                else:
+                    unchanged += 1
 
-            # prompt_id を取得
-            cursor.execute('SELECT id FROM civitai_prompts WHERE civitai_id = ?', (prompt_data["civitai_id"],))
-            row = cursor.fetchone()
-            prompt_id = row[0] if row else None
+            # 生データは圧縮して raw_payloads へ（同じ内容なら1回だけ保存）
+            raw_payloads = {
+                p["civitai_id"]: p.get("raw_payload") or self.raw_store.encode(p["raw_metadata"])
+                for p, _, _ in upserts
+            }
+            storage.insert_raw_payloads(cursor, list(raw_payloads.values()))
+            if self.dedup_index is not None:
+                # 内容が変わる既存行は書き換える前にクラスタから外す（代表だった時は残りのメンバーから選び直す）
+                self.dedup_index.release(conn, [
+                    existing[p["civitai_id"]][0] for p, content_hash, _ in upserts
+                    if p["civitai_id"] in existing and existing[p["civitai_id"]][1] != content_hash
+                ])
+            storage.upsert_civitai_prompts(cursor, [(
+                p["civitai_id"],
+                p["full_prompt"],
+                p["negative_prompt"],
+                p["quality_score"],
+                p["reaction_count"],
+                p["comment_count"],
+                p["download_count"],
+                p["prompt_length"],
+                p["tag_count"],
+                p["model_name"],
+                p["model_id"],
+                existing_collected_at if p["civitai_id"] in existing else collected_at,
+                content_hash,
+                stats_hash,
+                raw_payloads[p["civitai_id"]][0]
+            ) for p, content_hash, stats_hash in upserts])
+            storage.update_prompt_stats(cursor, stats_updates)
 
-            # 既存のカテゴリを一旦削除してから新規挿入（重複防止）
-            if prompt_id:
-                cursor.execute('DELETE FROM prompt_categories WHERE prompt_id = ?', (prompt_id,))
-                categories = self.categorize_prompt(prompt_data["full_prompt"])
+            # 再分類が必要な行の prompt_id はバッチ単位で1回だけ引く
+            id_map = self._lookup_prompt_ids(cursor, [p["civitai_id"] for p, _, _ in upserts])
+
+            category_rows = []
+            for p, _, _ in upserts:
+                prompt_id = id_map.get(p["civitai_id"])
+                if not prompt_id:
+                    continue
+                categories = p.get("categories")
+                if categories is None:
+                    categories = self.categorize_prompt(p["full_prompt"])
                 for category, data in categories.items():
-                    cursor.execute('''
-                    INSERT INTO prompt_categories (prompt_id, category, keywords, confidence)
-                    VALUES (?, ?, ?, ?)
-                    ''', (
+                    category_rows.append((
                         prompt_id,
                         category,
                         json.dumps(data["keywords"], ensure_ascii=False),
                         data["confidence"]
                     ))
-                conn.commit()
-            return True
+            # 既存のカテゴリを一旦削除してから新規挿入（重複防止）
+            storage.replace_categories(cursor, id_map.values(), category_rows)
+
+            # タグ行も内容が変わった行だけ作り直す
+            tags.write_prompt_tags(cursor, self.tag_interner, {
+                id_map[p["civitai_id"]]: p["tags"] if p.get("tags") is not None else tags.split_tags(p["full_prompt"])
+                for p, _, _ in upserts if p["civitai_id"] in id_map
+            })
+            conn.commit()
+
+            inserted = sum(1 for p, _, _ in upserts if p["civitai_id"] not in existing)
+            self.write_stats["inserted"] += inserted
+            self.write_stats["updated"] += len(upserts) - inserted
+            self.write_stats["stats_only"] += len(stats_updates)
+            self.write_stats["unchanged"] += unchanged
+            saved = len(upserts) + len(stats_updates) + unchanged
         except Exception as e:
-            print("[save_prompt_data] Database error:", e)
-            return False
+            conn.rollback()
+            # ロールバックで消えた tags.id を覚えていないように
+            self.tag_interner.clear()
+            metrics.add_time("save", time.perf_counter() - save_started)
+            metrics.incr("save_errors")
+            print("[save_prompt_batch] Database error:", e)
+            if raise_errors:
+                raise
+            return 0
+        metrics.add_time("save", time.perf_counter() - save_started)
+        metrics.incr("rows_written", len(upserts) + len(stats_updates))
+
+        if self.dedup_index is not None and upserts:
+            # このバッチで新規・内容が変わった行（cluster_id が NULL）だけをクラスタに振り分ける
+            # （それ以外の未処理の行は assign_clusters の backfill に任せる）
+            try:
+                with metrics.timer("dedup"):
+                    self.dedup_index.assign_ids(conn, id_map.values())
+            except sqlite3.Error as e:
+                conn.rollback()
+                print("[save_prompt_batch] Dedup error:", e)
+        return saved
+
+    def save_prompt_data(self, prompt_data):
+        """DB に1件保存（save_prompt_batch の1件版）。成功なら True"""
+        return self.save_prompt_batch([prompt_data]) > 0
+
+    def recategorize_all(self, chunk_size=5000):
+        """civitai_prompts 全件を現在の語彙で再分類し、prompt_categories を1トランザクションで作り直す
+        full_prompt を id 順に chunk_size 件ずつ読み、プロンプト×キーワードのヒット行列（bool）から
+        カテゴリごとのヒット数・confidence を行列演算で求める。メモリ使用量はチャンクサイズで頭打ち
+        - チャンク内で同じ full_prompt は1回だけ照合し、ヒット行列はまとめて（行・列の添字配列で）埋める
+        - 専用の接続で書く（self._conn に開いたままのトランザクションがあれば先にコミットして書き込みロックを放す）
+        """
+        import numpy as np
+
+        matcher = self.keyword_matcher
+        categories = list(self.categories)
+        keyword_count = len(matcher.keywords)
+
+        # キーワード×カテゴリの所属行列と、カテゴリごとの定義語数
+        membership = np.zeros((keyword_count, len(categories)), dtype=np.float32)
+        for j, category in enumerate(categories):
+            for kid in matcher.group_order.get(category, []):
+                membership[kid, j] = 1.0
+        category_sizes = np.array([max(1, len(self.categories[c])) for c in categories], dtype=np.float32)
+        nsfw_columns = np.array([c.startswith("nsfw_") for c in categories])
+        safe_column = categories.index("nsfw_safe") if "nsfw_safe" in categories else None
+
+        keyword_json = {}  # ヒットしたキーワード番号の組 -> JSON 文字列
+        if self._conn is not None and self._conn.in_transaction:
+            self._conn.commit()
+        conn = storage.connect(self.db_path)
+        cursor = conn.cursor()
+        started = time.perf_counter()
+        total_rows = 0
+        total_category_rows = 0
+        last_id = 0
+        try:
+            cursor.execute("BEGIN")
+            # 全行を入れ替えるので集計は行ごとに増減させず、最後にまとめて作り直す
+            category_stats.drop_triggers(cursor)
+            cursor.execute("DELETE FROM prompt_categories")
+            while True:
+                cursor.execute(
+                    "SELECT id, full_prompt FROM civitai_prompts WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, chunk_size),
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                # 重複を除いたプロンプト×キーワードのヒット行列（行 = unique の順番）
+                unique = {}
+                inverse = np.fromiter((unique.setdefault(prompt or "", len(unique)) for _, prompt in rows),
+                                      dtype=np.intp, count=len(rows))
+                kid_sets = [matcher.match_ids(text) for text in unique]
+                hits = np.zeros((len(unique), keyword_count), dtype=bool)
+                hit_rows = np.repeat(np.arange(len(kid_sets)), [len(k) for k in kid_sets])
+                hit_cols = np.fromiter((kid for kids in kid_sets for kid in kids), dtype=np.intp, count=len(hit_rows))
+                hits[hit_rows, hit_cols] = True
+                counts = hits.astype(np.float32) @ membership
+                confidence = counts / category_sizes
+
+                # (unique の行, カテゴリ) ごとの行を1回だけ作り、同じプロンプトの行で使い回す
+                # キーワードの組み合わせは少ないので JSON 文字列も組み合わせごとに1回だけ作る
+                per_prompt = {}
+                for u, j in zip(*(idx.tolist() for idx in np.nonzero(counts))):
+                    category = categories[j]
+                    found = tuple(kid for kid in matcher.group_order[category] if kid in kid_sets[u])
+                    dumped = keyword_json.get(found)
+                    if dumped is None:
+                        dumped = keyword_json[found] = json.dumps([matcher.keywords[kid] for kid in found],
+                                                                  ensure_ascii=False)
+                    per_prompt[u, j] = (category, dumped, float(confidence[u, j]))
+                inverse_list = inverse.tolist()
+                category_rows = []
+                row_idx, col_idx = np.nonzero(counts[inverse])
+                for i, j in zip(row_idx.tolist(), col_idx.tolist()):
+                    category, keywords, value = per_prompt[inverse_list[i], j]
+                    category_rows.append((rows[i][0], category, keywords, value))
+                # NSFW 系が一切見つからなければ safe と仮定（categorize_prompt と同じ規則）
+                if safe_column is not None:
+                    no_nsfw = ~(counts[:, nsfw_columns] > 0).any(axis=1)[inverse]
+                    for i in np.nonzero(no_nsfw)[0].tolist():
+                        category_rows.append((
+                            rows[i][0], "nsfw_safe", json.dumps(["default_safe"]), 0.5
+                        ))
+
+                cursor.executemany(storage.INSERT_CATEGORY, category_rows)
+                total_rows += len(rows)
+                total_category_rows += len(category_rows)
+                elapsed = time.perf_counter() - started
+                print(f"[recategorize_all] {total_rows} rows ({total_rows / max(elapsed, 1e-9):.0f} rows/s)")
+            category_stats.rebuild_aggregates(cursor, commit=False)
+            category_stats.create_triggers(cursor)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print("[recategorize_all] Database error:", e)
+            raise
         finally:
             conn.close()
 
-    def collect_dataset(self, model_id=None, model_name=None, max_items=5000):
+        elapsed = time.perf_counter() - started
+        result = {
+            "rows": total_rows,
+            "category_rows": total_category_rows,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(total_rows / max(elapsed, 1e-9), 1),
+        }
+        print(f"[recategorize_all] Completed: {result}")
+        return result
+
+    def get_raw_metadata(self, civitai_id):
+        """1件分の API 生データを必要になった時だけ展開して dict で返す（無ければ None）"""
+        conn = storage.connect(self.db_path)
+        try:
+            row = conn.execute('''
+            SELECT r.codec, r.payload, p.raw_metadata
+            FROM civitai_prompts p
+            LEFT JOIN raw_payloads r ON r.hash = p.raw_hash
+            WHERE p.civitai_id = ?
+            ''', (str(civitai_id),)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        codec, payload, legacy = row
+        if payload is not None:
+            return json.loads(self.raw_store.decode(codec, payload))
+        # 移行前の行は raw_metadata 列にそのまま入っている
+        return json.loads(legacy) if legacy else None
+
+    def migrate_raw_metadata(self, chunk_size=2000, train_dictionary=True, vacuum=True):
+        """既存 DB の raw_metadata 列を raw_payloads へ圧縮・重複排除して移す
+        train_dictionary=True かつ zstandard があれば、先にサンプルから辞書を学習する
+        """
+        conn = self._get_connection()
+        started = time.perf_counter()
+        if train_dictionary and self.raw_store.active_dict_id is None:
+            samples = [r[0] for r in conn.execute(
+                "SELECT raw_metadata FROM civitai_prompts WHERE raw_metadata IS NOT NULL "
+                "ORDER BY RANDOM() LIMIT 2000"
+            )]
+            if len(samples) >= 100:
+                dict_id = self.raw_store.train_dictionary(conn, samples)
+                if dict_id is not None:
+                    print(f"[migrate_raw_metadata] Trained zstd dictionary id={dict_id} from {len(samples)} samples")
+
+        moved = 0
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, raw_metadata FROM civitai_prompts "
+                "WHERE id > ? AND raw_metadata IS NOT NULL ORDER BY id LIMIT ?",
+                (last_id, chunk_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            encoded = [(pid, self.raw_store.encode(raw)) for pid, raw in rows]
+            conn.executemany(
+                "INSERT OR IGNORE INTO raw_payloads (hash, codec, payload) VALUES (?, ?, ?)",
+                [payload for _, payload in encoded],
+            )
+            conn.executemany(
+                "UPDATE civitai_prompts SET raw_hash = ?, raw_metadata = NULL WHERE id = ?",
+                [(payload[0], pid) for pid, payload in encoded],
+            )
+            conn.commit()
+            moved += len(rows)
+            print(f"[migrate_raw_metadata] moved {moved} rows")
+
+        purged = self.purge_raw_payloads()
+        if vacuum and moved:
+            conn.execute("VACUUM")
+        result = {"moved": moved, "purged": purged, "seconds": round(time.perf_counter() - started, 3)}
+        print(f"[migrate_raw_metadata] Completed: {result}")
+        return result
+
+    def purge_raw_payloads(self):
+        """どの行からも参照されなくなった raw_payloads を削除し、削除件数を返す"""
+        conn = self._get_connection()
+        cursor = conn.execute('''
+        DELETE FROM raw_payloads
+        WHERE hash NOT IN (SELECT raw_hash FROM civitai_prompts WHERE raw_hash IS NOT NULL)
+        ''')
+        conn.commit()
+        return cursor.rowcount
+
+    def prepare_item(self, item, model_id=None, model_name=None, raw=None):
+        """1件を抽出＋カテゴリ分けまで済ませ、save_prompt_batch に渡す dict を返す。対象外なら None
+        DB には触らないので、収集のワーカースレッドや offline.py のワーカープロセスから呼べる
+        """
+        # 1件ごとに呼ばれるので計測は perf_counter だけで取り、最後に1回で記録する
+        started = time.perf_counter()
+        prompt_data = self.extract_prompt_data(item, raw)
+        extracted = time.perf_counter()
+        if not prompt_data:
+            return None
+        if model_name and not prompt_data.get("model_name"):
+            prompt_data["model_name"] = model_name
+        if model_id and not prompt_data.get("model_id"):
+            prompt_data["model_id"] = str(model_id)
+        if not prompt_data.get("full_prompt"):
+            return None
+        categorize_started = time.perf_counter()
+        prompt_data["categories"] = self.categorize_prompt(prompt_data["full_prompt"])
+        categorized = time.perf_counter()
+        prompt_data["raw_payload"] = self.raw_store.encode(prompt_data["raw_metadata"])
+        self.metrics.add_times((
+            ("extract", extracted - started),
+            ("categorize", categorized - categorize_started),
+            ("compress", time.perf_counter() - categorized),
+        ))
+        return prompt_data
+
+    def get_collection_state(self, model_id=None, sort="Most Reactions", conn=None):
+        """collection_state から (next_page, high_water_id) を返す。記録が無ければ (None, None)"""
+        own = conn is None
+        conn = conn or storage.connect(self.db_path)
+        try:
+            row = conn.execute(
+                "SELECT next_page, high_water_id FROM collection_state WHERE model_key = ? AND sort = ?",
+                (str(model_id or "ALL"), sort),
+            ).fetchone()
+            return (row[0], row[1]) if row else (None, None)
+        finally:
+            if own:
+                conn.close()
+
+    def _save_collection_state(self, conn, model_id, sort, next_page, high_water_id):
+        """チェックポイント（次に取りに行く nextPage と最大 civitai_id）を記録
+        high_water_id は増やす一方で、None なら今の値を残す
+        """
+        conn.execute('''
+        INSERT INTO collection_state (model_key, sort, next_page, high_water_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(model_key, sort) DO UPDATE SET
+            next_page=excluded.next_page,
+            high_water_id=MAX(COALESCE(collection_state.high_water_id, excluded.high_water_id),
+                              COALESCE(excluded.high_water_id, collection_state.high_water_id)),
+            updated_at=excluded.updated_at
+        ''', (str(model_id or "ALL"), sort, next_page, high_water_id, datetime.now().isoformat()))
+        conn.commit()
+
+    def _all_known(self, conn, batch):
+        """ページ内の civitai_id がすべて DB に既にあるか"""
+        ids = [str(item.get("id", "")) for item in batch if item.get("id") is not None]
+        if not ids:
+            return False
+        return len(self._lookup_prompt_ids(conn.cursor(), ids)) == len(set(ids))
+
+    def _page_known(self, conn, batch, high_water_id):
+        """new_since の打ち切り判定。最後まで終わった前回の Newest 収集の最大 civitai_id（high_water_id）以下の
+        id だけなら DB を引かずに既知とみなす。それ以外（初回・前回が中断・数値でない id）は DB と照合する
+        """
+        ids = [item.get("id") for item in batch if item.get("id") is not None]
+        if high_water_id and ids and all(str(i).isdigit() and int(i) <= high_water_id for i in ids):
+            return True
+        return self._all_known(conn, batch)
+
+    def collect_dataset(self, model_id=None, model_name=None, max_items=5000, num_workers=2, queue_size=4,
+                        sort="Most Reactions", new_since=False, resume=True):
         """1モデル分（もしくは全体）の収集。model_id を None にすると modelId フィルタ無しで取得
         nextPage/cursorベースでページング対応
+        取得スレッド → 抽出/分類ワーカー(num_workers) → 書き込みスレッド のパイプラインで処理し、
+        各段の間は queue_size の有界キューで背圧をかける
+        - 書き込みが確定したページまでの nextPage を collection_state に記録し、
+          resume=True なら中断した位置から再開する（最後まで終われば記録は消える）
+        - max_items で打ち切った時は、まだ取っていないページがあるのでカーソルを残す
+          （途中で切ったページはそのページから取り直す）
+        - high_water_id（ここまでは全部取った最大 civitai_id）は最後まで終わった時だけ進める
+        - new_since=True: Newest 順で取得し、1ページ丸ごと既知の civitai_id なら打ち切る（差分収集）
+        - 取得が失敗した（リトライ切れ・4xx・本文の途中で切断）時は中断扱いにして、チェックポイントを残す
+          戻り値の "aborted" が True になる
+        - どこかのスレッドが想定外の例外で落ちた時は全段を止め（キューで待ち続けない）、
+          チェックポイントを残したまま、その例外を呼び出し元に送出する
         """
+        if new_since:
+            sort = "Newest"
         print(f"\n=== Collecting: {model_name or 'ALL_MODELS'} (model_id={model_id}) ===")
-        collected = 0
-        saved = 0
-        params = {"limit": 20, "sort": "Most Reactions"}
+        params = {"limit": 20, "sort": sort}
         # デバッグ: APIパラメータ
         print(f"[collect_dataset] API params: {params}")
         if model_id:
             params["modelVersionId"] = model_id
             print(f"[collect_dataset] modelVersionId set: {model_id}")
 
-        next_page_url = None
-        page_count = 1
-        while collected < max_items:
-            if next_page_url:
-                print(f"[collect_dataset] Fetching nextPage (collected: {collected}/{max_items})")
-                batch, next_page_url = self.fetch_batch(next_page_url)
-            else:
-                print(f"[collect_dataset] Fetching page {page_count} (collected: {collected}/{max_items})")
-                batch, next_page_url = self.fetch_batch(params)
-            # デバッグ: APIレスポンス件数
-            print(f"[collect_dataset] API batch items: {len(batch)}")
-            if not batch:
-                print("[collect_dataset] No more items returned by API for this page/params.")
-                break
-            for item in batch:
-                if collected >= max_items:
-                    break
-                prompt_data = self.extract_prompt_data(item)
-                if prompt_data:
-                    if model_name and not prompt_data.get("model_name"):
-                        prompt_data["model_name"] = model_name
-                    if model_id and not prompt_data.get("model_id"):
-                        prompt_data["model_id"] = str(model_id)
-                    if prompt_data.get("full_prompt"):
-                        ok = self.save_prompt_data(prompt_data)
-                        if ok:
-                            saved += 1
-                collected += 1
-            page_count += 1
-            time.sleep(1.2)
-            if not next_page_url:
-                break
-        print(f"[collect_dataset] Completed: saved {saved}/{collected} items for model '{model_name or model_id}'")
-        return {"collected": collected, "saved": saved}
+        num_workers = max(1, int(num_workers))
+        page_queue = queue.Queue(maxsize=queue_size)
+        write_queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        aborted = threading.Event()  # 取得・書き込みが失敗した（= チェックポイントを消さない）
+        crashed = threading.Event()  # どこかの段が例外で落ちた（相手のいないキューで待たない）
+        truncated = threading.Event()  # max_items で打ち切った（= まだ続きがあるのでカーソルを消さない）
+        errors = []
+        done = object()  # 終端マーカー
+        result = {"collected": 0, "saved": 0}
+
+        def put(q, item):
+            """q に入れる。落ちた段があって受け取り手がいなくなったら諦めて False"""
+            while not crashed.is_set():
+                try:
+                    q.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(q):
+            """q から取り出す。落ちた段があって送り手がいなくなったら終端マーカーを返す"""
+            while not crashed.is_set():
+                try:
+                    return q.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+            return done
+
+        def stage(name, body):
+            """各スレッドの本体を包む。例外で落ちたら全段を止め、例外は呼び出し元で送出し直す"""
+            def run():
+                try:
+                    body()
+                except BaseException as e:
+                    print(f"[collect_dataset] {name} failed, stopping the pipeline: {e!r}")
+                    errors.append(e)
+                    aborted.set()
+                    stop.set()
+                    crashed.set()
+            return run
+
+        next_page_url, known_high_water = self.get_collection_state(model_id, sort)
+        if next_page_url:
+            # 前回が途中で止まっている時は、high_water_id より小さい id にもまだ取っていないものがある
+            known_high_water = None
+        if not resume:
+            next_page_url = None
+        if next_page_url:
+            print(f"[collect_dataset] Resuming from checkpoint: {next_page_url}")
+
+        def fetch(url_or_params):
+            """1ページ取得して [(item, 生バイト列 or None), ...] と nextPage を返す"""
+            if self.stream_json:
+                return self.fetch_batch_stream(url_or_params)
+            batch, next_page = self.fetch_batch(url_or_params)
+            return [(item, None) for item in batch], next_page
+
+        def fetcher():
+            nonlocal next_page_url
+            page_count = 1
+            seq = 0
+            # 既知 ID 判定用の読み取り専用コネクション
+            read_conn = storage.connect(self.db_path) if new_since else None
+            try:
+                while result["collected"] < max_items and not stop.is_set():
+                    page_cursor = next_page_url  # このページを取った位置（途中で切った時はここから取り直す）
+                    try:
+                        if next_page_url:
+                            print(f"[collect_dataset] Fetching nextPage (collected: {result['collected']}/{max_items})")
+                            batch, next_page_url = fetch(next_page_url)
+                        else:
+                            print(f"[collect_dataset] Fetching page {page_count} (collected: {result['collected']}/{max_items})")
+                            batch, next_page_url = fetch(params)
+                    except (requests.exceptions.RequestException, StreamBrokenError) as e:
+                        # 最後のページとは扱わない: チェックポイント（直前までに書けたページの次）を残して止める
+                        print(f"[collect_dataset] Fetch failed, stopping and keeping the checkpoint: {e}")
+                        aborted.set()
+                        break
+                    # デバッグ: APIレスポンス件数
+                    print(f"[collect_dataset] API batch items: {len(batch)}")
+                    if not batch:
+                        print("[collect_dataset] No more items returned by API for this page/params.")
+                        break
+                    if new_since and self._page_known(read_conn, [item for item, _ in batch], known_high_water):
+                        print("[collect_dataset] Whole page already collected. Stopping (new-since).")
+                        break
+                    resume_from = next_page_url
+                    if len(batch) > max_items - result["collected"]:
+                        batch = batch[:max_items - result["collected"]]
+                        resume_from = page_cursor
+                        truncated.set()
+                    result["collected"] += len(batch)
+                    if not put(page_queue, (seq, batch, resume_from)):
+                        break
+                    seq += 1
+                    page_count += 1
+                    if not next_page_url:
+                        break
+                    if result["collected"] >= max_items:
+                        truncated.set()
+            finally:
+                if read_conn is not None:
+                    read_conn.close()
+                for _ in range(num_workers):
+                    put(page_queue, done)
+
+        def worker():
+            try:
+                while True:
+                    page = get(page_queue)
+                    if page is done:
+                        return
+                    seq, batch, page_next = page
+                    if stop.is_set():
+                        continue
+                    prepared = [self.prepare_item(item, model_id, model_name, raw) for item, raw in batch]
+                    if not put(write_queue, (seq, [p for p in prepared if p], page_next)):
+                        return
+            finally:
+                put(write_queue, done)
+
+        def writer():
+            # SQLite コネクションはスレッドをまたげないので書き込みスレッド専用に開く
+            conn = storage.connect(self.db_path)
+            pending = []
+            received = {}     # seq -> そのページの次の nextPage（ワーカー経由で順不同に届く）
+            committed = -1    # ここまでのページは連続して書き込み済み
+            high_water = 0    # 最後まで終わった時だけ collection_state に書く
+            finished = 0
+
+            def flush():
+                nonlocal pending, committed, high_water
+                if pending:
+                    # 失敗したら例外で抜ける（このバッチのページはチェックポイントに入れない）
+                    result["saved"] += self.save_prompt_batch(pending, conn=conn, raise_errors=True)
+                    high_water = max([high_water] + [int(p["civitai_id"]) for p in pending
+                                                     if p["civitai_id"].isdigit()])
+                    pending = []
+                # 連続して書き込み済みになったページの次カーソルをチェックポイントにする
+                advanced = False
+                cursor_to_save = None
+                while committed + 1 in received:
+                    committed += 1
+                    cursor_to_save = received.pop(committed)
+                    advanced = True
+                if advanced:
+                    self._save_collection_state(conn, model_id, sort, cursor_to_save, None)
+
+            try:
+                while finished < num_workers:
+                    entry = get(write_queue)
+                    if entry is done:
+                        finished += 1
+                        continue
+                    if aborted.is_set():
+                        # 書き込みに失敗した後は、上流が詰まらないように受け取って捨てるだけ
+                        continue
+                    seq, rows, page_next = entry
+                    pending.extend(rows)
+                    received[seq] = page_next
+                    # batch_size 件たまったらまとめて書き込む
+                    if len(pending) >= self.batch_size:
+                        try:
+                            flush()
+                        except Exception as e:
+                            print(f"[collect_dataset] Write failed, stopping and keeping the checkpoint: {e}")
+                            aborted.set()
+                            stop.set()
+                if not aborted.is_set():
+                    # 中断時も溜まっている分は書き出す
+                    try:
+                        flush()
+                    except Exception as e:
+                        print(f"[collect_dataset] Write failed, keeping the checkpoint: {e}")
+                        aborted.set()
+                # 最後まで取り切った（中断でも max_items での打ち切りでもない）ならカーソルを消して次回は先頭から
+                if not stop.is_set() and not aborted.is_set() and not truncated.is_set():
+                    self._save_collection_state(conn, model_id, sort, None, high_water or None)
+                elif truncated.is_set() and not aborted.is_set():
+                    print("[collect_dataset] Reached max_items. Keeping the checkpoint for the next run.")
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=stage("fetcher", fetcher), name="collect-fetcher", daemon=True),
+                   threading.Thread(target=stage("writer", writer), name="collect-writer", daemon=True)]
+        threads += [threading.Thread(target=stage("worker", worker), name=f"collect-worker-{i}", daemon=True)
+                    for i in range(num_workers)]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            print("[collect_dataset] Interrupted. Flushing pending rows...")
+            stop.set()
+            for t in threads:
+                t.join()
+
+        if errors:
+            raise errors[0]
+        result["aborted"] = aborted.is_set()
+        if result["aborted"]:
+            print(f"[collect_dataset] Aborted: saved {result['saved']}/{result['collected']} items for model "
+                  f"'{model_name or model_id}'. Run again to resume from the checkpoint.")
+        else:
+            print(f"[collect_dataset] Completed: saved {result['saved']}/{result['collected']} items for model '{model_name or model_id}'")
+        return result
 
     def collect_for_models(self, models: dict, max_per_model=5000):
         """複数モデルを順に収集するユーティリティ
@@ -347,114 +1215,428 @@ class CivitaiPromptCollector:
         for name, mid in models.items():
             res = self.collect_dataset(model_id=mid, model_name=name, max_items=max_per_model)
             results[name] = res
-            # モデル間に短い待機を入れてAPI負荷を下げる
-            time.sleep(2)
+        print(f"[collect_for_models] Metrics: {self.metrics.summary()}")
+        return results
+
+    async def _afetch_batch(self, client, url_or_params, headers, max_retries=5):
+        """fetch_batch の非同期版（httpx.AsyncClient を使用）
+        fetch_batch と同じく、リトライを使い切った時は requests.exceptions.RetryError、
+        再送しても変わらない 4xx は requests.exceptions.HTTPError を送出する（空のページと区別する）
+        """
+        import httpx
+
+        metrics = self.metrics
+        for attempt in range(1, max_retries + 1):
+            # 全モデル共通のレート制御器でプロセス全体のリクエスト数を抑える
+            metrics.add_time("sleep", await self.rate_limiter.acquire_async())
+            metrics.incr("requests")
+            try:
+                # 並行する他のリクエストを待つ時間も含む（イベントループ上の壁時計）
+                started = time.perf_counter()
+                if isinstance(url_or_params, dict):
+                    response = await client.get(self.base_url, params=url_or_params, headers=headers)
+                else:
+                    response = await client.get(url_or_params, headers=headers)
+                metrics.add_time("fetch", time.perf_counter() - started)
+                action = self._classify_response(response, attempt, max_retries, "afetch_batch")
+                if action == "ok":
+                    metrics.incr("bytes_downloaded", len(response.content))
+                    with metrics.timer("parse"):
+                        data = response.json()
+                    items = data.get("items", [])
+                    next_page = data.get("metadata", {}).get("nextPage")
+                    metrics.incr("pages")
+                    metrics.incr("items", len(items))
+                    return items, next_page
+                elif action == "retry":
+                    continue
+                else:
+                    raise requests.exceptions.HTTPError(f"HTTP {response.status_code} for: {url_or_params}")
+            except httpx.HTTPError as e:
+                metrics.incr("request_errors")
+                wait = self.rate_limiter.on_error(attempt)
+                print(f"[afetch_batch] Attempt {attempt} failed: {e} (retrying in {wait:.1f}s)")
+                continue
+        raise requests.exceptions.RetryError(f"All retries failed for: {url_or_params}")
+
+    async def _acollect_model(self, client, headers, write_queue, model_id, model_name, max_items):
+        """1モデル分のカーソルを非同期に辿り、抽出済みの行を書き込みキューへ流す
+        取得が失敗した（リトライ切れ・4xx）時はそのモデルだけ中断扱いにする（progress の "aborted" が True）
+        """
+        progress = self.progress[model_name]
+        params = {"limit": 20, "sort": "Most Reactions"}
+        if model_id:
+            params["modelVersionId"] = model_id
+
+        next_page_url = None
+        while progress["collected"] < max_items:
+            try:
+                batch, next_page_url = await self._afetch_batch(client, next_page_url or params, headers)
+            except requests.exceptions.RequestException as e:
+                # 最後のページとは扱わない（黙って終わると取り切ったのと区別できない）
+                print(f"[acollect] {model_name}: fetch failed, stopping this model: {e}")
+                progress["aborted"] = True
+                break
+            if not batch:
+                break
+            batch = batch[:max_items - progress["collected"]]
+            progress["pages"] += 1
+            progress["collected"] += len(batch)
+            prepared = [self.prepare_item(item, model_id, model_name) for item in batch]
+            await write_queue.put((model_name, [p for p in prepared if p]))
+            print(f"[acollect] {model_name}: page {progress['pages']}, "
+                  f"collected {progress['collected']}/{max_items}, saved {progress['saved']}, "
+                  f"rate {self.rate_limiter.current_rate:.2f} req/s")
+            if not next_page_url:
+                break
+        progress["done"] = True
+
+    async def _awriter(self, write_queue):
+        """書き込みキューを1本のコネクションで順に保存する（SQLite の書き込みは直列化）"""
+        conn = storage.connect(self.db_path, check_same_thread=False)
+        pending = {}
+        try:
+            while True:
+                entry = await write_queue.get()
+                if entry is None:
+                    break
+                model_name, rows = entry
+                pending.setdefault(model_name, []).extend(rows)
+                if sum(len(r) for r in pending.values()) >= self.batch_size:
+                    await self._aflush(conn, pending)
+            await self._aflush(conn, pending)
+        finally:
+            conn.close()
+
+    async def _aflush(self, conn, pending):
+        """溜まった行をモデルごとに1トランザクションで書き出し、進捗の saved を保存できた件数だけ増やす
+        （保存に失敗したモデルの saved は増えない）
+        """
+        for model_name, model_rows in pending.items():
+            if not model_rows:
+                continue
+            saved = await asyncio.to_thread(self.save_prompt_batch, model_rows, conn)
+            self.progress[model_name]["saved"] += saved
+        pending.clear()
+
+    async def acollect_for_models(self, models: dict, max_per_model=5000, concurrency=4,
+                                  rate_per_sec=None):
+        """複数モデルを asyncio で並行収集する（httpx が必要）
+           models: {"Model Name": "modelId", ...}
+           concurrency: 同時に辿るモデル数
+           rate_per_sec: 全モデル共通のレート制御器の初期レート（省略時は現在値のまま）
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("acollect_for_models requires httpx (pip install httpx)")
+
+        if rate_per_sec:
+            self.rate_limiter.rate = float(rate_per_sec)
+        semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+        write_queue = asyncio.Queue(maxsize=max(1, int(concurrency)) * 2)
+        headers = self.headers
+        self.progress = {
+            name: {"pages": 0, "collected": 0, "saved": 0, "done": False, "aborted": False}
+            for name in models
+        }
+
+        async def run_one(name, mid):
+            async with semaphore:
+                print(f"\n=== [acollect] Collecting: {name} (model_id={mid}) ===")
+                await self._acollect_model(client, headers, write_queue, mid, name, max_per_model)
+
+        writer = asyncio.create_task(self._awriter(write_queue))
+        timeout = httpx.Timeout(100.0, connect=5.0)
+        limits = httpx.Limits(max_connections=max(1, int(concurrency)))
+        try:
+            async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+                await asyncio.gather(*(run_one(name, mid) for name, mid in models.items()))
+        finally:
+            await write_queue.put(None)
+            await writer
+
+        results = {name: {"collected": p["collected"], "saved": p["saved"], "aborted": p["aborted"]}
+                   for name, p in self.progress.items()}
+        print(f"[acollect] Completed: {results}")
+        print(f"[acollect] Metrics: {self.metrics.summary()}")
         return results
 
-    def visualize_category_distribution(self, models_to_plot=None, normalize_percent=True, show=True, save_path=None):
+    def write_metrics_report(self, paths):
+        """self.metrics の集計を paths の各ファイルへ書き、report の dict を返す（形式は拡張子 .json/.csv/.prom）"""
+        for path in paths:
+            self.metrics.write_report(path)
+            print(f"[metrics] Report written to {path}")
+        return self.metrics.report()
+
+    def assign_clusters(self, rebuild=False, chunk_size=5000):
+        """cluster_id が未設定の行を近似重複クラスタに振り分ける（既存 DB の backfill 用）。処理件数を返す
+        rebuild=True なら署名・バケットを消して全行やり直す
+        """
+        import dedup
+
+        index = self.dedup_index or dedup.NearDuplicateIndex()
+        conn = storage.connect(self.db_path)
+        try:
+            if rebuild:
+                count = index.rebuild(conn, chunk_size)
+            else:
+                count = index.assign_pending(conn, chunk_size)
+            clusters = conn.execute("SELECT COUNT(DISTINCT cluster_id) FROM civitai_prompts").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"[assign_clusters] Assigned {count} rows ({clusters} clusters)")
+        return count
+
+    def backfill_tags(self, rebuild=False, chunk_size=5000):
+        """既存行の full_prompt から prompt_tags を作る。rebuild=True なら全行作り直す。処理件数を返す"""
+        conn = storage.connect(self.db_path)
+        try:
+            count = tags.backfill_tags(conn, chunk_size=chunk_size, rebuild=rebuild)
+        finally:
+            conn.close()
+        # 別接続で tags を書いたのでキャッシュは捨てる
+        self.tag_interner.clear()
+        print(f"[backfill_tags] Completed: {count} prompts")
+        return count
+
+    def get_category_stats(self, models=None):
+        """model_name × category の件数を集計テーブルから返す [(model_name, category, count), ...]
+        全件 JOIN せず、モデル数×カテゴリ数の行を読むだけ
         """
-        DB から model_name × category の出現数を集計しスタック棒グラフ表示
-        - models_to_plot: None -> DB 内の全モデル。リストを渡すとその順で表示。
+        conn = storage.connect(self.db_path)
+        try:
+            return category_stats.model_category_counts(conn, models)
+        finally:
+            conn.close()
+
+    def rebuild_aggregates(self):
+        """集計テーブルを prompt_categories から作り直す（既存 DB・不整合時用）。集計した組数を返す"""
+        conn = storage.connect(self.db_path)
+        try:
+            count = category_stats.rebuild_aggregates(conn)
+        finally:
+            conn.close()
+        print(f"[rebuild_aggregates] Rebuilt {count} model/category rows")
+        return count
+
+    def export_dataset(self, out_dir, fmt="parquet", chunk_size=50_000, incremental=False, partition_by_model=False):
+        """civitai_prompts をカテゴリ列付きで Parquet / Arrow IPC に書き出す（exporter.export_dataset を参照）"""
+        import exporter
+
+        return exporter.export_dataset(self.db_path, out_dir, fmt=fmt, chunk_size=chunk_size,
+                                       incremental=incremental, partition_by_model=partition_by_model)
+
+    def visualize_category_distribution(self, models_to_plot=None, normalize_percent=True, show=True, save_path=None,
+                                        top_models=30, top_categories=15):
+        """
+        model_name × category の分布をスタック棒グラフにする（集計は SQL 側で上位だけを読む。report.py を参照）
+        - models_to_plot: None -> 件数の多い順に top_models モデル（残りは "(other models)" にまとめる）。
+          リストを渡すとその順で表示。
         - normalize_percent: True のとき各モデルを 100% 正規化して割合表示
+        - show=False の時は pyplot を使わず Agg で save_path に描く
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        import report
 
-        cursor.execute('''
-        SELECT p.model_name, c.category, COUNT(*) as cnt
-        FROM civitai_prompts p
-        JOIN prompt_categories c ON p.id = c.prompt_id
-        GROUP BY p.model_name, c.category
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
+        conn = storage.open_readonly(self.db_path, storage.COLLECTOR_MIGRATIONS)
+        try:
+            summary = report.category_summary(conn, top_models=top_models, top_categories=top_categories,
+                                              models=models_to_plot)
+        finally:
+            conn.close()
 
-        if not rows:
+        if not summary["models"]:
             print("[visualize] No category data found in DB. Run collection first.")
-            return
-
-        data = defaultdict(lambda: defaultdict(int))
-        models_set = set()
-        categories_set = set()
-        for model_name, category, cnt in rows:
-            model_name = model_name or "Unknown"
-            data[model_name][category] += cnt
-            models_set.add(model_name)
-            categories_set.add(category)
-
-        # 選択モデル順
-        if models_to_plot:
-            model_names = [m for m in models_to_plot if m in data]
-        else:
-            model_names = sorted(models_set)
-
-        if not model_names:
-            print("[visualize] No matching models found to plot.")
-            return
-
-        categories = sorted(categories_set)
-        # build matrix values[cat][model_index]
-        matrix = np.zeros((len(categories), len(model_names)), dtype=float)
-        for j, m in enumerate(model_names):
-            total = sum(data[m].values()) or 1
-            for i, cat in enumerate(categories):
-                v = data[m].get(cat, 0)
-                matrix[i, j] = (v / total) * 100.0 if normalize_percent else v
-
-        # Plot stacked bar chart
-        x = np.arange(len(model_names))
-        bottom = np.zeros(len(model_names))
-
-        # Color map: auto generate
-        cmap = plt.get_cmap("tab20")
-        num_colors = max(3, len(categories))
-        colors = [cmap(i % 20) for i in range(num_colors)]
-
-        plt.figure(figsize=(max(8, len(model_names)*1.4), 6))
-        for i, cat in enumerate(categories):
-            vals = matrix[i, :]
-            plt.bar(x, vals, bottom=bottom, label=cat, color=colors[i % len(colors)])
-            bottom += vals
-
-        plt.xticks(x, model_names, rotation=25, ha='right')
-        plt.ylabel("Category Distribution (%)" if normalize_percent else "Count")
-        plt.title("Prompt Category Distribution by Model")
-        plt.legend(bbox_to_anchor=(1.02, 1), loc='upper left')
-        plt.tight_layout()
-
-        if save_path:
-            plt.savefig(save_path, dpi=200)
-            print(f"[visualize] Saved figure to: {save_path}")
+            return None
 
         if show:
+            import matplotlib.pyplot as plt
+
+            fig = plt.figure(figsize=(12, report.chart_height(summary)))
+            report.draw_distribution(fig, summary, normalize_percent)
+            if save_path:
+                fig.savefig(save_path, dpi=200)
+                print(f"[visualize] Saved figure to: {save_path}")
             plt.show()
-        else:
-            plt.close()
+            plt.close(fig)
+        elif save_path:
+            report.render_distribution(summary, save_path, normalize_percent, dpi=200)
+            print(f"[visualize] Saved figure to: {save_path}")
+        return summary
 
 # -----------------------
 # 実行部分
 # -----------------------
-def main():
-    # デフォルトは Illustrious Realism のみ（model_id=2091367）
-    target_models = {
-        "Realism Illustrious By Stable Yogi (ver.2091367)": "2091367"
-    }
-
-    collector = CivitaiPromptCollector(db_path="civitai_dataset.db")
-
-    # 少量で動作確認するデフォルト値（本番では増やす）
-    max_items_per_model = 10
-    print("Starting collection for models:", list(target_models.keys()))
-    results = collector.collect_for_models(target_models, max_per_model=max_items_per_model)
+# --model を指定しない時の収集対象（Illustrious Realism）
+DEFAULT_MODELS = {
+    "Realism Illustrious By Stable Yogi (ver.2091367)": "2091367"
+}
+
+
+def _parse_models(specs, all_models=False):
+    """--model "名前=modelId" / "modelId" のリストを {name: model_id} にする"""
+    if all_models:
+        return {"ALL_MODELS": None}
+    if not specs:
+        return dict(DEFAULT_MODELS)
+    models = {}
+    for spec in specs:
+        name, sep, model_id = spec.rpartition("=")
+        models[name if sep else spec] = model_id
+    return models
+
+
+def _cmd_collect(args):
+    models = _parse_models(args.model, args.all_models)
+    collector = CivitaiPromptCollector(db_path=args.db, base_url=args.base_url, batch_size=args.batch_size,
+                                       word_boundary=args.word_boundary, cache_path=args.cache,
+                                       stream_json=args.stream_json, dedup_clusters=args.dedup)
+    print("Starting collection for models:", list(models.keys()))
+
+    def run():
+        if args.use_async:
+            return asyncio.run(collector.acollect_for_models(models, max_per_model=args.max_items,
+                                                             concurrency=args.concurrency, rate_per_sec=args.rate))
+        if args.rate:
+            collector.rate_limiter.rate = args.rate
+        results = {}
+        for name, mid in models.items():
+            results[name] = collector.collect_dataset(model_id=mid, model_name=name, max_items=args.max_items,
+                                                      num_workers=args.workers, new_since=args.new_since,
+                                                      resume=not args.no_resume)
+        print(f"[collect_for_models] Metrics: {collector.metrics.summary()}")
+        return results
+
+    results = profile_call(run, stats_path=args.profile) if args.profile else run()
     print("Collection results:", results)
+    collector.write_metrics_report(args.metrics_out)
+    if args.plot:
+        # DB の model_name は API が返すモデル名なので、--model の名前では絞らず全モデルを描く
+        collector.visualize_category_distribution(show=False, save_path=args.plot)
+    collector.close()
+
+
+def _cmd_recategorize(args):
+    collector = CivitaiPromptCollector(db_path=args.db, word_boundary=args.word_boundary)
+    collector.recategorize_all(chunk_size=args.chunk_size)
+    collector.close()
+
+
+def _cmd_plot(args):
+    # 読むだけのコマンドは読み取り専用の接続で読む（スキーマが古い DB の時だけ、読む前に1回マイグレーションする）
+    collector = CivitaiPromptCollector(db_path=args.db, setup_db=False)
+    collector.visualize_category_distribution(models_to_plot=args.models or None,
+                                              normalize_percent=not args.count,
+                                              show=args.show, save_path=args.out,
+                                              top_models=args.top_models, top_categories=args.top_categories)
+    collector.close()
+
+
+def _cmd_report(args):
+    import report
+
+    report.generate_report(args.db, args.out_dir, top_models=args.top_models, top_categories=args.top_categories,
+                           models=args.models or None, normalize_percent=not args.count)
+
+
+def _cmd_search(args):
+    collector = CivitaiPromptCollector(db_path=args.db, setup_db=False)
+    try:
+        results = collector.search_prompts(args.query, limit=args.limit, offset=args.offset)
+    except sqlite3.Error as e:
+        print(f"[search] Cannot search {args.db}: {e}")
+        sys.exit(1)
+    finally:
+        collector.close()
+    for pid, civitai_id, model_name, prompt, score in results:
+        print(f"{score:8.3f}  {civitai_id}  [{model_name}]  {(prompt or '')[:args.width]}")
+
+
+def _cmd_export(args):
+    # export_state だけは書くので読み取り専用にはできないが、マイグレーションは流さない
+    collector = CivitaiPromptCollector(db_path=args.db, setup_db=False)
+    result = collector.export_dataset(args.out_dir, fmt=args.format, chunk_size=args.chunk_size,
+                                      incremental=args.incremental, partition_by_model=args.partition_by_model)
+    print(f"[export] {result}")
+    collector.close()
+
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CivitAI prompt collector (V8)")
+    parser.add_argument("--db", default="civitai_dataset.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("collect", help="API からプロンプトを収集して DB に保存する")
+    p.add_argument("--model", action="append", default=[],
+                   help='収集するモデル "名前=modelVersionId"（複数指定可。既定: Illustrious Realism）')
+    p.add_argument("--all-models", action="store_true", help="modelId で絞らずに収集する")
+    p.add_argument("--max-items", type=int, default=5000, help="モデルごとの収集件数")
+    p.add_argument("--base-url", default=None,
+                   help="API の URL（例: scripts/mock_civitai_server.py の http://127.0.0.1:8765/api/v1/images）")
+    p.add_argument("--workers", type=int, default=2, help="抽出・分類のワーカースレッド数")
+    p.add_argument("--async", dest="use_async", action="store_true",
+                   help="asyncio で複数モデルを並行収集する（httpx が必要）")
+    p.add_argument("--concurrency", type=int, default=4, help="--async で同時に辿るモデル数")
+    p.add_argument("--rate", type=float, default=None, help="送信レートの初期値（req/s）")
+    p.add_argument("--batch-size", type=int, default=100)
+    p.add_argument("--new-since", action="store_true", help="Newest 順で既知の行に当たるまでの差分だけ収集する")
+    p.add_argument("--no-resume", action="store_true", help="collection_state の続きからではなく最初から収集する")
+    p.add_argument("--stream-json", action="store_true")
+    p.add_argument("--cache", default=None, help="レスポンスキャッシュの SQLite パス")
+    p.add_argument("--dedup", action="store_true", help="保存時に近似重複クラスタへ振り分ける（numpy が必要）")
+    p.add_argument("--word-boundary", action="store_true")
+    p.add_argument("--plot", default=None, help="収集後にカテゴリ分布の図をこのパスに保存する")
+    p.add_argument("--metrics-out", action="append", default=[],
+                   help="実行後の計測レポートの出力先（.json / .csv / .prom、複数指定可）")
+    p.add_argument("--profile", nargs="?", const="collector.prof", default=None,
+                   help="cProfile 下で実行し pstats を保存する（既定: collector.prof）")
+    p.set_defaults(func=_cmd_collect)
+
+    p = sub.add_parser("recategorize", help="保存済みの全プロンプトを現在の語彙で再分類する")
+    p.add_argument("--chunk-size", type=int, default=5000)
+    p.add_argument("--word-boundary", action="store_true")
+    p.set_defaults(func=_cmd_recategorize)
+
+    p = sub.add_parser("plot", help="モデル×カテゴリの分布をスタック棒グラフにする（matplotlib が必要）")
+    p.add_argument("--models", nargs="*", default=None, help="表示するモデル名（既定: DB 内の全モデル）")
+    p.add_argument("--out", default="category_distribution.png")
+    p.add_argument("--count", action="store_true", help="割合ではなく件数で表示する")
+    p.add_argument("--show", action="store_true", help="ウィンドウに表示する")
+    p.add_argument("--top-models", type=int, default=30, help="件数の多い順に表示するモデル数")
+    p.add_argument("--top-categories", type=int, default=15, help="件数の多い順に表示するカテゴリ数")
+    p.set_defaults(func=_cmd_plot)
+
+    p = sub.add_parser("report", help="分布図・件数図（PNG）と CSV / HTML の要約を書き出す（matplotlib が必要）")
+    p.add_argument("out_dir")
+    p.add_argument("--models", nargs="*", default=None, help="表示するモデル名（既定: 件数の多い順に上位）")
+    p.add_argument("--top-models", type=int, default=30)
+    p.add_argument("--top-categories", type=int, default=15)
+    p.add_argument("--count", action="store_true", help="割合ではなく件数で表示する")
+    p.set_defaults(func=_cmd_report)
+
+    p = sub.add_parser("search", help="full_prompt を全文検索する")
+    p.add_argument("query")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--offset", type=int, default=0)
+    p.add_argument("--width", type=int, default=120, help="表示するプロンプトの文字数")
+    p.set_defaults(func=_cmd_search)
+
+    p = sub.add_parser("export", help="Parquet / Arrow IPC に書き出す（pyarrow が必要）")
+    p.add_argument("out_dir")
+    p.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    p.add_argument("--chunk-size", type=int, default=50_000)
+    p.add_argument("--incremental", action="store_true")
+    p.add_argument("--partition-by-model", action="store_true")
+    p.set_defaults(func=_cmd_export)
+    return parser
+
 
-    # 可視化はデフォルトで非表示（CIやヘッドレス環境対策）
-    collector.visualize_category_distribution(models_to_plot=list(target_models.keys()), normalize_percent=True, show=False)
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
 
-    # テスト用コレクション（model_id=None で全モデル対象）
-    print("\n=== TEST COLLECTION (all models) ===")
-    c = CivitaiPromptCollector(db_path="test_collect.db")
-    print(c.collect_for_models({"test": None}, max_per_model=1))
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,20 @@
-import requests
 from config import settings
+from http_client import CachedHttpClient, ResponseCache, get_session
+
+_client = None
+
+def _get_client():
+    """共有セッション（＋設定されていればレスポンスキャッシュ）を使う HTTP クライアント"""
+    global _client
+    if _client is None:
+        cache = None
+        if settings.get("HTTP_CACHE_PATH"):
+            cache = ResponseCache(settings["HTTP_CACHE_PATH"], ttl=settings.get("HTTP_CACHE_TTL", 3600))
+        _client = CachedHttpClient(get_session(), cache=cache)
+    return _client
 
 def fetch_prompts(limit=50):
-    url = f"{settings['API_URL']}?limit={limit}"
-    response = requests.get(url)
+    response = _get_client().get(settings['API_URL'], params={"limit": limit})
     response.raise_for_status()
     data = response.json()
     return data.get("items", [])
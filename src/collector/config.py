@@ -1,5 +1,10 @@
 settings = {
     "API_URL": "https://civitai.com/api/v1/models",
     "FETCH_LIMIT": 50,       # 一度に取得する件数
-    "DB_PATH": "civitai_prompts.db"
+    "DB_PATH": "civitai_prompts.db",
+    "HTTP_CACHE_PATH": None,  # 例: "http_cache.db" にするとレスポンスをキャッシュ
+    "HTTP_CACHE_TTL": 3600,   # キャッシュの有効秒数（過ぎたら ETag で再検証）
 }
+
+# CivitAI の API キーを読む環境変数名
+CIVITAI_API_ENV = "CIVITAI_API_KEY"
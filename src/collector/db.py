@@ -1,24 +1,20 @@
-import sqlite3
+import storage
 
 def init_db(db_path):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS prompts (
-            id INTEGER PRIMARY KEY,
-            text TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    """prompts テーブル・FTS 索引をマイグレーションで作り、その接続を返す（呼び出し側で閉じる）
+    この接続を save_prompts(conn=...) に渡せば、1回の実行で接続を開閉するのは1回だけになる
+    """
+    return storage.open_database(db_path, storage.PROMPTS_MIGRATIONS)
 
-def save_prompts(prompts, db_path="civitai_prompts.db"):
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    for p in prompts:
-        try:
-            cur.execute("INSERT INTO prompts (id, text) VALUES (?, ?)", (p["id"], p["text"]))
-        except sqlite3.IntegrityError:
-            continue  # 既にある場合はスキップ
-    conn.commit()
-    conn.close()
+def save_prompts(prompts, db_path="civitai_prompts.db", conn=None):
+    """prompts を1トランザクションでまとめて保存し、追加した件数を返す（既にある id はスキップ）
+    何度も呼ぶ場合は conn（storage.connect の接続）を渡して使い回す
+    WAL の接続は最後に閉じる時にチェックポイントを走らせるので、呼び出しごとに開閉すると遅い
+    """
+    if conn is not None:
+        return storage.insert_prompts(conn, prompts)
+    conn = storage.connect(db_path)
+    try:
+        return storage.insert_prompts(conn, prompts)
+    finally:
+        conn.close()
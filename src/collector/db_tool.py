@@ -1,22 +1,19 @@
-import sqlite3
+import fts_index
+import storage
 
 # ─── DBファイルパス ───
 DB_PATH = "civitai_prompts.db"
 
-# ─── category列がなければ追加 ───
-conn = sqlite3.connect(DB_PATH)
-cur = conn.cursor()
-try:
-    cur.execute("ALTER TABLE prompts ADD COLUMN category TEXT")
-except sqlite3.OperationalError:
-    # すでに存在する場合は無視
-    pass
-conn.commit()
-conn.close()
-
 # ─── DB接続 ───
+# import 時には DB に触らない。category 列などのスキーマは最初に接続した時にマイグレーションで揃える
+_migrated = False
+
 def connect_db():
-    return sqlite3.connect(DB_PATH)
+    global _migrated
+    if not _migrated:
+        storage.open_database(DB_PATH, storage.PROMPTS_MIGRATIONS).close()
+        _migrated = True
+    return storage.connect(DB_PATH)
 
 # ─── データ確認 ───
 def show_prompts(limit=10):
@@ -37,18 +34,36 @@ def update_category(prompt_id, new_category):
     conn.close()
     print(f"Prompt ID {prompt_id} のカテゴリを '{new_category}' に更新しました。")
 
-# ─── キーワード検索 ───
-def search_prompt(keyword):
+# ─── キーワード検索（FTS5 / bm25 順） ───
+def search_prompts(query, limit=20, offset=0):
+    """(id, text, category, score) のリストを返す。カンマ区切りでタグ単位の AND 検索、末尾 * で前方一致
+    "fts:" で始めると FTS5 の構文（AND/OR/NOT/NEAR）として扱う
+    """
     conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, text, category FROM prompts WHERE text LIKE ?", (f"%{keyword}%",))
-    rows = cur.fetchall()
-    conn.close()
+    try:
+        return fts_index.search(conn, "prompts", query, columns=("id", "text", "category"),
+                                limit=limit, offset=offset)
+    finally:
+        conn.close()
+
+def search_prompt(keyword, limit=20, offset=0):
+    rows = search_prompts(keyword, limit=limit, offset=offset)
     if rows:
         for row in rows:
             print(f"ID: {row[0]}, Category: {row[2]}\nPrompt: {row[1]}\n{'-'*50}")
     else:
         print("該当するプロンプトはありません。")
+    return len(rows)
+
+# ─── 検索インデックス再構築（既存 DB の backfill） ───
+def rebuild_search_index():
+    conn = connect_db()
+    try:
+        fts_index.setup_fts(conn, "prompts", backfill=False)
+        count = fts_index.rebuild_fts(conn, "prompts")
+    finally:
+        conn.close()
+    print(f"検索インデックスを再構築しました（{count} 件）。")
 
 # ─── 実行用メニュー ───
 def menu():
@@ -56,7 +71,8 @@ def menu():
         print("\n1: データ確認")
         print("2: カテゴリ更新")
         print("3: キーワード検索")
-        print("4: 終了")
+        print("4: 検索インデックス再構築")
+        print("5: 終了")
         choice = input("選択: ").strip()
         if choice == "1":
             limit_input = input("表示件数 (デフォルト10): ").strip()
@@ -72,8 +88,16 @@ def menu():
             update_category(pid, cat)
         elif choice == "3":
             kw = input("検索キーワード: ").strip()
-            search_prompt(kw)
+            page_size = 20
+            offset = 0
+            # 1ページずつ表示し、続きがあれば次ページを聞く
+            while search_prompt(kw, limit=page_size, offset=offset) == page_size:
+                if input("次のページを表示しますか？ (y/N): ").strip().lower() != "y":
+                    break
+                offset += page_size
         elif choice == "4":
+            rebuild_search_index()
+        elif choice == "5":
             break
         else:
             print("無効な選択です。")
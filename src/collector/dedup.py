@@ -0,0 +1,309 @@
+import hashlib
+
+import numpy as np
+
+from tags import split_tags
+
+# 2^61-1（メルセンヌ素数）。(a * x + b) mod P を置換のハッシュに使う
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def tag_tokens(prompt):
+    """MinHash に入れるトークン（正規化したタグの集合。順番・重み・重複は無視する）"""
+    return {tag for tag, _ in split_tags(prompt)}
+
+
+class MinHasher:
+    """タグ集合の MinHash 署名（uint32 × num_perm）を作る
+    タグは blake2b で 32bit にしてから num_perm 個の (a * x + b) mod P で並べ替え、各置換の最小値を取る
+    a, x < 2^32 なので積は uint64 に収まる
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def _hash_tokens(tokens):
+        return np.array(
+            [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "little") for t in tokens],
+            dtype=np.uint64,
+        )
+
+    def signature(self, tokens):
+        """トークン集合の署名。空集合は全要素が最大値の署名（他の何とも一致しない）"""
+        return self.signatures([tokens])[0]
+
+    def signatures(self, token_sets):
+        """複数のトークン集合の署名をまとめて作る（len(token_sets) × num_perm の配列）
+        全トークンを1つの行列で置換し、集合ごとの最小値を reduceat で取る
+        """
+        result = np.full((len(token_sets), self.num_perm), 0xFFFFFFFF, dtype=np.uint32)
+        nonempty = [i for i, tokens in enumerate(token_sets) if tokens]
+        if not nonempty:
+            return result
+        flat = [t for i in nonempty for t in token_sets[i]]
+        starts = np.cumsum([0] + [len(token_sets[i]) for i in nonempty[:-1]])
+        x = self._hash_tokens(flat)[:, None]
+        permuted = ((self.a * x + self.b) % _MERSENNE) & _MAX_HASH
+        result[nonempty] = np.minimum.reduceat(permuted, starts, axis=0).astype(np.uint32)
+        return result
+
+
+def estimate_jaccard(sig_a, sig_b):
+    return float(np.count_nonzero(sig_a == sig_b)) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """MinHash + LSH（バンド分割）で似たプロンプトを cluster_id にまとめる
+    - 署名を bands 個のバンド（各 rows 行）に分け、どれか1バンドが一致した行だけを候補にする（全組比較しない）
+    - 候補は署名の一致率（推定 Jaccard）が threshold 以上なら同じクラスタ
+    - 署名は prompt_minhash、バンドのバケットは lsh_buckets に置くので、新しいページは追加分だけ処理できる
+      （どのクラスタにも一致しなかった代表行だけを索引に入れる）
+    - cluster_id はクラスタ内の最小の civitai_prompts.id（単独なら自分の id）
+    - 内容が変わる行は書き換える前に release() でクラスタから外す（残りのメンバーが索引から消えないように）
+    既定の 16 バンド × 8 行は一致率およそ 0.7 前後から候補に上がる
+    """
+
+    def __init__(self, num_perm=128, bands=16, threshold=0.7, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        # バンド内の rows 個の値を1つの 64bit キーにまとめる係数（奇数。桁あふれは 2^64 で折り返す）
+        multipliers = np.random.RandomState(seed + 1).randint(1, 1 << 62, size=self.rows, dtype=np.uint64)
+        self._multipliers = multipliers | np.uint64(1)
+
+    def band_keys(self, signatures):
+        """署名の配列（n × num_perm）から、行ごと・バンドごとのバケットキー（n × bands の int64）を作る"""
+        banded = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        with np.errstate(over="ignore"):
+            keys = (banded * self._multipliers).sum(axis=2, dtype=np.uint64)
+        return keys.view(np.int64)
+
+    def assign_pending(self, conn, chunk_size=5000):
+        """cluster_id が未設定の行を id 順に chunk_size 件ずつ処理する。処理した行数を返す
+        呼び出し側のトランザクションはここでコミットする
+        """
+        total = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, full_prompt FROM civitai_prompts WHERE cluster_id IS NULL ORDER BY id LIMIT ?",
+                (chunk_size,),
+            ).fetchall()
+            if not rows:
+                break
+            self._assign_chunk(conn, rows)
+            conn.commit()
+            total += len(rows)
+        return total
+
+    def assign_ids(self, conn, ids, chunk_size=500):
+        """ids のうち cluster_id が未設定の行だけを処理する（保存したバッチの分だけ。他の未処理行には触らない）
+        処理した行数を返す。呼び出し側のトランザクションはここでコミットする
+        """
+        ids = sorted(set(ids))
+        total = 0
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            rows = conn.execute(
+                f"SELECT id, full_prompt FROM civitai_prompts WHERE id IN ({','.join('?' * len(chunk))}) "
+                "AND cluster_id IS NULL ORDER BY id",
+                chunk,
+            ).fetchall()
+            if rows:
+                self._assign_chunk(conn, rows)
+                total += len(rows)
+        conn.commit()
+        return total
+
+    def release(self, conn, ids):
+        """内容が変わる行 ids をクラスタから外す（full_prompt を書き換える前に、同じトランザクションで呼ぶ）
+        - ids の署名・バケットを消す（書き換え後に assign_ids でやり直す）
+        - cluster_id が ids の行を指していたら、残るメンバーの最小 id に付け替える
+        - 残るメンバーに代表（索引に入っている行）がいなくなるなら、最小 id のメンバーを代表にする
+        処理したクラスタ数を返す（コミットはしない）
+        """
+        ids = sorted(set(ids))
+        if not ids:
+            return 0
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _dedup_released (prompt_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM _dedup_released")
+        conn.executemany("INSERT INTO _dedup_released VALUES (?)", [(pid,) for pid in ids])
+        clusters = [r[0] for r in conn.execute('''
+        SELECT DISTINCT p.cluster_id FROM _dedup_released r
+        JOIN civitai_prompts p ON p.id = r.prompt_id
+        WHERE p.cluster_id IS NOT NULL
+        ''')]
+        conn.execute("DELETE FROM lsh_buckets WHERE prompt_id IN (SELECT prompt_id FROM _dedup_released)")
+        conn.execute("DELETE FROM prompt_minhash WHERE prompt_id IN (SELECT prompt_id FROM _dedup_released)")
+
+        released = set(ids)
+        elected = []
+        for cluster in clusters:
+            first = conn.execute('''
+            SELECT MIN(id) FROM civitai_prompts
+            WHERE cluster_id = ? AND id NOT IN (SELECT prompt_id FROM _dedup_released)
+            ''', (cluster,)).fetchone()[0]
+            if first is None:
+                continue
+            if cluster in released:
+                conn.execute('''
+                UPDATE civitai_prompts SET cluster_id = ?
+                WHERE cluster_id = ? AND id NOT IN (SELECT prompt_id FROM _dedup_released)
+                ''', (first, cluster))
+                cluster = first
+            has_representative = conn.execute('''
+            SELECT 1 FROM civitai_prompts p JOIN prompt_minhash m ON m.prompt_id = p.id
+            WHERE p.cluster_id = ? LIMIT 1
+            ''', (cluster,)).fetchone()
+            if not has_representative:
+                elected.append(first)
+
+        if elected:
+            rows = conn.execute(
+                f"SELECT id, full_prompt FROM civitai_prompts WHERE id IN ({','.join('?' * len(elected))})",
+                elected,
+            ).fetchall()
+            token_sets = [tag_tokens(prompt) for _, prompt in rows]
+            sig_matrix = self.hasher.signatures(token_sets)
+            key_matrix = self.band_keys(sig_matrix).tolist()
+            # タグが無い行は索引に入れない（_assign_chunk と同じ）
+            chosen = [i for i, tokens in enumerate(token_sets) if tokens]
+            conn.executemany(
+                "INSERT INTO prompt_minhash (prompt_id, signature) VALUES (?, ?)",
+                [(rows[i][0], sig_matrix[i].tobytes()) for i in chosen],
+            )
+            conn.executemany(
+                "INSERT INTO lsh_buckets (band, bucket, prompt_id) VALUES (?, ?, ?)",
+                [(band, key, rows[i][0]) for i in chosen for band, key in enumerate(key_matrix[i])],
+            )
+        return len(clusters)
+
+    def _assign_chunk(self, conn, rows):
+        ids = [r[0] for r in rows]
+        token_sets = [tag_tokens(prompt) for _, prompt in rows]
+        sig_matrix = self.hasher.signatures(token_sets)
+        key_matrix = self.band_keys(sig_matrix).tolist()
+        # タグが1つも無い行は索引に入れず単独クラスタにする
+        signatures = {pid: sig_matrix[i] for i, pid in enumerate(ids) if token_sets[i]}
+        keys = {pid: key_matrix[i] for i, pid in enumerate(ids) if token_sets[i]}
+
+        # 内容が変わって再処理する行は古い署名・バケットを消す
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _dedup_ids (prompt_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM _dedup_ids")
+        conn.executemany("INSERT INTO _dedup_ids VALUES (?)", [(pid,) for pid in ids])
+        conn.execute("DELETE FROM lsh_buckets WHERE prompt_id IN (SELECT prompt_id FROM _dedup_ids)")
+        conn.execute("DELETE FROM prompt_minhash WHERE prompt_id IN (SELECT prompt_id FROM _dedup_ids)")
+
+        # 既存行の候補: このチャンクのバケットと一致するものを1回の JOIN で引く
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS _dedup_buckets (band INTEGER, bucket INTEGER, prompt_id INTEGER)")
+        conn.execute("DELETE FROM _dedup_buckets")
+        conn.executemany(
+            "INSERT INTO _dedup_buckets VALUES (?, ?, ?)",
+            [(band, key, pid) for pid, ks in keys.items() for band, key in enumerate(ks)],
+        )
+        pairs = conn.execute('''
+        SELECT DISTINCT t.prompt_id, b.prompt_id
+        FROM _dedup_buckets t
+        JOIN lsh_buckets b ON b.band = t.band AND b.bucket = t.bucket
+        ''').fetchall()
+        # 候補の一致率はまとめて行列で比べ、threshold 以上だった既存クラスタだけを残す
+        matches = {}
+        if pairs:
+            others = sorted({other for _, other in pairs})
+            conn.execute("DELETE FROM _dedup_ids")
+            conn.executemany("INSERT INTO _dedup_ids VALUES (?)", [(o,) for o in others])
+            stored = {
+                other: (blob, cluster_id)
+                for other, blob, cluster_id in conn.execute('''
+                SELECT m.prompt_id, m.signature, p.cluster_id
+                FROM _dedup_ids d
+                JOIN prompt_minhash m ON m.prompt_id = d.prompt_id
+                JOIN civitai_prompts p ON p.id = d.prompt_id
+                ''')
+            }
+            pairs = [(pid, other) for pid, other in pairs if other in stored]
+        if pairs:
+            row_of = {pid: i for i, pid in enumerate(ids)}
+            other_sigs = np.frombuffer(b"".join(stored[o][0] for _, o in pairs), dtype=np.uint32)
+            mine = sig_matrix[[row_of[pid] for pid, _ in pairs]]
+            similar = (mine == other_sigs.reshape(len(pairs), -1)).mean(axis=1) >= self.threshold
+            for (pid, other), ok in zip(pairs, similar.tolist()):
+                if ok:
+                    cluster_id = stored[other][1]
+                    matches.setdefault(pid, set()).add(cluster_id if cluster_id is not None else other)
+
+        # Union-Find（要素: このチャンクの id と、既存クラスタの cluster_id）
+        parent = {}
+
+        def find(x):
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(x, y):
+            rx, ry = find(x), find(y)
+            if rx != ry:
+                # 小さい id を代表にする
+                parent[max(rx, ry)] = min(rx, ry)
+
+        # どのクラスタにも一致しなかった行だけを「代表」として索引に入れる
+        # （同じプロンプトが大量にあってもバケットは増えず、照合は代表とだけ行うので線形に近い）
+        local_buckets = {}
+        representatives = []
+        existing_clusters = set()
+        for pid in ids:
+            find(pid)
+            sig = signatures.get(pid)
+            if sig is None:
+                continue
+            matched = False
+            for cluster in matches.get(pid, ()):
+                existing_clusters.add(cluster)
+                union(pid, cluster)
+                matched = True
+            checked = set()
+            for band, key in enumerate(keys[pid]):
+                for rep in local_buckets.get((band, key), []):
+                    if rep in checked:
+                        continue
+                    checked.add(rep)
+                    if estimate_jaccard(sig, signatures[rep]) >= self.threshold:
+                        union(pid, rep)
+                        matched = True
+            if not matched:
+                representatives.append(pid)
+                for band, key in enumerate(keys[pid]):
+                    local_buckets.setdefault((band, key), []).append(pid)
+
+        # 既存クラスタ同士が新しい行でつながった場合は代表（最小 id）へ寄せる
+        merges = [(find(c), c) for c in existing_clusters if find(c) != c]
+        conn.executemany("UPDATE civitai_prompts SET cluster_id = ? WHERE cluster_id = ?", merges)
+        conn.executemany(
+            "UPDATE civitai_prompts SET cluster_id = ? WHERE id = ?",
+            [(find(pid), pid) for pid in ids],
+        )
+        conn.executemany(
+            "INSERT INTO prompt_minhash (prompt_id, signature) VALUES (?, ?)",
+            [(pid, signatures[pid].tobytes()) for pid in representatives],
+        )
+        conn.executemany(
+            "INSERT INTO lsh_buckets (band, bucket, prompt_id) VALUES (?, ?, ?)",
+            [(band, key, pid) for pid in representatives for band, key in enumerate(keys[pid])],
+        )
+
+    def rebuild(self, conn, chunk_size=5000):
+        """全行の署名・バケット・cluster_id を作り直す（パラメータを変えた時や既存 DB の初回）"""
+        conn.execute("DELETE FROM lsh_buckets")
+        conn.execute("DELETE FROM prompt_minhash")
+        conn.execute("UPDATE civitai_prompts SET cluster_id = NULL")
+        conn.commit()
+        return self.assign_pending(conn, chunk_size)
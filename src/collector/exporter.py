@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# exporter.py
+# civitai_prompts + prompt_categories を Parquet / Arrow IPC にチャンク単位で書き出す
+# - カテゴリは1カテゴリ = <category>（bool）と <category>_confidence（float32）の2列に展開
+# - 差分出力: 前回出力した collected_at より後の行だけ（更新された行も collected_at が進むので含まれる）
+# - 全件出力（差分でない / 前回の位置が無い）は、前回までに書いた part-*.{parquet,arrow} を消してから書く
+# - model_id ごとに Hive 形式のディレクトリ（model_id=xxx/）へ分割
+# - chunk_size 行ずつ読んでは書くので、全件数に関係なくメモリ使用量はチャンク分で頭打ち
+#
+# 使い方:
+#   python src/collector/exporter.py civitai_dataset.db export/ --format parquet --partition-by-model
+#   python src/collector/exporter.py civitai_dataset.db export/ --incremental
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # pyarrow が無い環境でも収集側は import できるようにする
+    pa = None
+    ds = None
+
+import storage
+
+FORMATS = {"parquet": ("parquet", "parquet"), "arrow": ("ipc", "arrow")}
+
+# civitai_prompts の出力列と Arrow 型
+PROMPT_COLUMNS = [
+    ("id", "int64"),
+    ("civitai_id", "string"),
+    ("full_prompt", "string"),
+    ("negative_prompt", "string"),
+    ("quality_score", "int32"),
+    ("reaction_count", "int64"),
+    ("comment_count", "int64"),
+    ("download_count", "int64"),
+    ("prompt_length", "int32"),
+    ("tag_count", "int32"),
+    ("model_name", "string"),
+    ("model_id", "string"),
+    ("collected_at", "timestamp"),
+]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("exporter には pyarrow が必要です: pip install pyarrow")
+
+
+def _setup_state(conn):
+    """出力先ごとの差分出力位置（最後に書いた collected_at, id）"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS export_state (
+        target TEXT PRIMARY KEY,
+        last_collected_at TEXT,
+        last_id INTEGER,
+        rows INTEGER,
+        exported_at TIMESTAMP
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_civitai_prompts_collected_at ON civitai_prompts (collected_at, id)")
+    conn.commit()
+
+
+def _clear_previous_export(out_dir):
+    """out_dir 以下の前回までの出力ファイル（part-*.parquet / part-*.arrow）と空になったパーティションを消す
+    それ以外のファイルには触らない。消したファイル数を返す
+    """
+    if not os.path.isdir(out_dir):
+        return 0
+    extensions = tuple(f".{ext}" for _, ext in FORMATS.values())
+    removed = 0
+    for root, dirs, files in os.walk(out_dir, topdown=False):
+        for name in files:
+            if name.startswith("part-") and name.endswith(extensions):
+                os.remove(os.path.join(root, name))
+                removed += 1
+        if root != out_dir and os.path.basename(root).startswith("model_id=") and not os.listdir(root):
+            os.rmdir(root)
+    return removed
+
+
+def list_categories(conn):
+    """出力するカテゴリ列（全チャンクで同じスキーマにするため最初に確定させる）"""
+    try:
+        rows = conn.execute("SELECT DISTINCT category FROM model_category_stats").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    if not rows:
+        rows = conn.execute("SELECT DISTINCT category FROM prompt_categories").fetchall()
+    return sorted(r[0] for r in rows if r[0])
+
+
+def build_schema(categories, partition_by_model=False):
+    _require_pyarrow()
+    types = {
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "string": pa.string(),
+        "timestamp": pa.timestamp("us"),
+    }
+    fields = [pa.field(name, types[kind]) for name, kind in PROMPT_COLUMNS]
+    for category in categories:
+        fields.append(pa.field(category, pa.bool_()))
+        fields.append(pa.field(f"{category}_confidence", pa.float32()))
+    schema = pa.schema(fields)
+    if partition_by_model:
+        # パーティション列はディレクトリ名になるので、欠損は固定値にしておく
+        schema = schema.set(schema.get_field_index("model_id"), pa.field("model_id", pa.string(), nullable=False))
+    return schema
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _iter_chunks(conn, categories, chunk_size, since):
+    """(rows, category_map) をチャンクごとに返すジェネレータ
+    since が None なら id 順に全件、(collected_at, id) なら それより後を collected_at 順に読む
+    """
+    columns = ", ".join(name for name, _ in PROMPT_COLUMNS)
+    if since is None:
+        order, where, key = "id", "id > ?", (0,)
+    else:
+        order = "collected_at, id"
+        where = "(collected_at > ? OR (collected_at = ? AND id > ?))"
+        key = (since[0], since[0], since[1])
+    wanted = set(categories)
+    while True:
+        rows = conn.execute(
+            f"SELECT {columns} FROM civitai_prompts WHERE {where} ORDER BY {order} LIMIT ?",
+            key + (chunk_size,),
+        ).fetchall()
+        if not rows:
+            return
+        # チャンクと同じ条件の id だけカテゴリを引く（prompt_id 索引を使い、バインド変数の上限も気にしない）
+        category_map = {}
+        for prompt_id, category, confidence in conn.execute(
+            f"""SELECT prompt_id, category, confidence FROM prompt_categories
+            WHERE prompt_id IN (SELECT id FROM civitai_prompts WHERE {where} ORDER BY {order} LIMIT ?)""",
+            key + (chunk_size,),
+        ):
+            if category in wanted:
+                category_map.setdefault(prompt_id, {})[category] = confidence
+        yield rows, category_map
+        last = rows[-1]
+        key = (last[0],) if since is None else (last[-1], last[-1], last[0])
+
+
+def _to_batch(rows, category_map, categories, schema, partition_by_model):
+    """チャンクを列ごとの配列にして RecordBatch を作る"""
+    data = {}
+    for i, (name, kind) in enumerate(PROMPT_COLUMNS):
+        values = [r[i] for r in rows]
+        if kind == "timestamp":
+            values = [_parse_time(v) for v in values]
+        data[name] = values
+    if partition_by_model:
+        data["model_id"] = [v if v else "unknown" for v in data["model_id"]]
+    ids = data["id"]
+    for category in categories:
+        confidences = [category_map.get(pid, {}).get(category) for pid in ids]
+        data[category] = [c is not None for c in confidences]
+        data[f"{category}_confidence"] = confidences
+    return pa.RecordBatch.from_pydict(data, schema=schema)
+
+
+def export_dataset(db_path, out_dir, fmt="parquet", chunk_size=50_000, incremental=False,
+                   partition_by_model=False, max_rows_per_file=1_000_000):
+    """civitai_prompts をカテゴリ列付きで out_dir に書き出し、{"rows", "files", "seconds"} を返す
+    incremental=True なら前回この out_dir に出力した位置より後の行だけを書き、位置を DB に記録する
+    全件を書く時（incremental=False か、前回の位置が無い時）は前回までの出力を消して置き換える
+    """
+    _require_pyarrow()
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt} (choose from {', '.join(FORMATS)})")
+    ds_format, extension = FORMATS[fmt]
+    target = os.path.abspath(out_dir)
+
+    # バッチは write_dataset の内部スレッドから順に読まれる（同時には使わない）
+    conn = storage.connect(db_path, check_same_thread=False)
+    try:
+        _setup_state(conn)
+        since = None
+        if incremental:
+            state = conn.execute(
+                "SELECT last_collected_at, last_id FROM export_state WHERE target = ?", (target,)
+            ).fetchone()
+            if state and state[0] is not None:
+                since = (state[0], state[1])
+
+        if since is None:
+            # 全件出力に前回のファイルが残っていると同じ行が2回入る
+            removed = _clear_previous_export(out_dir)
+            if removed:
+                print(f"[export_dataset] Removed {removed} files from the previous export")
+            conn.execute("DELETE FROM export_state WHERE target = ?", (target,))
+            conn.commit()
+
+        categories = list_categories(conn)
+        schema = build_schema(categories, partition_by_model)
+        progress = {"rows": 0, "last": since}
+        started = time.perf_counter()
+        written = []
+
+        def batches():
+            for rows, category_map in _iter_chunks(conn, categories, chunk_size, since):
+                progress["rows"] += len(rows)
+                # collected_at の最大位置（id 順で読んだ時も含め）を差分出力の次の開始位置にする
+                for r in rows:
+                    if r[-1] is not None and (progress["last"] is None or (r[-1], r[0]) > progress["last"]):
+                        progress["last"] = (r[-1], r[0])
+                yield _to_batch(rows, category_map, categories, schema, partition_by_model)
+                print(f"[export_dataset] {progress['rows']} rows")
+
+        run_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        ds.write_dataset(
+            pa.RecordBatchReader.from_batches(schema, batches()),
+            out_dir,
+            format=ds_format,
+            partitioning=["model_id"] if partition_by_model else None,
+            partitioning_flavor="hive" if partition_by_model else None,
+            basename_template=f"part-{run_id}-{{i}}.{extension}",
+            existing_data_behavior="overwrite_or_ignore",
+            max_rows_per_file=max_rows_per_file,
+            max_rows_per_group=min(max_rows_per_file, max(chunk_size, 1)),
+            file_visitor=lambda f: written.append(f.path),
+        )
+
+        if progress["last"] is not None and progress["last"] != since:
+            conn.execute('''
+            INSERT INTO export_state (target, last_collected_at, last_id, rows, exported_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(target) DO UPDATE SET
+                last_collected_at=excluded.last_collected_at,
+                last_id=excluded.last_id,
+                rows=export_state.rows + excluded.rows,
+                exported_at=excluded.exported_at
+            ''', (target, progress["last"][0], progress["last"][1], progress["rows"],
+                  datetime.now().isoformat()))
+            conn.commit()
+    finally:
+        conn.close()
+
+    result = {
+        "rows": progress["rows"],
+        "files": len(written),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(f"[export_dataset] Completed: {result}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export civitai_prompts to Parquet / Arrow IPC")
+    parser.add_argument("db_path")
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--incremental", action="store_true", help="前回の出力以降に収集された行だけ書き出す")
+    parser.add_argument("--partition-by-model", action="store_true", help="model_id=xxx/ ごとに分割する")
+    args = parser.parse_args()
+    export_dataset(args.db_path, args.out_dir, fmt=args.format, chunk_size=args.chunk_size,
+                   incremental=args.incremental, partition_by_model=args.partition_by_model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import re
+import sqlite3
+
+# テーブル名 -> (FTS テーブル名, 本文列)。rowid は元テーブルの id
+FTS_TABLES = {
+    "prompts": ("prompts_fts", "text"),
+    "civitai_prompts": ("civitai_prompts_fts", "full_prompt"),
+}
+
+# タグ区切り（カンマ）の代わりに索引へ入れる区切りトークン
+# フレーズ検索 "soft lighting" が "soft, lighting" のようにタグをまたいでマッチしないようにする
+TAG_SEPARATOR = " tagsep "
+
+# 区切りトークンそのものを検索語に入れると全行にマッチしてしまうので、利用者の入力からは取り除く
+# （unicode61 は英数字以外で単語を区切るので、前後が英数字でない tagsep がトークンになる）
+_SEPARATOR_TOKEN = re.compile(r"(?<![^\W_])" + TAG_SEPARATOR.strip() + r"(?![^\W_])", re.IGNORECASE)
+
+# この接頭辞で始まる入力だけは FTS5 の構文としてそのまま MATCH に渡す（例: "fts: soft NEAR light"）
+RAW_PREFIX = "fts:"
+
+
+def _indexed(column_expr):
+    """索引に入れる形に変換する SQL 式（カンマを区切りトークンに置き換え）"""
+    return f"replace(COALESCE({column_expr}, ''), ',', '{TAG_SEPARATOR}')"
+
+
+def setup_fts(conn, table, backfill=True):
+    """FTS5 索引と同期用トリガーを作る。新しく作った時は既存行を backfill する
+    作成した場合 True、既にあった場合 False を返す
+    """
+    fts, column = FTS_TABLES[table]
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+    ).fetchone()
+    conn.executescript(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {column}, content='{table}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, {column}) VALUES (new.id, {_indexed('new.' + column)});
+    END;
+    CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, {_indexed('old.' + column)});
+    END;
+    CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, {_indexed('old.' + column)});
+        INSERT INTO {fts}(rowid, {column}) VALUES (new.id, {_indexed('new.' + column)});
+    END;
+    """)
+    if exists:
+        return False
+    if backfill:
+        rebuild_fts(conn, table)
+    return True
+
+
+def rebuild_fts(conn, table):
+    """FTS 索引を元テーブルから作り直し、索引に入れた行数を返す（既存 DB の backfill 用）"""
+    fts, column = FTS_TABLES[table]
+    conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+    cursor = conn.execute(
+        f"INSERT INTO {fts}(rowid, {column}) SELECT id, {_indexed(column)} FROM {table}"
+    )
+    conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+    conn.commit()
+    return cursor.rowcount
+
+
+def build_match_query(text, raw=False):
+    """利用者の入力を FTS5 の MATCH 式にする
+    - カンマ区切りの各タグをフレーズ（引用符で囲む）として AND 検索する
+      "(masterpiece:1.2)" や引用符を含む入力も、そのままの語の並びとして探す
+      末尾の * は前方一致（例: "soft light*, portrait"）
+    - raw=True か RAW_PREFIX で始まる入力だけは FTS5 の構文（AND/OR/NOT/NEAR・括弧）としてそのまま使う
+    """
+    text = (text or "").strip()
+    if text.lower().startswith(RAW_PREFIX):
+        text, raw = text[len(RAW_PREFIX):].strip(), True
+    if not text:
+        return None
+    if raw:
+        return text
+    terms = []
+    for tag in text.split(","):
+        tag = _SEPARATOR_TOKEN.sub(" ", tag).strip()
+        prefix = tag.endswith("*")
+        tag = tag.rstrip("*").strip()
+        if not tag:
+            continue
+        phrase = '"' + tag.replace('"', '""') + '"'
+        terms.append(phrase + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+
+def search(conn, table, query, columns=("id",), limit=20, offset=0, raw=False):
+    """bm25 順に検索し、(columns..., score) のタプルのリストを返す（score は小さいほど関連が高い）
+    FTS5 の構文として解釈できない入力（raw の書き間違いなど）は空のリストを返す
+    """
+    fts, _ = FTS_TABLES[table]
+    match = build_match_query(query, raw=raw)
+    if match is None:
+        return []
+    select_cols = ", ".join(f"t.{c}" for c in columns)
+    try:
+        return conn.execute(f"""
+            SELECT {select_cols}, bm25({fts}) AS score
+            FROM {fts}
+            JOIN {table} t ON t.id = {fts}.rowid
+            WHERE {fts} MATCH ?
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        """, (match, limit, offset)).fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"[search] Invalid search query {match!r}: {e}")
+        return []
@@ -0,0 +1,187 @@
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=16):
+    """プロセス共有の requests.Session を返す（keep-alive で TCP/TLS 接続を使い回す）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def cache_key(url, params=None):
+    """URL とパラメータから キャッシュキーを作る（パラメータ順に依存しない）"""
+    if params:
+        query = urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+        return f"{url}?{query}"
+    return url
+
+
+class CachedResponse:
+    """キャッシュから返すレスポンス（requests.Response の必要な部分だけ）"""
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=64 * 1024):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class ResponseCache:
+    """SQLite ファイルに置くレスポンスキャッシュ
+    - ttl 秒以内ならそのまま返し、古くなったら ETag で If-None-Match 再検証
+    - 合計サイズが max_bytes を超えたら最終アクセスの古い順に追い出す
+    """
+
+    def __init__(self, path, ttl=3600, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS http_cache (
+            key TEXT PRIMARY KEY,
+            etag TEXT,
+            headers TEXT,
+            body BLOB,
+            size INTEGER,
+            fetched_at REAL,
+            last_access REAL
+        )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_http_cache_access ON http_cache (last_access)")
+        self._conn.commit()
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+
+    def get(self, key):
+        """(body, etag, headers, fresh) を返す。無ければ None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, headers, fetched_at FROM http_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE http_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        body, etag, headers, fetched_at = row
+        fresh = (time.time() - fetched_at) < self.ttl
+        return body, etag, json.loads(headers or "{}"), fresh
+
+    def put(self, key, body, etag=None, headers=None):
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM http_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute('''
+            INSERT OR REPLACE INTO http_cache (key, etag, headers, body, size, fetched_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, etag, json.dumps(headers or {}), body, len(body), now, now))
+            self._total += len(body) - (old[0] if old else 0)
+            self.stats["stores"] += 1
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """304 で再検証できた時に鮮度を更新する"""
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "UPDATE http_cache SET fetched_at = ?, last_access = ? WHERE key = ?", (now, now, key)
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        """サイズ上限を超えた分を最終アクセスの古い順に削除（ロック内で呼ぶ）"""
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM http_cache ORDER BY last_access LIMIT 32"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM http_cache WHERE key = ?", (key,))
+                self._total -= size
+                self.stats["evictions"] += 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedHttpClient:
+    """共有セッション + 任意のレスポンスキャッシュで GET する
+    キャッシュは 200 の応答だけを保存し、キーにヘッダー（API キー等）は含めない
+    """
+
+    def __init__(self, session=None, cache=None):
+        self.session = session or get_session()
+        self.cache = cache
+
+    def get(self, url, params=None, headers=None, timeout=(5, 100), stream=False, before_request=None):
+        """stream=True はキャッシュ無しの時だけ本文を逐次読みにする（キャッシュ時は保存のため全体を読む）
+        before_request はネットワークへ送る直前に呼ぶ（レート制御用。新鮮なキャッシュを返す時は呼ばない）
+        """
+        if self.cache is None:
+            if before_request is not None:
+                before_request()
+            return self.session.get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+
+        key = cache_key(url, params)
+        cached = self.cache.get(key)
+        request_headers = dict(headers or {})
+        if cached is not None:
+            body, etag, cached_headers, fresh = cached
+            if fresh:
+                self.cache.stats["hits"] += 1
+                return CachedResponse(200, body, cached_headers)
+            if etag:
+                request_headers["If-None-Match"] = etag
+        self.cache.stats["misses"] += 1
+
+        if before_request is not None:
+            before_request()
+        response = self.session.get(url, params=params, headers=request_headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            self.cache.stats["revalidated"] += 1
+            self.cache.touch(key)
+            return CachedResponse(200, cached[0], cached[2])
+        if response.status_code == 200:
+            kept_headers = {k: v for k, v in response.headers.items()
+                            if k.lower() in ("content-type", "etag", "last-modified")}
+            self.cache.put(key, response.content, response.headers.get("ETag"), kept_headers)
+        return response
@@ -0,0 +1,128 @@
+import json
+import re
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # orjson が無ければ標準の json で読む
+    loads = json.loads
+
+# 文字列の外で意味を持つ文字 / 文字列の中で意味を持つ文字
+_STRUCT = re.compile(rb'["{}\[\]]')
+_IN_STRING = re.compile(rb'["\\]')
+
+
+class ItemStreamParser:
+    """API ページ（{"items": [...], "metadata": {...}}）をチャンクごとに読み、
+    items 配列の要素を1件ずつ生バイト列として取り出すインクリメンタルパーサ
+    - ページ全体を一度にメモリへ載せず、要素が閉じた時点で返す
+    - 返すバイト列は元の JSON のスライスなので、再シリアライズせずに raw_metadata に使える
+    - items 以外の部分（metadata など）は小さな骨組みとして残し、close() で dict にして返す
+    """
+
+    def __init__(self, array_key=b"items"):
+        self.array_key = array_key
+        self._buf = b""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = None
+        self._last_key = None
+        self._in_items = False
+        self._item_start = None
+        self._skel_from = 0
+        self._skeleton = bytearray()
+        self.bytes_read = 0
+
+    def feed(self, chunk):
+        """チャンクを読み込み、完結した要素のバイト列をリストで返す"""
+        self.bytes_read += len(chunk)
+        buf = self._buf + chunk if self._buf else bytes(chunk)
+        pos = self._pos
+        items = []
+        while True:
+            if self._in_string:
+                m = _IN_STRING.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                idx = m.start()
+                if buf[idx] == 0x5C:  # backslash: 次の1バイトを飛ばす（チャンク境界なら続きを待つ）
+                    if idx + 1 >= len(buf):
+                        pos = idx
+                        break
+                    pos = idx + 2
+                    continue
+                self._in_string = False
+                if self._depth == 1 and self._string_start is not None:
+                    self._last_key = buf[self._string_start + 1:idx]
+                self._string_start = None
+                pos = idx + 1
+                continue
+
+            m = _STRUCT.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            idx = m.start()
+            ch = buf[idx]
+            pos = idx + 1
+            if ch == 0x22:  # "
+                self._in_string = True
+                self._string_start = idx
+            elif ch in (0x7B, 0x5B):  # { [
+                if (not self._in_items and self._depth == 1 and ch == 0x5B
+                        and self._last_key == self.array_key):
+                    # items 配列に入る: ここまでを骨組みに入れ、要素の中身は骨組みから外す
+                    self._skeleton += buf[self._skel_from:idx + 1]
+                    self._skel_from = None
+                    self._in_items = True
+                elif self._in_items and self._depth == 2:
+                    self._item_start = idx
+                self._depth += 1
+            else:  # } ]
+                self._depth -= 1
+                if self._in_items and self._depth == 2 and self._item_start is not None:
+                    items.append(buf[self._item_start:idx + 1])
+                    self._item_start = None
+                elif self._in_items and self._depth == 1:
+                    # items 配列を抜けた: 閉じ括弧から骨組みの記録を再開
+                    self._in_items = False
+                    self._skel_from = idx
+            if self._depth == 1 and ch in (0x7D, 0x5D) and not self._in_items:
+                self._last_key = None
+
+        # 使い終わった先頭部分を捨てる（要素・キー文字列の途中なら、その開始位置から残す）
+        keep = pos
+        if self._item_start is not None:
+            keep = min(keep, self._item_start)
+        if self._in_string and self._string_start is not None:
+            keep = min(keep, self._string_start)
+        if self._skel_from is not None:
+            self._skeleton += buf[self._skel_from:keep]
+            self._skel_from = 0
+        if self._item_start is not None:
+            self._item_start -= keep
+        if self._string_start is not None:
+            self._string_start -= keep
+        self._buf = buf[keep:]
+        self._pos = pos - keep
+        return items
+
+    def close(self):
+        """残りを読み切り、items 以外の部分（例: {"items": [], "metadata": {...}}）を dict で返す"""
+        if self._skel_from is not None:
+            self._skeleton += self._buf[self._skel_from:]
+        self._buf = b""
+        if not self._skeleton.strip():
+            return {}
+        return loads(bytes(self._skeleton))
+
+
+def iter_items(chunks, array_key=b"items"):
+    """チャンクの iterable から (item の dict, 生バイト列) を順に返し、最後に骨組み dict を return する"""
+    parser = ItemStreamParser(array_key)
+    for chunk in chunks:
+        for raw in parser.feed(chunk):
+            yield loads(raw), raw
+    return parser.close()
@@ -0,0 +1,148 @@
+from collections import deque
+
+
+class KeywordMatcher:
+    """Aho-Corasick 法による複数キーワードの一括マッチャ
+    keyword_groups: {ラベル: [キーワード, ...]}。同じキーワードが複数ラベルに属してもよい
+    テキストを1回走査するだけで全ラベルの全ヒット（重なりも含む）を返す
+    word_boundary=True のとき、英数字の途中から/途中までのヒットは捨てる
+    （例: "dark" が "darkness" に、"sfw" が "nsfw" にマッチしない）
+    """
+
+    def __init__(self, keyword_groups, word_boundary=False, lowercase=True):
+        self.word_boundary = word_boundary
+        self.lowercase = lowercase
+        self.keywords = []      # キーワード番号 -> キーワード文字列
+        self.labels = []        # キーワード番号 -> そのキーワードを持つラベルのタプル
+        self.group_order = {}   # ラベル -> 定義順のキーワード番号リスト
+        index = {}
+        for label, words in keyword_groups.items():
+            order = []
+            for word in words:
+                key = word.lower() if lowercase else word
+                if not key:
+                    continue
+                if key not in index:
+                    index[key] = len(self.keywords)
+                    self.keywords.append(key)
+                    self.labels.append(())
+                kid = index[key]
+                if label not in self.labels[kid]:
+                    self.labels[kid] = self.labels[kid] + (label,)
+                if kid not in order:
+                    order.append(kid)
+            self.group_order[label] = order
+        self._build()
+
+    def _build(self):
+        """トライを作り、失敗リンクを辿って遷移表（DFA）と出力表を完成させる"""
+        goto = [{}]
+        outputs = [[]]
+        for kid, word in enumerate(self.keywords):
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(kid)
+
+        # BFS で失敗リンクを計算し、出力を失敗先から継承する
+        fail = [0] * len(goto)
+        delta = [dict(g) for g in goto]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if goto[f].get(ch, 0) != nxt else 0
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+            # 失敗先の遷移を取り込んで、走査時に失敗リンクを辿らなくて済むようにする
+            if state:
+                for ch, nxt in delta[fail[state]].items():
+                    delta[state].setdefault(ch, nxt)
+
+        self._delta = delta
+        # 走査ループでの属性参照を省くため、状態ごとの dict.get を束縛しておく
+        self._steps = [d.get for d in delta]
+        self._outputs = [tuple((kid, len(self.keywords[kid])) for kid in out) for out in outputs]
+
+    @staticmethod
+    def _is_word_char(ch):
+        return ch.isalnum() or ch == "_"
+
+    def _on_boundary(self, text, start, end):
+        """キーワードの両端が単語の境目に来ているか"""
+        if start > 0 and self._is_word_char(text[start]) and self._is_word_char(text[start - 1]):
+            return False
+        if end < len(text) and self._is_word_char(text[end - 1]) and self._is_word_char(text[end]):
+            return False
+        return True
+
+    def iter_matches(self, text):
+        """(キーワード番号, 開始位置, 終了位置) を出現順に返すジェネレータ"""
+        if not text:
+            return
+        if self.lowercase:
+            text = text.lower()
+        steps = self._steps
+        outputs = self._outputs
+        state = 0
+        for pos, ch in enumerate(text):
+            state = steps[state](ch, 0)
+            if outputs[state]:
+                end = pos + 1
+                for kid, length in outputs[state]:
+                    start = end - length
+                    if self.word_boundary and not self._on_boundary(text, start, end):
+                        continue
+                    yield kid, start, end
+
+    def _scan_ids(self, text):
+        """位置を追わずにヒットしたキーワード番号の集合だけを求める（境界判定なしの高速経路）"""
+        if not text:
+            return set()
+        if self.lowercase:
+            text = text.lower()
+        steps = self._steps
+        outputs = self._outputs
+        state = 0
+        hit_states = set()
+        for ch in text:
+            state = steps[state](ch, 0)
+            if outputs[state]:
+                hit_states.add(state)
+        return {kid for st in hit_states for kid, _ in outputs[st]}
+
+    def find_all(self, text):
+        """全ヒットを [(ラベル, キーワード, 開始位置, 終了位置), ...] で返す"""
+        hits = []
+        for kid, start, end in self.iter_matches(text):
+            keyword = self.keywords[kid]
+            for label in self.labels[kid]:
+                hits.append((label, keyword, start, end))
+        return hits
+
+    def match_ids(self, text):
+        """ヒットしたキーワード番号の集合を返す（word_boundary の設定に従う）"""
+        if self.word_boundary:
+            return {kid for kid, _, _ in self.iter_matches(text)}
+        return self._scan_ids(text)
+
+    def match_groups(self, text):
+        """ラベルごとにヒットしたキーワードを定義順・重複なしで返す {ラベル: [キーワード, ...]}"""
+        hit_ids = self.match_ids(text)
+        if not hit_ids:
+            return {}
+        result = {}
+        for label, order in self.group_order.items():
+            found = [self.keywords[kid] for kid in order if kid in hit_ids]
+            if found:
+                result[label] = found
+        return result
@@ -4,11 +4,15 @@ from db import init_db, save_prompts
 from config import settings
 
 def main():
-    init_db(settings["DB_PATH"])
-    raw = fetch_prompts(limit=settings["FETCH_LIMIT"])
-    cleaned = clean_prompts(raw)
-    save_prompts(cleaned)
-    print("✅ Done.")
+    # マイグレーションと保存で同じ接続を使う（WAL の接続は閉じる時にチェックポイントが走るので開閉は1回に）
+    conn = init_db(settings["DB_PATH"])
+    try:
+        raw = fetch_prompts(limit=settings["FETCH_LIMIT"])
+        cleaned = clean_prompts(raw)
+        saved = save_prompts(cleaned, conn=conn)
+    finally:
+        conn.close()
+    print(f"✅ Done. ({saved} new prompts)")
 
 if __name__ == "__main__":
     main()
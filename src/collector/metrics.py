@@ -0,0 +1,211 @@
+import cProfile
+import csv
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+
+
+class _Timer:
+    """Metrics.timer() が返すコンテキストマネージャ（with を抜けた時に経過時間を足す）"""
+
+    __slots__ = ("_metrics", "_stage", "_started")
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._metrics.add_time(self._stage, time.perf_counter() - self._started)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """段階ごとの処理時間とカウンタを積算する軽量な計測器（スレッドセーフ）
+    - timer("fetch") / add_time("sleep", 秒): 回数・合計・最大を記録
+    - incr("rows_written", n): カウンタを加算
+    - report() で dict、to_json / to_csv / to_prometheus で文字列にする
+    1回の記録は perf_counter 2回とロック1回だけ。enabled=False なら何もしない
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._timers = {}       # stage -> [count, total, max]
+            self._counters = {}
+            self._started = time.perf_counter()
+
+    def timer(self, stage):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def add_time(self, stage, seconds, count=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._timers.get(stage)
+            if entry is None:
+                self._timers[stage] = [count, seconds, seconds]
+            else:
+                entry[0] += count
+                entry[1] += seconds
+                if seconds > entry[2]:
+                    entry[2] = seconds
+
+    def add_times(self, pairs):
+        """[(stage, 秒), ...] をロック1回でまとめて記録する（1件ごとに呼ばれる細かい段向け）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            timers = self._timers
+            for stage, seconds in pairs:
+                entry = timers.get(stage)
+                if entry is None:
+                    timers[stage] = [1, seconds, seconds]
+                else:
+                    entry[0] += 1
+                    entry[1] += seconds
+                    if seconds > entry[2]:
+                        entry[2] = seconds
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def report(self):
+        """{"elapsed_seconds", "timers": {stage: {...}}, "counters": {...}} を返す
+        timers の合計はスレッドごとの時間の和なので、並列に動く段では elapsed を超えることがある
+        """
+        with self._lock:
+            timers = {stage: list(v) for stage, v in self._timers.items()}
+            counters = dict(self._counters)
+            elapsed = time.perf_counter() - self._started
+        return {
+            "elapsed_seconds": round(elapsed, 6),
+            "timers": {
+                stage: {
+                    "count": count,
+                    "total_seconds": round(total, 6),
+                    "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+                    "max_ms": round(peak * 1000, 3),
+                }
+                for stage, (count, total, peak) in sorted(timers.items())
+            },
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def to_json(self, report=None):
+        return json.dumps(report or self.report(), ensure_ascii=False, indent=2)
+
+    def to_csv(self, report=None):
+        """1行1指標: kind, name, count, total_seconds, mean_ms, max_ms, value"""
+        report = report or self.report()
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["kind", "name", "count", "total_seconds", "mean_ms", "max_ms", "value"])
+        writer.writerow(["run", "elapsed_seconds", "", "", "", "", report["elapsed_seconds"]])
+        for stage, t in report["timers"].items():
+            writer.writerow(["timer", stage, t["count"], t["total_seconds"], t["mean_ms"], t["max_ms"], ""])
+        for name, value in report["counters"].items():
+            writer.writerow(["counter", name, "", "", "", "", value])
+        return buf.getvalue()
+
+    def to_prometheus(self, report=None, prefix="civitai_collector"):
+        """Prometheus のテキスト形式（node_exporter の textfile collector などにそのまま置ける）"""
+        report = report or self.report()
+        lines = [
+            f"# TYPE {prefix}_elapsed_seconds gauge",
+            f"{prefix}_elapsed_seconds {report['elapsed_seconds']}",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{stage}"}} {t["total_seconds"]}'
+                  for stage, t in report["timers"].items()]
+        lines.append(f"# TYPE {prefix}_stage_calls_total counter")
+        lines += [f'{prefix}_stage_calls_total{{stage="{stage}"}} {t["count"]}'
+                  for stage, t in report["timers"].items()]
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        """拡張子で形式を選んでファイルに書く（.json / .csv / .prom）"""
+        report = self.report()
+        if path.endswith(".csv"):
+            text = self.to_csv(report)
+        elif path.endswith(".prom"):
+            text = self.to_prometheus(report)
+        else:
+            text = self.to_json(report)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def summary(self):
+        """1行の要約（ログ用）"""
+        report = self.report()
+        stages = " ".join(f"{stage}={t['total_seconds']:.2f}s" for stage, t in report["timers"].items())
+        counters = " ".join(f"{name}={value}" for name, value in report["counters"].items())
+        return f"elapsed={report['elapsed_seconds']:.2f}s {stages} {counters}".strip()
+
+
+def profile_call(func, *args, stats_path=None, sort="cumulative", top=30, **kwargs):
+    """func(*args, **kwargs) を cProfile 下で実行して結果を返す
+    収集はスレッドのパイプラインなので、実行中に起動したスレッドにもそれぞれプロファイラを付けて最後に合算する
+    （Python 3.12 以降は複数のプロファイラを同時に有効にできないため、呼び出したスレッドの分だけになる）
+    stats_path があれば pstats 形式で保存（snakeviz / python -m pstats で読める）。上位 top 件を表示
+    """
+    profilers = []
+    lock = threading.Lock()
+
+    def start_thread_profiler(frame, event, arg):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return
+        with lock:
+            profilers.append(profiler)
+
+    main = cProfile.Profile()
+    threading.setprofile(start_thread_profiler)
+    try:
+        return main.runcall(func, *args, **kwargs)
+    finally:
+        threading.setprofile(None)
+        stats = pstats.Stats(main)
+        with lock:
+            for profiler in profilers:
+                profiler.disable()
+                stats.add(profiler)
+        if stats_path:
+            stats.dump_stats(stats_path)
+            print(f"[profile] Stats written to {stats_path} ({len(profilers) + 1} threads)")
+        stats.sort_stats(sort).print_stats(top)
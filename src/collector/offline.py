@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# offline.py
+# 保存済みの API 生データを複数プロセスで再抽出・再スコア・再分類して DB に書き戻す
+# - 入力: API ページを1行1ページ（または1行1アイテム）で保存した JSONL、または DB の raw_metadata（raw_payloads）
+# - 抽出・スコア・カテゴリ分け（CPU 処理）はプロセスプールで並列化し、キーワード照合器はワーカーごとに1回だけ作る
+# - 書き込みはメインプロセスの1本の SQLite 接続だけが行う（save_prompt_batch）
+# - 投入中のチャンク数を workers × 2 に抑えるので、入力がどれだけ大きくてもメモリは一定
+#
+# 使い方:
+#   python src/collector/offline.py --db civitai_dataset.db --jsonl dumps/*.jsonl --workers 4
+#   python src/collector/offline.py --db civitai_dataset.db --from-db --workers 8
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import storage
+from civitai_collector_v8 import CivitaiPromptCollector
+
+# ワーカープロセスごとに1つだけ作る抽出・分類器
+_processor = None
+
+
+def _init_worker(db_path, word_boundary):
+    """ワーカー起動時に1回だけ呼ばれる: 照合器をコンパイルし、raw の zstd 辞書を読む"""
+    global _processor
+    _processor = CivitaiPromptCollector(db_path=db_path, word_boundary=word_boundary, setup_db=False)
+    if db_path and os.path.exists(db_path):
+        conn = storage.connect(db_path, readonly=True)
+        try:
+            _processor.raw_store.load_dictionaries(conn)
+        except sqlite3.OperationalError:
+            # raw_dictionaries がまだ無い DB
+            pass
+        finally:
+            conn.close()
+
+
+def _iter_items(line):
+    """JSONL の1行（ページ or アイテム）から API アイテムを取り出す"""
+    obj = json.loads(line)
+    if isinstance(obj, dict) and isinstance(obj.get("items"), list):
+        return obj["items"]
+    return [obj]
+
+
+def process_lines(lines):
+    """ワーカー: JSONL の行のまとまりを抽出・分類して prompt_data のリストを返す"""
+    results = []
+    for line in lines:
+        for item in _iter_items(line):
+            prompt_data = _processor.prepare_item(item)
+            if prompt_data:
+                results.append(prompt_data)
+    return results
+
+
+def process_rows(rows):
+    """ワーカー: DB の (codec, payload, raw_metadata, model_id, model_name) を展開して抽出・分類する"""
+    results = []
+    for codec, payload, legacy, model_id, model_name in rows:
+        text = _processor.raw_store.decode(codec, payload) if payload is not None else legacy
+        if not text:
+            continue
+        # 元の JSON 文字列をそのまま raw に渡すので、raw_payloads のハッシュは保存済みのものと一致する
+        prompt_data = _processor.prepare_item(json.loads(text), model_id, model_name, raw=text.encode("utf-8"))
+        if prompt_data:
+            results.append(prompt_data)
+    return results
+
+
+def iter_jsonl_chunks(paths, lines_per_chunk):
+    chunk = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                chunk.append(line)
+                if len(chunk) >= lines_per_chunk:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_db_chunks(db_path, rows_per_chunk):
+    """civitai_prompts を id 順に読み、生データ（圧縮済み or 旧 raw_metadata 列）をチャンクで返す"""
+    conn = storage.connect(db_path, readonly=True)
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute('''
+            SELECT p.id, r.codec, r.payload, p.raw_metadata, p.model_id, p.model_name
+            FROM civitai_prompts p
+            LEFT JOIN raw_payloads r ON r.hash = p.raw_hash
+            WHERE p.id > ?
+            ORDER BY p.id LIMIT ?
+            ''', (last_id, rows_per_chunk)).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [r[1:] for r in rows]
+    finally:
+        conn.close()
+
+
+def run(db_path, chunks, task, workers=None, word_boundary=False, force=False):
+    """chunks を task（process_lines / process_rows）でプール処理し、結果を1本の接続で書き込む
+    {"items", "saved", "write_seconds", "seconds", "items_per_sec", "workers"} を返す
+    force=True なら内容が同じ行もカテゴリ・タグを作り直す（save_prompt_batch の force）
+    既存行の collected_at は変えない（再処理は収集ではないので、差分出力の位置を進めない）
+    """
+    workers = workers or os.cpu_count() or 1
+    writer = CivitaiPromptCollector(db_path=db_path, word_boundary=word_boundary)
+    # WAL + synchronous=NORMAL の接続（コミットごとの fsync をしない）
+    conn = storage.connect(db_path)
+    started = time.perf_counter()
+    stats = {"items": 0, "saved": 0, "write_seconds": 0.0}
+
+    def write(results):
+        stats["items"] += len(results)
+        if results:
+            # 書き込みは1本なので、ここの時間が全体に近づいたら並列度を上げても速くならない
+            write_started = time.perf_counter()
+            stats["saved"] += writer.save_prompt_batch(results, conn=conn, force=force, keep_collected_at=True)
+            stats["write_seconds"] += time.perf_counter() - write_started
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(db_path, word_boundary)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(task, chunk))
+                # 投入済みチャンクが多すぎる時は古いものから書き込んで待つ（順序も保つ）
+                while len(pending) >= workers * 2:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    stats["write_seconds"] = round(stats["write_seconds"], 3)
+    result = dict(stats, seconds=round(elapsed, 3),
+                  items_per_sec=round(stats["items"] / max(elapsed, 1e-9), 1), workers=workers)
+    print(f"[offline] Completed: {result}")
+    return result
+
+
+def process_jsonl(db_path, paths, workers=None, lines_per_chunk=20, word_boundary=False, force=False):
+    """保存済み API ページ（JSONL）を並列処理して DB に保存する（既にある行は変わった分だけ書く）"""
+    return run(db_path, iter_jsonl_chunks(paths, lines_per_chunk), process_lines,
+               workers=workers, word_boundary=word_boundary, force=force)
+
+
+def reprocess_db(db_path, workers=None, rows_per_chunk=2000, word_boundary=False):
+    """DB に保存済みの生データから全行を再抽出・再スコア・再分類する
+    生データは保存済みのものと同じなので、語彙の変更を反映するには force で作り直す必要がある
+    """
+    return run(db_path, iter_db_chunks(db_path, rows_per_chunk), process_rows,
+               workers=workers, word_boundary=word_boundary, force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-extract and re-categorize saved CivitAI data in parallel")
+    parser.add_argument("--db", default="civitai_dataset.db")
+    parser.add_argument("--jsonl", nargs="*", default=[], help="API ページを1行ずつ保存した JSONL")
+    parser.add_argument("--from-db", action="store_true", help="DB の raw_metadata から再処理する")
+    parser.add_argument("--workers", type=int, default=None, help="プロセス数（既定: CPU 数）")
+    parser.add_argument("--chunk", type=int, default=None, help="1ワーカーに渡す行数")
+    parser.add_argument("--word-boundary", action="store_true")
+    parser.add_argument("--force", action="store_true", help="--jsonl で内容が同じ行もカテゴリ・タグを作り直す")
+    args = parser.parse_args()
+
+    if args.from_db:
+        reprocess_db(args.db, workers=args.workers, rows_per_chunk=args.chunk or 2000,
+                     word_boundary=args.word_boundary)
+    elif args.jsonl:
+        process_jsonl(args.db, args.jsonl, workers=args.workers, lines_per_chunk=args.chunk or 20,
+                      word_boundary=args.word_boundary, force=args.force)
+    else:
+        parser.error("--jsonl か --from-db を指定してください")
+
+
+if __name__ == "__main__":
+    main()
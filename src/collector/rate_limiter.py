@@ -0,0 +1,172 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限。スレッド・asyncio のどちらからも共有できる
+    rate: 1秒あたりに補充されるトークン数（= 平均リクエスト数/秒）
+    capacity: 貯められるトークンの上限（瞬間的に許すバースト数）
+    """
+
+    def __init__(self, rate, capacity=1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """トークンを1つ予約し、実際に使えるまでの待ち時間（秒）を返す
+        先に予約した呼び出し元から順に枠が割り当てられるので、並行していても公平になる
+        """
+        with self._lock:
+            now = time.monotonic()
+            return self._take(now, now)
+
+    def _take(self, now, start):
+        """start 以降で最初に使えるトークンを1つ取り、now からの待ち時間を返す（self._lock を持って呼ぶ）
+        補充は start（と先の予約で進めた時刻）から数えるので、start を未来にすると枠はそこから1つずつ並ぶ
+        """
+        if start > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (start - self._updated) * self.rate)
+            self._updated = start
+        self._tokens -= 1.0
+        wait = self._updated - now
+        if self._tokens < 0:
+            wait += -self._tokens / self.rate
+        return max(0.0, wait)
+
+    def acquire(self):
+        """トークンが使えるまでブロックして待つ"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """トークンが使えるまでイベントループを止めずに待つ"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def parse_retry_after(value, now=None):
+    """Retry-After ヘッダー（秒数 or HTTP 日付）を待ち秒数にする。解釈できなければ None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    now = now if now is not None else time.time()
+    return max(0.0, when.timestamp() - now)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """応答を見て送信レートを AIMD で調整するトークンバケット
+    - 正常応答が続けば rate を increase ずつ上げる（max_rate まで）
+    - 429 を受けたら rate を decrease 倍に下げ、Retry-After（無ければジッター付き指数バックオフ）の間は全体を止める
+    - X-RateLimit-Remaining が 0 なら Reset まで止める
+    スレッド・asyncio のどちらから共有してもよい
+    """
+
+    def __init__(self, initial_rate=1.0, min_rate=0.05, max_rate=5.0, capacity=1,
+                 increase=0.05, decrease=0.5, base_backoff=1.0, max_backoff=120.0):
+        super().__init__(initial_rate, capacity=capacity)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._blocked_until = 0.0
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "waited": 0.0}
+
+    @property
+    def current_rate(self):
+        """現在の送信レート（リクエスト/秒）"""
+        return self.rate
+
+    def _reserve(self):
+        # 止めている間の呼び出しは解除時刻から rate の間隔で並べる（解除と同時に全員が送らないように）
+        with self._lock:
+            now = time.monotonic()
+            wait = self._take(now, max(now, self._blocked_until))
+            self.stats["requests"] += 1
+            self.stats["waited"] += wait
+        return wait
+
+    def backoff_delay(self, attempt):
+        """ジッター付き指数バックオフの待ち秒数（上限の半分〜上限で一様に散らす）"""
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** max(0, attempt - 1)))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def _block_for(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _header_wait(self, headers):
+        """レート制限系ヘッダーから「残り0なので待つべき秒数」を読む"""
+        if not headers:
+            return None
+        remaining = headers.get("X-RateLimit-Remaining") or headers.get("RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset") or headers.get("RateLimit-Reset")
+        if remaining is None or reset is None:
+            return None
+        try:
+            if int(float(remaining)) > 0:
+                return None
+            reset = float(reset)
+        except ValueError:
+            return None
+        # 大きな値はエポック秒、小さな値は残り秒数として扱う
+        return max(0.0, reset - time.time()) if reset > 1e9 else reset
+
+    def on_success(self, headers=None):
+        """正常応答: 加算的にレートを上げる"""
+        with self._lock:
+            self.stats["ok"] += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+        wait = self._header_wait(headers)
+        if wait:
+            self._block_for(wait)
+
+    def on_rate_limited(self, headers=None, attempt=1):
+        """429: 乗算的にレートを下げ、待ち秒数を決めて全体を止める。待ち秒数を返す"""
+        with self._lock:
+            self.stats["rate_limited"] += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+        wait = parse_retry_after((headers or {}).get("Retry-After"))
+        if wait is None:
+            wait = self._header_wait(headers)
+        if wait is None:
+            wait = self.backoff_delay(attempt)
+        self._block_for(wait)
+        return wait
+
+    def on_error(self, attempt=1):
+        """通信エラー・5xx: レートは少し下げ、ジッター付き指数バックオフで止める。待ち秒数を返す"""
+        with self._lock:
+            self.stats["errors"] += 1
+            self.rate = max(self.min_rate, self.rate * (1 + self.decrease) / 2)
+        wait = self.backoff_delay(attempt)
+        self._block_for(wait)
+        return wait
+
+    def snapshot(self):
+        """現在のレートと統計値"""
+        with self._lock:
+            return dict(self.stats, rate=round(self.rate, 4))
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd が無ければ zlib だけで動かす
+    zstandard = None
+
+
+class RawPayloadStore:
+    """API の生データ（raw_metadata）を圧縮・重複排除して raw_payloads テーブルに置くための符号化器
+    - 同じ内容の payload はハッシュをキーに1回だけ保存する
+    - zstandard が入っていれば zstd（学習済み辞書があれば辞書付き）、無ければ zlib で圧縮
+    codec 文字列: "zlib" / "zstd" / "zstd:<辞書ID>"
+    """
+
+    def __init__(self, zlib_level=6, zstd_level=9):
+        self.zlib_level = zlib_level
+        self.zstd_level = zstd_level
+        self.dictionaries = {}       # 辞書ID -> zstandard.ZstdCompressionDict
+        self.active_dict_id = None   # 新規書き込みに使う辞書
+        # zstd の圧縮器/展開器はスレッド間で共有できないのでスレッドごとに持つ
+        self._local = threading.local()
+
+    @staticmethod
+    def payload_hash(data):
+        """payload（bytes）の重複排除キー"""
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def load_dictionaries(self, conn):
+        """raw_dictionaries から学習済み辞書を読み込み、最新のものを書き込み用にする"""
+        if zstandard is None:
+            return
+        rows = conn.execute("SELECT id, dictionary FROM raw_dictionaries ORDER BY id").fetchall()
+        for dict_id, blob in rows:
+            self.dictionaries[dict_id] = zstandard.ZstdCompressionDict(blob)
+        if rows:
+            self.active_dict_id = rows[-1][0]
+        self._local = threading.local()
+
+    def train_dictionary(self, conn, samples, dict_size=64 * 1024):
+        """サンプル payload から zstd 辞書を学習して保存し、その辞書IDを返す（zstd が無ければ None）"""
+        if zstandard is None or not samples:
+            return None
+        trained = zstandard.train_dictionary(dict_size, [s if isinstance(s, bytes) else s.encode("utf-8")
+                                                         for s in samples])
+        cursor = conn.execute("INSERT INTO raw_dictionaries (dictionary) VALUES (?)", (trained.as_bytes(),))
+        conn.commit()
+        dict_id = cursor.lastrowid
+        self.dictionaries[dict_id] = trained
+        self.active_dict_id = dict_id
+        self._local = threading.local()
+        return dict_id
+
+    def _compressor(self):
+        comp = getattr(self._local, "compressor", None)
+        if comp is None or self._local.compressor_dict_id != self.active_dict_id:
+            dictionary = self.dictionaries.get(self.active_dict_id)
+            if dictionary is not None:
+                comp = zstandard.ZstdCompressor(level=self.zstd_level, dict_data=dictionary)
+            else:
+                comp = zstandard.ZstdCompressor(level=self.zstd_level)
+            self._local.compressor = comp
+            self._local.compressor_dict_id = self.active_dict_id
+        return comp
+
+    def _decompressor(self, dict_id):
+        cache = getattr(self._local, "decompressors", None)
+        if cache is None:
+            cache = self._local.decompressors = {}
+        if dict_id not in cache:
+            dictionary = self.dictionaries.get(dict_id)
+            if dict_id is not None and dictionary is None:
+                raise KeyError(f"zstd dictionary {dict_id} is not loaded")
+            cache[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary) if dictionary else zstandard.ZstdDecompressor()
+        return cache[dict_id]
+
+    def encode(self, raw):
+        """raw（str か bytes）を (hash, codec, 圧縮済み blob) にする"""
+        data = raw.encode("utf-8") if isinstance(raw, str) else raw
+        digest = self.payload_hash(data)
+        if zstandard is not None:
+            codec = f"zstd:{self.active_dict_id}" if self.active_dict_id is not None else "zstd"
+            return digest, codec, self._compressor().compress(data)
+        return digest, "zlib", zlib.compress(data, self.zlib_level)
+
+    def decode(self, codec, blob):
+        """encode の逆。元の JSON 文字列を返す"""
+        if codec == "zlib":
+            data = zlib.decompress(blob)
+        elif codec.startswith("zstd"):
+            if zstandard is None:
+                raise RuntimeError("this payload is zstd-compressed; install zstandard to read it")
+            dict_id = int(codec.split(":", 1)[1]) if ":" in codec else None
+            data = self._decompressor(dict_id).decompress(blob)
+        else:
+            raise ValueError(f"unknown raw payload codec: {codec}")
+        return data.decode("utf-8")
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# report.py
+# model_name × category の分布レポート（PNG / CSV / HTML）を大きな DB でも一定のメモリで作る
+# - 集計は SQL（model_category_stats）で行い、上位 top_models モデル × 上位 top_categories カテゴリだけを読む
+#   それ以外のモデル・カテゴリは SQL 側で "(other models)" / "other" にまとめる
+# - 全モデルの件数一覧（model_totals.csv）はカーソルから1行ずつ書くので、モデル数が増えてもメモリは増えない
+# - 描画は pyplot を使わず Figure + FigureCanvasAgg で行う（グローバルな図の状態を持たないので、
+#   1プロセスで何枚描いても図が溜まらない。ヘッドレス環境でもそのまま動く）
+#
+# 使い方:
+#   python src/collector/report.py civitai_dataset.db report/ --top-models 30 --top-categories 15
+#   python src/collector/report.py civitai_dataset.db report/ --models "Model A" "Model B" --count
+
+import argparse
+import csv
+import html
+import os
+import time
+
+import category_stats
+import storage
+
+OTHER_MODELS = "(other models)"
+OTHER_CATEGORY = "other"
+
+
+def category_summary(conn, top_models=30, top_categories=15, models=None):
+    """上位モデル × 上位カテゴリの件数を SQL で集計して返す
+    {"models": [名前...], "categories": [名前...], "counts": [[モデルごとのカテゴリ別件数]...],
+     "totals": [モデルごとの合計], "model_count": 全モデル数, "total": 全件数}
+    models を渡すとそのモデルだけを、渡した順で並べる（top_models は適用しない）
+    上位に入らなかったモデル・カテゴリはそれぞれ OTHER_MODELS の行・OTHER_CATEGORY の列にまとめる
+    """
+    table = category_stats.STATS_TABLE
+    where = "prompt_count > 0"
+    params = []
+    if models:
+        where += f" AND model_name IN ({', '.join('?' for _ in models)})"
+        params = list(models)
+
+    model_count, total = conn.execute(
+        f"SELECT COUNT(DISTINCT model_name), COALESCE(SUM(prompt_count), 0) FROM {table} WHERE {where}", params
+    ).fetchone()
+    if not model_count:
+        return {"models": [], "categories": [], "counts": [], "totals": [], "model_count": 0, "total": 0}
+
+    category_names = [row[0] for row in conn.execute(f"""
+        SELECT category FROM {table} WHERE {where}
+        GROUP BY category ORDER BY SUM(prompt_count) DESC, category LIMIT ?
+    """, params + [top_categories])]
+    if models:
+        model_names = list(dict.fromkeys(models))
+    else:
+        model_names = [row[0] for row in conn.execute(f"""
+            SELECT model_name FROM {table} WHERE {where}
+            GROUP BY model_name ORDER BY SUM(prompt_count) DESC, model_name LIMIT ?
+        """, params + [top_models])]
+
+    # 上位に入らなかったものを SQL 側でまとめるので、返ってくる行数は最大で (モデル数+1) × (カテゴリ数+1)
+    model_marks = ", ".join("?" for _ in model_names)
+    category_marks = ", ".join("?" for _ in category_names)
+    rows = conn.execute(f"""
+        SELECT CASE WHEN model_name IN ({model_marks}) THEN model_name ELSE ? END AS model,
+               CASE WHEN category IN ({category_marks}) THEN category ELSE ? END AS cat,
+               SUM(prompt_count)
+        FROM {table} WHERE {where}
+        GROUP BY model, cat
+    """, model_names + [OTHER_MODELS] + category_names + [OTHER_CATEGORY] + params).fetchall()
+
+    row_index = {name: i for i, name in enumerate(model_names)}
+    column_index = {name: j for j, name in enumerate(category_names)}
+    if OTHER_MODELS not in row_index and any(model == OTHER_MODELS for model, _, _ in rows):
+        row_index[OTHER_MODELS] = len(model_names)
+        model_names = model_names + [OTHER_MODELS]
+    if OTHER_CATEGORY not in column_index and any(cat == OTHER_CATEGORY for _, cat, _ in rows):
+        column_index[OTHER_CATEGORY] = len(category_names)
+        category_names = category_names + [OTHER_CATEGORY]
+
+    counts = [[0] * len(category_names) for _ in model_names]
+    for model, cat, count in rows:
+        if model in row_index:
+            counts[row_index[model]][column_index[cat]] += count
+    # models で指定したが件数の無いモデルは落とす
+    keep = [i for i, row in enumerate(counts) if any(row)]
+    return {
+        "models": [model_names[i] for i in keep],
+        "categories": category_names,
+        "counts": [counts[i] for i in keep],
+        "totals": [sum(counts[i]) for i in keep],
+        "model_count": model_count,
+        "total": total,
+    }
+
+
+def shown_models(summary):
+    """図・表に個別に出したモデル数（"(other models)" の行は数えない）"""
+    return sum(1 for name in summary["models"] if name != OTHER_MODELS)
+
+
+def iter_model_totals(conn):
+    """全モデルの (model_name, 件数) を件数の多い順に1行ずつ返す（fetchall しない）"""
+    return conn.execute(f"""
+        SELECT model_name, SUM(prompt_count) AS total FROM {category_stats.STATS_TABLE}
+        WHERE prompt_count > 0 GROUP BY model_name ORDER BY total DESC, model_name
+    """)
+
+
+def _new_figure(width, height):
+    """pyplot を通さない Figure（Agg キャンバス付き）を作る"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def draw_distribution(fig, summary, normalize_percent=True):
+    """summary のモデルごとのカテゴリ分布を fig に横向きのスタック棒グラフで描く"""
+    import matplotlib
+    import numpy as np
+
+    counts = np.asarray(summary["counts"], dtype=float)
+    if normalize_percent:
+        counts = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1) * 100.0
+    cmap = matplotlib.colormaps["tab20"]
+    y = np.arange(len(summary["models"]))
+    left = np.zeros(len(summary["models"]))
+    ax = fig.add_subplot()
+    for j, cat in enumerate(summary["categories"]):
+        # "other" 列は目立たない灰色にする
+        color = "0.75" if cat == OTHER_CATEGORY else cmap(j % 20)
+        ax.barh(y, counts[:, j], left=left, label=cat, color=color)
+        left += counts[:, j]
+    ax.set_yticks(y, summary["models"])
+    ax.invert_yaxis()
+    ax.set_xlabel("Category Distribution (%)" if normalize_percent else "Count")
+    ax.set_title(f"Prompt Category Distribution by Model (top {shown_models(summary)} of "
+                 f"{summary['model_count']} models)")
+    ax.legend(bbox_to_anchor=(1.02, 1), loc="upper left", fontsize="small")
+    fig.tight_layout()
+    return ax
+
+
+def draw_totals(fig, summary):
+    """summary のモデルごとの件数を横棒グラフで描く"""
+    ax = fig.add_subplot()
+    y = range(len(summary["models"]))
+    ax.barh(y, summary["totals"], color="tab:blue")
+    ax.set_yticks(y, summary["models"])
+    ax.invert_yaxis()
+    ax.set_xlabel("Category assignments")
+    ax.set_title(f"Prompts by Model (total {summary['total']:,})")
+    fig.tight_layout()
+    return ax
+
+
+def chart_height(summary):
+    """モデル数に合わせた図の高さ（インチ）"""
+    return max(4.0, 0.3 * len(summary["models"]) + 1.5)
+
+
+def render_distribution(summary, path, normalize_percent=True, dpi=150):
+    """分布図を PNG に保存する。図はこの関数の中で捨てるので、何枚描いてもメモリは溜まらない"""
+    fig = _new_figure(12, chart_height(summary))
+    draw_distribution(fig, summary, normalize_percent)
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def render_totals(summary, path, dpi=150):
+    fig = _new_figure(10, chart_height(summary))
+    draw_totals(fig, summary)
+    fig.savefig(path, dpi=dpi)
+    return path
+
+
+def write_summary_csv(summary, path):
+    """上位モデル × カテゴリの件数（横持ち: model_name, total, <category>...）"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["model_name", "total"] + summary["categories"])
+        for name, total, row in zip(summary["models"], summary["totals"], summary["counts"]):
+            writer.writerow([name, total] + row)
+    return path
+
+
+def write_model_totals_csv(conn, path):
+    """全モデルの件数をカーソルから1行ずつ書く。書いた行数を返す"""
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["model_name", "total"])
+        for row in iter_model_totals(conn):
+            writer.writerow(row)
+            written += 1
+    return written
+
+
+def write_html(summary, path, images=(), normalize_percent=True):
+    """図（同じディレクトリの PNG への相対リンク）と上位モデル × カテゴリの表を1枚の HTML にする"""
+    esc = html.escape
+    head = "".join(f"<th>{esc(c)}</th>" for c in summary["categories"])
+    body = []
+    for name, total, row in zip(summary["models"], summary["totals"], summary["counts"]):
+        if normalize_percent:
+            cells = "".join(f"<td>{v / max(total, 1) * 100:.1f}%</td>" for v in row)
+        else:
+            cells = "".join(f"<td>{v}</td>" for v in row)
+        body.append(f"<tr><th>{esc(name)}</th><td>{total}</td>{cells}</tr>")
+    figures = "".join(f'<p><img src="{esc(os.path.basename(p))}" alt="{esc(os.path.basename(p))}"></p>'
+                      for p in images)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Prompt Category Report</title>
+<style>
+body {{ font-family: sans-serif; }}
+table {{ border-collapse: collapse; font-size: 12px; }}
+th, td {{ border: 1px solid #ccc; padding: 2px 6px; text-align: right; }}
+tr th:first-child {{ text-align: left; }}
+img {{ max-width: 100%; }}
+</style></head><body>
+<h1>Prompt Category Report</h1>
+<p>{summary['model_count']:,} models, {summary['total']:,} category assignments.
+Top {shown_models(summary)} models and {len(summary['categories'])} categories shown;
+the rest are grouped as "{esc(OTHER_MODELS)}" / "{esc(OTHER_CATEGORY)}".
+Full per-model totals: <a href="model_totals.csv">model_totals.csv</a>.</p>
+{figures}
+<table><thead><tr><th>model</th><th>total</th>{head}</tr></thead>
+<tbody>
+{chr(10).join(body)}
+</tbody></table>
+</body></html>
+""")
+    return path
+
+
+def generate_report(db_path, out_dir, top_models=30, top_categories=15, models=None, normalize_percent=True,
+                    dpi=150):
+    """out_dir に分布図・件数図（PNG）、summary.csv / model_totals.csv、index.html を書く
+    {"models", "model_count", "files", "seconds"} を返す
+    """
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    # スキーマが古い DB（集計テーブルが無い）は読む前に1回だけマイグレーションする
+    conn = storage.open_readonly(db_path, storage.COLLECTOR_MIGRATIONS)
+    try:
+        summary = category_summary(conn, top_models=top_models, top_categories=top_categories, models=models)
+        if not summary["models"]:
+            print("[report] No category data found in DB. Run collection first.")
+            return {"models": 0, "model_count": 0, "files": [], "seconds": round(time.perf_counter() - started, 3)}
+        totals_path = os.path.join(out_dir, "model_totals.csv")
+        write_model_totals_csv(conn, totals_path)
+    finally:
+        conn.close()
+
+    images = [
+        render_distribution(summary, os.path.join(out_dir, "category_distribution.png"), normalize_percent, dpi),
+        render_totals(summary, os.path.join(out_dir, "model_totals.png"), dpi),
+    ]
+    files = images + [
+        write_summary_csv(summary, os.path.join(out_dir, "summary.csv")),
+        totals_path,
+        write_html(summary, os.path.join(out_dir, "index.html"), images, normalize_percent),
+    ]
+    result = {"models": shown_models(summary), "model_count": summary["model_count"], "files": files,
+              "seconds": round(time.perf_counter() - started, 3)}
+    print(f"[report] Wrote {len(files)} files to {out_dir} in {result['seconds']}s "
+          f"({result['models']} of {result['model_count']} models)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write category distribution charts and CSV/HTML summaries")
+    parser.add_argument("db")
+    parser.add_argument("out_dir")
+    parser.add_argument("--top-models", type=int, default=30)
+    parser.add_argument("--top-categories", type=int, default=15)
+    parser.add_argument("--models", nargs="*", default=None, help="表示するモデル名（指定順で並べる）")
+    parser.add_argument("--count", action="store_true", help="割合ではなく件数で表示する")
+    parser.add_argument("--dpi", type=int, default=150)
+    args = parser.parse_args()
+    generate_report(args.db, args.out_dir, top_models=args.top_models, top_categories=args.top_categories,
+                    models=args.models or None, normalize_percent=not args.count, dpi=args.dpi)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import threading
+
+import numpy as np
+
+import storage
+
+
+class AliasTable:
+    """Walker のエイリアス法。構築 O(n)、1回の抽選 O(1)（乱数2つと配列参照だけ）"""
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        if n == 0 or weights.sum() <= 0:
+            raise ValueError("weights must contain a positive value")
+        # 要素ごとのループは numpy のスカラー参照より Python のリストの方が速い
+        scaled = (weights * (n / weights.sum())).tolist()
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, g = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            (small if scaled[g] < 1.0 else large).append(g)
+        # 残りは丸め誤差分なので確率 1 のまま
+        self.prob = np.array(prob, dtype=np.float64)
+        self.alias = np.array(alias, dtype=np.int64)
+        self.size = n
+
+    def draw(self, rng, k=1):
+        """添字を k 個返す（numpy でまとめて引く）"""
+        idx = rng.integers(0, self.size, size=k)
+        keep = rng.random(k) < self.prob[idx]
+        return np.where(keep, idx, self.alias[idx])
+
+
+class PromptSampler:
+    """civitai_prompts から quality_score / reaction_count で重み付けしたランダム抽選をするメモリ上のサンプラー
+    - 行の id・重みと、カテゴリごとの行位置の配列をメモリに持つ
+    - カテゴリの組み合わせ（例: lighting + composition）ごとにエイリアス表を作ってキャッシュし、以後の抽選は O(1)
+    - refresh() は前回以降に追加・更新された行だけを読み足す（重みの変わった組み合わせの表は作り直し）
+      既存行のカテゴリが変わった場合（recategorize_all の後など）は PromptSampler を作り直す
+    weight_by: "quality_score" / "reaction_count"。重みは max(値, 0) + smoothing（0 点の行もわずかに出る）
+    """
+
+    WEIGHT_COLUMNS = ("quality_score", "reaction_count")
+
+    def __init__(self, db_path, weight_by="quality_score", smoothing=1.0, seed=None):
+        if weight_by not in self.WEIGHT_COLUMNS:
+            raise ValueError(f"weight_by must be one of {self.WEIGHT_COLUMNS}")
+        self.db_path = db_path
+        self.weight_by = weight_by
+        self.smoothing = smoothing
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._weights = np.zeros(0, dtype=np.float64)
+        self._position = {}                 # id -> 配列上の位置
+        self._members = {}                  # category -> 位置のリスト（追記のみ）
+        self._member_arrays = {}            # category -> np.ndarray（_members のキャッシュ）
+        self._tables = {}                   # frozenset(categories) -> (位置の配列, AliasTable)
+        self._last_id = 0
+        self._last_collected_at = ""
+        self.refresh()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def categories(self):
+        return sorted(self._members)
+
+    def _weight(self, values):
+        return np.maximum(np.asarray(values, dtype=np.float64), 0.0) + self.smoothing
+
+    def refresh(self):
+        """前回以降に追加された行（id）と更新された行（collected_at）を読み込む。読み込んだ行数を返す"""
+        conn = storage.connect(self.db_path, readonly=True)
+        try:
+            rows = conn.execute(
+                f"SELECT id, COALESCE({self.weight_by}, 0), COALESCE(collected_at, '') FROM civitai_prompts "
+                "WHERE id > ? OR collected_at > ? ORDER BY id",
+                (self._last_id, self._last_collected_at),
+            ).fetchall()
+            if not rows:
+                return 0
+            new_ids = [r[0] for r in rows if r[0] not in self._position]
+            categories = []
+            if new_ids:
+                categories = conn.execute(
+                    "SELECT prompt_id, category FROM prompt_categories WHERE prompt_id >= ? ORDER BY prompt_id",
+                    (new_ids[0],),
+                ).fetchall()
+        finally:
+            conn.close()
+
+        with self._lock:
+            updated = [(self._position[r[0]], r[1]) for r in rows if r[0] in self._position]
+            if updated:
+                positions, values = zip(*updated)
+                self._weights[list(positions)] = self._weight(values)
+
+            added = [r for r in rows if r[0] not in self._position]
+            if added:
+                start = len(self._ids)
+                self._ids = np.concatenate([self._ids, np.array([r[0] for r in added], dtype=np.int64)])
+                self._weights = np.concatenate([self._weights, self._weight([r[1] for r in added])])
+                for offset, r in enumerate(added):
+                    self._position[r[0]] = start + offset
+                for prompt_id, category in categories:
+                    position = self._position.get(prompt_id)
+                    if position is not None and position >= start:
+                        self._members.setdefault(category, []).append(position)
+                self._member_arrays.clear()
+
+            self._last_id = max(self._last_id, rows[-1][0])
+            self._last_collected_at = max([self._last_collected_at] + [r[2] for r in rows])
+            # 重みか所属が変わったので表は次の抽選時に作り直す
+            self._tables.clear()
+        return len(rows)
+
+    def _positions(self, categories):
+        """全カテゴリに属する行の位置（AND）。categories が空なら全行"""
+        if not categories:
+            return np.arange(len(self._ids))
+        result = None
+        for category in categories:
+            members = self._member_arrays.get(category)
+            if members is None:
+                members = np.array(sorted(self._members.get(category, [])), dtype=np.int64)
+                self._member_arrays[category] = members
+            result = members if result is None else np.intersect1d(result, members, assume_unique=True)
+        return result
+
+    def _table(self, categories):
+        key = frozenset(categories or ())
+        entry = self._tables.get(key)
+        if entry is None:
+            positions = self._positions(key)
+            table = AliasTable(self._weights[positions]) if len(positions) else None
+            entry = (positions, table)
+            self._tables[key] = entry
+        return entry
+
+    def sample_ids(self, k=1, categories=None):
+        """条件に合う id を重み付きで k 個（重複あり）返す。該当なしなら空配列"""
+        with self._lock:
+            positions, table = self._table(categories)
+            if table is None:
+                return np.zeros(0, dtype=np.int64)
+            return self._ids[positions[table.draw(self.rng, k)]]
+
+    def sample(self, k=1, categories=None):
+        """sample_ids の結果を (id, full_prompt, negative_prompt) のリストにして返す"""
+        ids = self.sample_ids(k, categories).tolist()
+        if not ids:
+            return []
+        conn = storage.connect(self.db_path, readonly=True)
+        try:
+            unique = sorted(set(ids))
+            placeholders = ", ".join("?" for _ in unique)
+            rows = {r[0]: r for r in conn.execute(
+                f"SELECT id, full_prompt, negative_prompt FROM civitai_prompts WHERE id IN ({placeholders})",
+                unique,
+            )}
+        finally:
+            conn.close()
+        return [rows[i] for i in ids if i in rows]
@@ -0,0 +1,321 @@
+import sqlite3
+
+import category_stats
+import fts_index
+import tags
+
+# 接続ごとの PRAGMA（journal_mode=WAL は DB ファイルに残るので書き込み可能な接続で1回切り替えれば良い）
+# - synchronous=NORMAL: WAL ではコミットごとの fsync を省いても DB は壊れない（電源断で直前のコミットが消えうるだけ）
+# - mmap_size: 読み込みをページキャッシュ経由のコピーではなく mmap で行う
+# - cache_size: 負の値は KiB 単位（-65536 = 64MB）
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -65536,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+
+def connect(db_path, readonly=False, wal=True, pragmas=None, **kwargs):
+    """DB 接続を作る唯一の入口。WAL と PRAGMAS を設定した接続を返す
+    readonly=True は mode=ro の URI で開き、書き込みを拒否する（PRAGMA query_only）
+    kwargs は sqlite3.connect にそのまま渡す（check_same_thread など）
+    """
+    # 同じ SQL 文の再利用（プリペアドステートメントのキャッシュ）を増やす
+    kwargs.setdefault("cached_statements", 256)
+    if readonly:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, **kwargs)
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn = sqlite3.connect(db_path, **kwargs)
+        if wal and db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+    for name, value in dict(PRAGMAS, **(pragmas or {})).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+# ─── スキーママイグレーション ───
+# DB は2種類ある: main.py / db_tool.py の prompts だけの DB と、CivitaiPromptCollector の DB
+# それぞれ自分のリスト（PROMPTS_MIGRATIONS / COLLECTOR_MIGRATIONS）だけを流し、相手のテーブルは作らない
+# PRAGMA user_version に適用済みの番号を持ち、それより新しいものだけを順に流す
+# 番号は2つのリストを通して増やす一方にする（どちらの DB でも user_version は単調に増える）
+# user_version は1つしかないので、2つのスキーマを同じファイルに同居させることは想定しない（既定のファイル名も別）
+# user_version を持たない既存 DB（0）にも全部流すので、各ステップは何度流しても同じ結果になるように書く
+
+
+def _add_columns(conn, table, columns):
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+
+def _migrate_prompts(conn):
+    """main.py / db_tool.py の prompts（カテゴリ列・FTS 索引付き）"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS prompts (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL
+    )
+    ''')
+    _add_columns(conn, "prompts", [("category", "TEXT")])
+    fts_index.setup_fts(conn, "prompts")
+
+
+def _migrate_civitai_prompts(conn):
+    """CivitaiPromptCollector のプロンプト・カテゴリ"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS civitai_prompts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        civitai_id TEXT UNIQUE,
+        full_prompt TEXT,
+        negative_prompt TEXT,
+        quality_score INTEGER,
+        reaction_count INTEGER,
+        comment_count INTEGER,
+        download_count INTEGER,
+        prompt_length INTEGER,
+        tag_count INTEGER,
+        model_name TEXT,
+        model_id TEXT,
+        collected_at TIMESTAMP,
+        raw_metadata TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS prompt_categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        prompt_id INTEGER,
+        category TEXT,
+        keywords TEXT,
+        confidence REAL,
+        FOREIGN KEY (prompt_id) REFERENCES civitai_prompts (id)
+    )
+    ''')
+
+
+def _migrate_raw_payloads(conn):
+    """変更検知用のハッシュ列と、圧縮した API 生データ（内容ハッシュで重複排除）"""
+    _add_columns(conn, "civitai_prompts", [("content_hash", "TEXT"), ("stats_hash", "TEXT"), ("raw_hash", "TEXT")])
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS raw_payloads (
+        hash TEXT PRIMARY KEY,
+        codec TEXT,
+        payload BLOB
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS raw_dictionaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dictionary BLOB
+    )
+    ''')
+
+
+def _migrate_collection_state(conn):
+    """収集のチェックポイント（モデル×ソートごとの nextPage カーソルと最大 civitai_id）"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS collection_state (
+        model_key TEXT,
+        sort TEXT,
+        next_page TEXT,
+        high_water_id INTEGER,
+        updated_at TIMESTAMP,
+        PRIMARY KEY (model_key, sort)
+    )
+    ''')
+
+
+def _migrate_civitai_fts(conn):
+    """full_prompt のキーワード検索用 FTS5 索引（トリガーで同期、初回は既存行を backfill）"""
+    fts_index.setup_fts(conn, "civitai_prompts")
+
+
+def _migrate_tags(conn):
+    """正規化タグの辞書と プロンプト×タグ（位置・重み付き）"""
+    tags.setup_tags(conn)
+
+
+def _migrate_clusters(conn):
+    """近似重複クラスタ（cluster_id 列と MinHash 署名・LSH バケット。中身は dedup.NearDuplicateIndex が書く）"""
+    _add_columns(conn, "civitai_prompts", [("cluster_id", "INTEGER")])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_civitai_prompts_cluster_id ON civitai_prompts (cluster_id)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS prompt_minhash (
+        prompt_id INTEGER PRIMARY KEY,
+        signature BLOB
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS lsh_buckets (
+        band INTEGER,
+        bucket INTEGER,
+        prompt_id INTEGER
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets (band, bucket)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lsh_buckets_prompt ON lsh_buckets (prompt_id)")
+
+
+def _migrate_unknown_model_label(conn):
+    """model_name が空文字の行も "Unknown" に数えるトリガーに入れ替え、集計テーブルを作り直す"""
+    category_stats.drop_triggers(conn)
+    category_stats.create_triggers(conn)
+    category_stats.rebuild_aggregates(conn, commit=False)
+
+
+def _migrate_bracket_tags(conn):
+    """括弧グループ (a, b:1.2) を展開する split_tags で prompt_tags を作り直す（旧版はグループ内のカンマで割っていた）"""
+    tags.backfill_tags(conn, rebuild=True)
+
+
+def _migrate_aggregates(conn):
+    """差分読み出し用の collected_at 索引と model_name × category の集計テーブル"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_civitai_prompts_collected_at ON civitai_prompts (collected_at, id)")
+    category_stats.setup_aggregates(conn)
+
+
+# (番号, 内容, 関数)。番号は2つのリストを通して増やす一方で、適用済みのステップは書き換えない
+PROMPTS_MIGRATIONS = [
+    (1, "prompts table", _migrate_prompts),
+]
+COLLECTOR_MIGRATIONS = [
+    (2, "civitai_prompts / prompt_categories", _migrate_civitai_prompts),
+    (3, "change hashes and raw_payloads", _migrate_raw_payloads),
+    (4, "collection_state", _migrate_collection_state),
+    (5, "civitai_prompts FTS index", _migrate_civitai_fts),
+    (6, "tags / prompt_tags", _migrate_tags),
+    (7, "near-duplicate clusters", _migrate_clusters),
+    (8, "collected_at index and category aggregates", _migrate_aggregates),
+    (9, "re-split prompt_tags with bracket groups", _migrate_bracket_tags),
+    (10, "count blank model_name as Unknown in category aggregates", _migrate_unknown_model_label),
+]
+SCHEMA_VERSION = max(PROMPTS_MIGRATIONS[-1][0], COLLECTOR_MIGRATIONS[-1][0])
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations):
+    """migrations（PROMPTS_MIGRATIONS / COLLECTOR_MIGRATIONS）の未適用分を順に流し、適用したステップ数を返す
+    最新なら何もしない
+    """
+    current = schema_version(conn)
+    applied = 0
+    for version, description, step in migrations:
+        if version <= current:
+            continue
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        print(f"[storage] Applied migration {version}: {description}")
+        applied += 1
+    return applied
+
+
+def open_database(db_path, migrations, **kwargs):
+    """connect して migrations でスキーマを最新にした書き込み用の接続を返す"""
+    conn = connect(db_path, **kwargs)
+    try:
+        migrate(conn, migrations)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def open_readonly(db_path, migrations, **kwargs):
+    """読み取り専用の接続を返す。スキーマが migrations より古ければ、先に1回だけ書き込み用の接続で流してから開き直す
+    （読むだけのコマンドを、マイグレーション前の DB に対して使った時に「no such table」で落ちないように）
+    DB ファイルが無い時は作らずに sqlite3.OperationalError
+    """
+    conn = connect(db_path, readonly=True, **kwargs)
+    if schema_version(conn) >= migrations[-1][0]:
+        return conn
+    conn.close()
+    open_database(db_path, migrations).close()
+    return connect(db_path, readonly=True, **kwargs)
+
+
+# ─── まとめて書き込む経路 ───
+# SQL は定数にして同じ文字列を使い回す（接続のステートメントキャッシュに載ったまま executemany で流す）
+
+INSERT_PROMPT = "INSERT OR IGNORE INTO prompts (id, text) VALUES (?, ?)"
+
+UPSERT_CIVITAI_PROMPT = '''
+INSERT INTO civitai_prompts
+(civitai_id, full_prompt, negative_prompt, quality_score,
+ reaction_count, comment_count, download_count, prompt_length, tag_count,
+ model_name, model_id, collected_at, raw_metadata, content_hash, stats_hash, raw_hash)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?)
+ON CONFLICT(civitai_id) DO UPDATE SET
+    full_prompt=excluded.full_prompt,
+    negative_prompt=excluded.negative_prompt,
+    quality_score=excluded.quality_score,
+    reaction_count=excluded.reaction_count,
+    comment_count=excluded.comment_count,
+    download_count=excluded.download_count,
+    prompt_length=excluded.prompt_length,
+    tag_count=excluded.tag_count,
+    model_name=excluded.model_name,
+    model_id=excluded.model_id,
+    collected_at=COALESCE(excluded.collected_at, civitai_prompts.collected_at),
+    raw_metadata=excluded.raw_metadata,
+    content_hash=excluded.content_hash,
+    stats_hash=excluded.stats_hash,
+    raw_hash=excluded.raw_hash,
+    cluster_id=CASE WHEN civitai_prompts.content_hash IS excluded.content_hash
+                    THEN civitai_prompts.cluster_id END
+'''
+
+UPDATE_PROMPT_STATS = '''
+UPDATE civitai_prompts SET
+    quality_score=?, reaction_count=?, comment_count=?, download_count=?,
+    stats_hash=?, collected_at=COALESCE(?, collected_at)
+WHERE id = ?
+'''
+
+INSERT_RAW_PAYLOAD = "INSERT OR IGNORE INTO raw_payloads (hash, codec, payload) VALUES (?, ?, ?)"
+
+INSERT_CATEGORY = "INSERT INTO prompt_categories (prompt_id, category, keywords, confidence) VALUES (?, ?, ?, ?)"
+
+
+def insert_prompts(conn, prompts):
+    """prompts に [{"id", "text"}, ...] を1トランザクションで入れる（既にある id は飛ばす）。追加した件数を返す"""
+    try:
+        # rowcount は OR IGNORE で飛ばした行と FTS トリガーの書き込みを含まない
+        inserted = conn.executemany(INSERT_PROMPT, [(p["id"], p["text"]) for p in prompts]).rowcount
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return inserted
+
+
+def upsert_civitai_prompts(conn, rows):
+    """UPSERT_CIVITAI_PROMPT の引数タプルをまとめて流す（コミットは呼び出し側）"""
+    conn.executemany(UPSERT_CIVITAI_PROMPT, rows)
+
+
+def update_prompt_stats(conn, rows):
+    """数値だけ変わった行の (quality_score, reaction_count, comment_count, download_count, stats_hash, collected_at, id)
+    collected_at が None の行は今の値を残す
+    """
+    conn.executemany(UPDATE_PROMPT_STATS, rows)
+
+
+def insert_raw_payloads(conn, rows):
+    conn.executemany(INSERT_RAW_PAYLOAD, rows)
+
+
+def replace_categories(conn, prompt_ids, rows):
+    """prompt_ids のカテゴリ行を消して rows（prompt_id, category, keywords, confidence）を入れ直す"""
+    conn.executemany("DELETE FROM prompt_categories WHERE prompt_id = ?", [(pid,) for pid in prompt_ids])
+    conn.executemany(INSERT_CATEGORY, rows)
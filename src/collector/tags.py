@@ -0,0 +1,225 @@
+import re
+
+# (tag:1.2) / ((tag)) / [tag] などの強調記法と、前後の空白・区切り
+_WEIGHTED = re.compile(r"^\((.*):\s*([-+]?\d*\.?\d+)\s*\)$")
+_BRACKETS = "()[]{}"
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_tag(tag):
+    """タグを正規化して (tag, weight) を返す。空なら (None, None)
+    - 小文字化・空白の詰め
+    - (tag:1.2) の重みを取り出し、((tag)) や [tag] の括弧を外す（括弧だけの強調は weight None）
+    """
+    tag = _SPACES.sub(" ", tag.strip().lower())
+    weight = None
+    m = _WEIGHTED.match(tag)
+    if m:
+        tag = m.group(1)
+        try:
+            weight = float(m.group(2))
+        except ValueError:
+            weight = None
+    tag = tag.strip(_BRACKETS + " ").strip()
+    if not tag:
+        return None, None
+    return tag, weight
+
+
+_OPENERS = {"(": ")", "[": "]", "{": "}"}
+
+
+def _split_top_level(text):
+    """括弧の外側にあるカンマだけで区切る
+    閉じ括弧が余っても深さは 0 で止め、開き括弧が閉じないまま終わった時は括弧を無視して全部のカンマで区切る
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for i, ch in enumerate(text):
+        if ch in _OPENERS:
+            depth += 1
+        elif ch in ")]}":
+            depth = max(depth - 1, 0)
+        elif ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    if depth:
+        return text.split(",")
+    parts.append(text[start:])
+    return parts
+
+
+def _unwrap_group(part):
+    """part 全体が1組の括弧で囲まれていれば (中身, weight) を返す。囲まれていなければ (None, None)
+    (a, b:1.2) は中身 "a, b" と weight 1.2、((a, b)) や [a, b] は括弧を1組外して weight None
+    """
+    if len(part) < 2 or part[0] not in _OPENERS or part[-1] != _OPENERS[part[0]]:
+        return None, None
+    depth = 0
+    for i, ch in enumerate(part):
+        if ch in _OPENERS:
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+            if depth == 0 and i != len(part) - 1:
+                return None, None  # (a), (b) のように途中で閉じている
+    m = _WEIGHTED.match(part)
+    if m:
+        try:
+            return m.group(1), float(m.group(2))
+        except ValueError:
+            pass
+    return part[1:-1], None
+
+
+def _group_tags(part, inherited):
+    """括弧グループを展開してタグを返す。グループの重みは中のタグに付ける（タグ自身の重みが優先）"""
+    part = part.strip()
+    inner, weight = _unwrap_group(part)
+    if inner is not None:
+        weight = weight if weight is not None else inherited
+        return [tag for piece in _split_top_level(inner) for tag in _group_tags(piece, weight)]
+    tag, weight = normalize_tag(part)
+    if not tag:
+        return []
+    return [(tag, weight if weight is not None else inherited)]
+
+
+def split_tags(prompt):
+    """プロンプトを正規化したタグのリスト [(tag, weight), ...] にして返す（空要素は除く）
+    括弧の中のカンマでは区切らず、(a, b:1.2) のようなグループは a・b それぞれに重み 1.2 を付けて展開する
+    """
+    result = []
+    for part in _split_top_level(prompt or ""):
+        result.extend(_group_tags(part, None))
+    return result
+
+
+def count_segments(prompt):
+    """カンマ区切りの空でない要素数（civitai_prompts.tag_count の値。括弧の中も含めて数える）"""
+    return len([s for s in (prompt or "").split(",") if s.strip()])
+
+
+def setup_tags(conn):
+    """タグ辞書（tags）と プロンプト×タグ（prompt_tags）のテーブル・索引を作る"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS prompt_tags (
+        prompt_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        weight REAL,
+        PRIMARY KEY (prompt_id, position)
+    ) WITHOUT ROWID
+    ''')
+    # 「タグ X を含むプロンプト」・頻度集計用（tag_id だけで引ける）
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_tags_tag ON prompt_tags (tag_id, prompt_id)")
+
+
+class TagInterner:
+    """タグ名 -> tags.id の対応をメモリにキャッシュしながら引く（無ければ tags に追加）"""
+
+    def __init__(self):
+        self._ids = {}
+
+    def intern(self, conn, names):
+        """names の各タグの id を dict で返す"""
+        missing = [n for n in set(names) if n not in self._ids]
+        if missing:
+            conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(n,) for n in missing])
+            chunk = 500
+            for i in range(0, len(missing), chunk):
+                part = missing[i:i + chunk]
+                placeholders = ",".join("?" * len(part))
+                self._ids.update(conn.execute(
+                    f"SELECT name, id FROM tags WHERE name IN ({placeholders})", part
+                ).fetchall())
+        return {n: self._ids[n] for n in names}
+
+    def clear(self):
+        """ロールバックした時など、DB と食い違ったキャッシュを捨てる"""
+        self._ids.clear()
+
+
+def write_prompt_tags(conn, interner, prompt_tags):
+    """{prompt_id: [(tag, weight), ...]} を prompt_tags に書く（そのプロンプトの既存行は置き換え）"""
+    if not prompt_tags:
+        return 0
+    conn.executemany("DELETE FROM prompt_tags WHERE prompt_id = ?", [(pid,) for pid in prompt_tags])
+    ids = interner.intern(conn, [tag for tags in prompt_tags.values() for tag, _ in tags])
+    rows = [
+        (pid, ids[tag], position, weight)
+        for pid, tags in prompt_tags.items()
+        for position, (tag, weight) in enumerate(tags)
+    ]
+    conn.executemany(
+        "INSERT OR REPLACE INTO prompt_tags (prompt_id, tag_id, position, weight) VALUES (?, ?, ?, ?)", rows
+    )
+    return len(rows)
+
+
+def backfill_tags(conn, interner=None, chunk_size=5000, rebuild=False):
+    """civitai_prompts の full_prompt から prompt_tags を作る（既存 DB 用）。処理したプロンプト数を返す
+    rebuild=False なら prompt_tags がまだ無い行だけ、True なら全行を作り直す
+    """
+    interner = interner or TagInterner()
+    if rebuild:
+        conn.execute("DELETE FROM prompt_tags")
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+        SELECT p.id, p.full_prompt FROM civitai_prompts p
+        WHERE p.id > ? AND NOT EXISTS (SELECT 1 FROM prompt_tags t WHERE t.prompt_id = p.id)
+        ORDER BY p.id LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        write_prompt_tags(conn, interner, {pid: split_tags(prompt) for pid, prompt in rows})
+        conn.commit()
+        total += len(rows)
+        print(f"[backfill_tags] {total} prompts")
+    conn.commit()
+    return total
+
+
+def tag_frequency(conn, limit=50):
+    """出現プロンプト数の多い順に [(tag, count), ...]"""
+    return conn.execute('''
+    SELECT t.name, f.cnt FROM (
+        SELECT tag_id, COUNT(DISTINCT prompt_id) AS cnt FROM prompt_tags GROUP BY tag_id
+    ) f JOIN tags t ON t.id = f.tag_id
+    ORDER BY f.cnt DESC, t.name LIMIT ?
+    ''', (limit,)).fetchall()
+
+
+def co_occurring_tags(conn, tag, limit=20):
+    """tag と同じプロンプトに出てくるタグを多い順に [(tag, count), ...]"""
+    tag, _ = normalize_tag(tag)
+    return conn.execute('''
+    SELECT t.name, COUNT(DISTINCT o.prompt_id) AS cnt
+    FROM tags x
+    JOIN prompt_tags s ON s.tag_id = x.id
+    JOIN prompt_tags o ON o.prompt_id = s.prompt_id AND o.tag_id != x.id
+    JOIN tags t ON t.id = o.tag_id
+    WHERE x.name = ?
+    GROUP BY o.tag_id ORDER BY cnt DESC, t.name LIMIT ?
+    ''', (tag, limit)).fetchall()
+
+
+def prompts_with_tag(conn, tag, limit=50, after_id=0):
+    """tag を含むプロンプトの id を id 順に（キーセットページング）"""
+    tag, _ = normalize_tag(tag)
+    return [r[0] for r in conn.execute('''
+    SELECT DISTINCT s.prompt_id FROM tags x
+    JOIN prompt_tags s ON s.tag_id = x.id
+    WHERE x.name = ? AND s.prompt_id > ?
+    ORDER BY s.prompt_id LIMIT ?
+    ''', (tag, after_id, limit))]
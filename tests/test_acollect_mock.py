@@ -0,0 +1,80 @@
+# test_acollect_mock.py
+# acollect_for_models を scripts/mock_civitai_server.py のモックサーバーに対して流す
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+pytest.importorskip("httpx")
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import start_server  # noqa: E402
+
+MODELS = {"Mock A": "11", "Mock B": "12"}
+
+
+@pytest.fixture
+def mock_server():
+    server, base_url = start_server(items_per_model=30)
+    yield base_url
+    server.shutdown()
+    server.server_close()
+
+
+def run_acollect(db_path, base_url, max_per_model=25, models=MODELS):
+    collector = CivitaiPromptCollector(db_path=db_path, base_url=base_url, batch_size=10)
+    collector.rate_limiter.base_backoff = collector.rate_limiter.max_backoff = 0.01
+    results = asyncio.run(collector.acollect_for_models(models, max_per_model=max_per_model, concurrency=2,
+                                                        rate_per_sec=50))
+    return collector, results
+
+
+def test_acollect_saves_every_model(tmp_path, mock_server):
+    db_path = str(tmp_path / "acollect.db")
+    collector, results = run_acollect(db_path, mock_server)
+
+    assert results == {name: {"collected": 25, "saved": 25, "aborted": False} for name in MODELS}
+    conn = sqlite3.connect(db_path)
+    try:
+        stored = conn.execute("SELECT COUNT(*) FROM civitai_prompts").fetchone()[0]
+    finally:
+        conn.close()
+    assert stored == 50
+    assert collector.write_stats["inserted"] == 50
+
+
+def test_acollect_counts_only_saved_rows(tmp_path, mock_server):
+    # 書き込みが全部失敗する DB では collected だけが増え、saved は 0 のまま
+    db_path = str(tmp_path / "broken.db")
+    CivitaiPromptCollector(db_path=db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TRIGGER reject_insert BEFORE INSERT ON civitai_prompts "
+                 "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    conn.commit()
+    conn.close()
+
+    _, results = run_acollect(db_path, mock_server)
+
+    assert results == {name: {"collected": 25, "saved": 0, "aborted": False} for name in MODELS}
+
+
+def test_acollect_marks_exhausted_retries_as_aborted(tmp_path):
+    # 1ページ目の後は 503 しか返さない: 取り切ったのではなく中断として返す
+    server, base_url = start_server(items_per_model=30, status_script=[200] + [503] * 10)
+    try:
+        _, results = run_acollect(str(tmp_path / "aborted.db"), base_url, models={"Mock A": "11"})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results == {"Mock A": {"collected": 20, "saved": 20, "aborted": True}}
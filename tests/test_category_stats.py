@@ -0,0 +1,43 @@
+# test_category_stats.py
+# model_category_stats（トリガーで同期する集計）と rebuild_aggregates の結果が同じになること
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+
+import category_stats  # noqa: E402
+import storage  # noqa: E402
+
+
+def make_db(tmp_path):
+    conn = storage.open_database(str(tmp_path / "stats.db"), storage.COLLECTOR_MIGRATIONS)
+    for civitai_id, model_name in (("1", "Model A"), ("2", ""), ("3", None)):
+        prompt_id = conn.execute("INSERT INTO civitai_prompts (civitai_id, model_name) VALUES (?, ?)",
+                                 (civitai_id, model_name)).lastrowid
+        conn.execute("INSERT INTO prompt_categories (prompt_id, category, keywords, confidence) "
+                     "VALUES (?, 'mood', '[]', 0.1)", (prompt_id,))
+    conn.commit()
+    return conn
+
+
+def test_blank_model_name_counts_as_unknown(tmp_path):
+    conn = make_db(tmp_path)
+    try:
+        expected = [("Model A", "mood", 1), (category_stats.UNKNOWN_MODEL, "mood", 2)]
+        assert category_stats.model_category_counts(conn) == expected
+        category_stats.rebuild_aggregates(conn)
+        assert category_stats.model_category_counts(conn) == expected
+
+        # 空文字から名前が付いた行は Unknown から移る
+        conn.execute("UPDATE civitai_prompts SET model_name = 'Model A' WHERE civitai_id = '2'")
+        conn.commit()
+        assert category_stats.model_category_counts(conn) == [
+            ("Model A", "mood", 2), (category_stats.UNKNOWN_MODEL, "mood", 1),
+        ]
+    finally:
+        conn.close()
@@ -0,0 +1,93 @@
+# test_collect_checkpoint.py
+# collect_dataset のチェックポイント（collection_state）を scripts/mock_civitai_server.py に対して確かめる
+# - max_items で打ち切った時はカーソルを残し、次の実行が続きを取る
+# - 4xx で止まった時は中断扱いにして、カーソルを消さない
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import start_server  # noqa: E402
+
+MODEL_ID = "21"
+ITEMS = 95
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_server(items_per_model=ITEMS, **kwargs)
+        servers.append(server)
+        return base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_collector(db_path, base_url):
+    collector = CivitaiPromptCollector(db_path=db_path, base_url=base_url, batch_size=10)
+    collector.rate_limiter.rate = collector.rate_limiter.max_rate = 50
+    return collector
+
+
+def collect(collector, **kwargs):
+    return collector.collect_dataset(model_id=MODEL_ID, model_name="Mock", num_workers=2, **kwargs)
+
+
+def count_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM civitai_prompts").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_max_items_keeps_cursor_for_new_since(tmp_path, server_factory):
+    db_path = str(tmp_path / "truncated.db")
+    collector = make_collector(db_path, server_factory())
+
+    first = collect(collector, max_items=30, new_since=True)
+    assert first["collected"] == 30 and not first["aborted"]
+    next_page, high_water = collector.get_collection_state(MODEL_ID, "Newest")
+    # 2ページ目の途中で切ったので、2ページ目から取り直す
+    assert next_page is not None and "cursor=20" in next_page
+    assert high_water is None
+
+    second = collect(collector, max_items=1000, new_since=True)
+    assert not second["aborted"]
+    assert count_rows(db_path) == ITEMS
+    next_page, high_water = collector.get_collection_state(MODEL_ID, "Newest")
+    assert next_page is None
+    assert high_water == int(MODEL_ID) * 1_000_000 + ITEMS - 1
+
+
+def test_client_error_aborts_and_keeps_cursor(tmp_path, server_factory):
+    db_path = str(tmp_path / "forbidden.db")
+    # 1ページ目は成功、2ページ目で 403
+    collector = make_collector(db_path, server_factory(status_script=[200, 403]))
+
+    first = collect(collector, max_items=1000)
+    assert first["aborted"]
+    assert count_rows(db_path) == 20
+    next_page, _ = collector.get_collection_state(MODEL_ID)
+    assert next_page is not None and "cursor=20" in next_page
+
+    second = collect(collector, max_items=1000)
+    assert not second["aborted"]
+    assert second["collected"] == ITEMS - 20
+    assert count_rows(db_path) == ITEMS
+    assert collector.get_collection_state(MODEL_ID) == (None, int(MODEL_ID) * 1_000_000 + ITEMS - 1)
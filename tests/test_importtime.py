@@ -0,0 +1,45 @@
+# test_importtime.py
+# 新しい DB への収集・検索の経路で重い依存（matplotlib / numpy / pyarrow）が読み込まれないことを
+# python -X importtime の子プロセスで確かめる（時間の計測は scripts/bench_importtime.py）
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from bench_importtime import run_importtime  # noqa: E402
+
+HEAVY = ("matplotlib", "numpy", "pyarrow")
+
+COLLECT_CODE = """
+import sys
+sys.path.insert(0, {scripts!r})
+from mock_civitai_server import start_server
+from civitai_collector_v8 import CivitaiPromptCollector
+server, base_url = start_server(items_per_model=25)
+collector = CivitaiPromptCollector(db_path={db!r}, base_url=base_url, batch_size=10)
+collector.rate_limiter.rate = collector.rate_limiter.max_rate = 50
+result = collector.collect_dataset(model_id="1", model_name="Mock", max_items=25)
+assert result["saved"] == 25, result
+assert collector.search_prompts("masterpiece, *") is not None
+collector.close()
+server.shutdown()
+server.server_close()
+"""
+
+
+def heavy_modules(modules):
+    return sorted({name.split(".")[0] for name in modules} & set(HEAVY))
+
+
+def test_collect_on_fresh_db_skips_heavy_imports(tmp_path):
+    code = COLLECT_CODE.format(scripts=os.path.abspath(SCRIPTS_DIR), db=str(tmp_path / "fresh.db"))
+    modules = run_importtime(code)
+    # 収集まで流れたこと（子プロセスの assert は check=True で失敗になる）
+    assert "civitai_collector_v8" in modules
+    assert heavy_modules(modules) == []
@@ -0,0 +1,71 @@
+# test_rate_limiter.py
+# AdaptiveRateLimiter を scripts/mock_civitai_server.py の台本（429 / 5xx）に対して動かす
+# - 429 の Retry-After の間は待ち、乗算的にレートを下げる
+# - 5xx はバックオフしてリトライし、その後の 200 でレートが戻る
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import start_server  # noqa: E402
+
+RETRY_AFTER = 0.5
+
+
+@pytest.fixture
+def scripted_server():
+    # 1ページ目は成功、2ページ目は 429 → 503 → 200、以降は 200
+    server, base_url = start_server(items_per_model=200, status_script=[200, 429, 503],
+                                    retry_after=str(RETRY_AFTER))
+    yield base_url
+    server.shutdown()
+    server.server_close()
+
+
+def test_backoff_retry_and_recovery(tmp_path, scripted_server):
+    collector = CivitaiPromptCollector(db_path=str(tmp_path / "limiter.db"), base_url=scripted_server)
+    limiter = collector.rate_limiter
+    limiter.rate = limiter.max_rate = 8.0
+    limiter.increase = 1.0
+    limiter.decrease = 0.5
+    limiter.base_backoff = 0.05
+
+    items, next_page = collector.fetch_batch({"limit": 20, "sort": "Newest"})
+    assert len(items) == 20 and next_page
+    assert limiter.current_rate == 8.0
+
+    started = time.monotonic()
+    items, next_page = collector.fetch_batch(next_page)
+    elapsed = time.monotonic() - started
+    assert len(items) == 20
+    # Retry-After の間は次のリクエストを送らない
+    assert elapsed >= RETRY_AFTER
+
+    snapshot = limiter.snapshot()
+    assert snapshot["requests"] == 4
+    assert snapshot["ok"] == 2
+    assert snapshot["rate_limited"] == 1
+    assert snapshot["errors"] == 1
+    assert snapshot["waited"] >= RETRY_AFTER
+    counters = collector.metrics.report()["counters"]
+    assert counters["rate_limited"] == 1
+    assert counters["server_errors"] == 1
+    # 429 で半分（8 -> 4）、503 で (1 + 0.5) / 2 倍（-> 3）、200 で +1
+    assert limiter.current_rate == pytest.approx(4.0)
+
+    # 以降の 200 で加算的に戻り、max_rate で頭打ちになる
+    for expected in (5.0, 6.0, 7.0, 8.0, 8.0):
+        items, next_page = collector.fetch_batch(next_page)
+        assert items
+        assert limiter.current_rate == pytest.approx(expected)
+    assert limiter.snapshot()["ok"] == 7
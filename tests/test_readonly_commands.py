@@ -0,0 +1,79 @@
+# test_readonly_commands.py
+# 読むだけのコマンド（search など）をマイグレーション前の DB（旧版が作った2テーブルだけの DB）に対して使う
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+
+import storage  # noqa: E402
+from civitai_collector_v8 import main  # noqa: E402
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """旧版の setup_database と同じ civitai_prompts / prompt_categories だけを持つ DB（user_version 0）"""
+    db_path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE civitai_prompts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, civitai_id TEXT UNIQUE, full_prompt TEXT, negative_prompt TEXT,
+        quality_score INTEGER, reaction_count INTEGER, comment_count INTEGER, download_count INTEGER,
+        prompt_length INTEGER, tag_count INTEGER, model_name TEXT, model_id TEXT, collected_at TIMESTAMP,
+        raw_metadata TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE prompt_categories (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, prompt_id INTEGER, category TEXT, keywords TEXT, confidence REAL
+    )
+    ''')
+    conn.execute("INSERT INTO civitai_prompts (civitai_id, full_prompt, model_name) "
+                 "VALUES ('1', 'masterpiece, dark', 'Legacy')")
+    conn.execute("INSERT INTO prompt_categories (prompt_id, category, keywords, confidence) "
+                 "VALUES (1, 'mood', '[\"dark\"]', 0.14)")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def test_search_migrates_legacy_db_once(legacy_db, capsys):
+    main(["--db", legacy_db, "search", "masterpiece"])
+
+    out = capsys.readouterr().out
+    assert "masterpiece, dark" in out
+    assert "Invalid search query" not in out
+    conn = sqlite3.connect(legacy_db)
+    try:
+        assert storage.schema_version(conn) == storage.COLLECTOR_MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+
+    # 2回目はマイグレーションしない
+    main(["--db", legacy_db, "search", "masterpiece"])
+    assert "Applied migration" not in capsys.readouterr().out
+
+
+def test_search_missing_db_exits_non_zero(tmp_path, capsys):
+    missing = str(tmp_path / "missing.db")
+    with pytest.raises(SystemExit) as exc:
+        main(["--db", missing, "search", "masterpiece"])
+    assert exc.value.code == 1
+    assert "[search]" in capsys.readouterr().out
+    assert not os.path.exists(missing)
+
+
+def test_report_migrates_legacy_db(legacy_db, tmp_path):
+    pytest.importorskip("matplotlib")
+    import report
+
+    result = report.generate_report(legacy_db, str(tmp_path / "report"))
+    assert result["models"] == 1
+    assert os.path.exists(os.path.join(str(tmp_path / "report"), "category_distribution.png"))
@@ -0,0 +1,76 @@
+# test_stream_fetch.py
+# stream_json=True の取得経路（fetch_batch_stream）を scripts/mock_civitai_server.py の台本に対して動かす
+# - 429 / 5xx の応答は閉じてからリトライし、リトライは max_retries 回までしか送らない
+# - ページごとのピーク（page_peak_rss_mb か page_peak_alloc_mb）が既定の設定でも入る
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from civitai_collector_v8 import CivitaiPromptCollector  # noqa: E402
+from mock_civitai_server import start_server  # noqa: E402
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_server(items_per_model=40, retry_after="0", **kwargs)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_collector(base_url, responses):
+    collector = CivitaiPromptCollector(base_url=base_url, stream_json=True, setup_db=False)
+    limiter = collector.rate_limiter
+    limiter.rate = limiter.max_rate = 50
+    limiter.base_backoff = limiter.max_backoff = 0.01
+    http_get = collector._http_get
+
+    def recording_get(url_or_params, stream=False):
+        response = http_get(url_or_params, stream=stream)
+        responses.append(response)
+        return response
+
+    collector._http_get = recording_get
+    return collector
+
+
+def test_stream_retries_close_responses_and_report_page_peak(server_factory):
+    _, base_url = server_factory(status_script=[429, 503])
+    responses = []
+    collector = make_collector(base_url, responses)
+
+    pairs, next_page = collector.fetch_batch_stream({"limit": 20})
+    assert len(pairs) == 20 and next_page
+    assert [r.status_code for r in responses] == [429, 503, 200]
+    assert all(r.raw.closed for r in responses)
+    stats = collector.last_page_stats
+    assert stats["items"] == 20
+    assert stats["page_peak_rss_mb"] is not None or stats["page_peak_alloc_mb"] is not None
+
+
+def test_stream_retry_budget_is_not_nested(server_factory):
+    server, base_url = server_factory(status_script=[503] * 50)
+    responses = []
+    collector = make_collector(base_url, responses)
+
+    with pytest.raises(requests.exceptions.RetryError):
+        collector.fetch_batch_stream({"limit": 20}, max_retries=3)
+    assert server.RequestHandlerClass._request_count == 3
+    assert all(r.raw.closed for r in responses)
@@ -0,0 +1,36 @@
+# test_tags.py
+# split_tags の括弧グループの扱いと tag_count 用の count_segments
+#
+# 使い方:
+#   python -m pytest -q tests
+
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src", "collector"))
+
+import tags  # noqa: E402
+
+
+def test_split_tags_expands_weighted_group():
+    assert tags.split_tags("masterpiece, (a, b:1.2), ((c)), [d]") == [
+        ("masterpiece", None), ("a", 1.2), ("b", 1.2), ("c", None), ("d", None),
+    ]
+
+
+def test_split_tags_inner_weight_wins():
+    assert tags.split_tags("((x, (y:1.5), z:1.1)), w") == [
+        ("x", 1.1), ("y", 1.5), ("z", 1.1), ("w", None),
+    ]
+
+
+def test_split_tags_unbalanced_brackets():
+    assert tags.split_tags("(a, b") == [("a", None), ("b", None)]
+    assert tags.split_tags("a), b") == [("a", None), ("b", None)]
+
+
+def test_count_segments_keeps_comma_count():
+    prompt = "masterpiece, (a, b:1.2), , ()"
+    assert tags.count_segments(prompt) == 4
+    assert len(tags.split_tags(prompt)) == 3